@@ -32,6 +32,18 @@ asynSetTraceIOMask("L0",-1,0x2)
 
 ## Load record instances
 dbLoadRecords("db/devKeithley2290.db","P=KHLY2290:,PORT=L0")
+## Waveform capture, only answered by the emulator
+#dbLoadRecords("db/devKeithley2290Waveform.db","P=KHLY2290:,PORT=L0")
+## Batched poll of the readbacks, only answered by the emulator
+#dbLoadRecords("db/devKeithley2290Snapshot.db","P=KHLY2290:,PORT=L0")
+
+## Several units instead, e.g. four devices of the emulator's multi-device host:
+##     python -m lewis_emulators.keithley_2290.host --devices 4 --port 57000
+#iocshLoad("iocBoot/${IOC}/unit.cmd", "PORT=L1,ADDRESS=localhost:57000")
+#iocshLoad("iocBoot/${IOC}/unit.cmd", "PORT=L2,ADDRESS=localhost:57001")
+#iocshLoad("iocBoot/${IOC}/unit.cmd", "PORT=L3,ADDRESS=localhost:57002")
+#iocshLoad("iocBoot/${IOC}/unit.cmd", "PORT=L4,ADDRESS=localhost:57003")
+#dbLoadTemplate("iocBoot/${IOC}/keithley2290Units.substitutions")
 
 cd ${TOP}/iocBoot/${IOC}
 iocInit()
@@ -0,0 +1,6 @@
+## Configures the asyn port of one unit of keithley2290Units.substitutions, on TCP, e.g.
+##     iocshLoad("iocBoot/${IOC}/unit.cmd", "PORT=L1,ADDRESS=localhost:57000")
+
+drvAsynIPPortConfigure("$(PORT)","$(ADDRESS)")
+asynOctetSetInputEos("$(PORT)", -1, "\n")
+asynOctetSetOutputEos("$(PORT)", -1, "\n")
@@ -0,0 +1,376 @@
+##################################################
+#
+# Benchmark File
+#
+# In-process benchmarks of the Keithley 2290 emulator
+# Run from the system_tests directory, e.g.
+#     python -m benchmarks.keithley_2290 batched
+#
+##################################################
+
+import argparse
+import asyncio
+import functools
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from lewis_emulators.keithley_2290 import SimulatedKeithley2290
+from lewis_emulators.keithley_2290.host import DeviceHost
+from lewis_emulators.keithley_2290.interfaces import Keithley2290StreamInterface
+from lewis_emulators.keithley_2290.interfaces.dispatcher import AnyRequest, MnemonicMatcher
+
+_SYSTEM_TESTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+# Readbacks queried by the poll_snapshot protocol, one command each
+POLLED_COMMANDS = ["VOUT?", "VLIM?", "IOUT?", "ILIM?", "ITRP?", "TMOD?", "LERR?", "*STB?"]
+
+# The same commands in a single line, as poll_snapshot sends them
+BATCHED_POLL = ";".join(POLLED_COMMANDS)
+
+# Commands sent on start up, by the event scanned records and by setpoint writes
+OTHER_COMMANDS = ["*IDN?", "*STB? 7", "*ESR? 4", "VSET 0", "VLIM 10000", "TMOD 0", "HVOF"]
+
+
+def _create_interface():
+    interface = Keithley2290StreamInterface()
+    interface.device = SimulatedKeithley2290()
+    return interface
+
+
+def _process(interface, request, bound_commands=None):
+    """
+    Processes a request the same way as the Lewis stream handler does.
+    """
+    request = request.encode()
+    if bound_commands is None:
+        bound_commands = interface.bound_commands
+    cmd = next((cmd for cmd in bound_commands if cmd.can_process(request)), None)
+    if cmd is None:
+        raise RuntimeError("None of the device's commands matched {}.".format(request))
+    return cmd.process_request(request)
+
+
+def _process_all(interface, requests, bound_commands=None):
+    for request in requests:
+        _process(interface, request, bound_commands)
+
+
+def _process_devices(devices, delta):
+    for device in devices:
+        device.process(delta)
+
+
+def _rate(func, duration):
+    """
+    Calls func repeatedly for duration seconds and returns the calls per second.
+    """
+    calls = 0
+    start = time.perf_counter()
+    end = start + duration
+    while time.perf_counter() < end:
+        func()
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def benchmark_batched(duration):
+    """
+    Compares polling every scanned value with one command each against one batched command.
+    """
+    interface = _create_interface()
+
+    def per_record_poll():
+        for command in POLLED_COMMANDS:
+            _process(interface, command)
+
+    def batched_poll():
+        _process(interface, BATCHED_POLL)
+
+    for name, poll, round_trips in (
+        ("per-record", per_record_poll, len(POLLED_COMMANDS)),
+        ("batched", batched_poll, 1),
+    ):
+        polls_per_second = _rate(poll, duration)
+        print(
+            "{:<12} {:>10.0f} polls/s {:>10.0f} readbacks/s {:>10.0f} lines/s "
+            "{:>3} round trips/poll".format(
+                name,
+                polls_per_second,
+                polls_per_second * len(POLLED_COMMANDS),
+                polls_per_second * round_trips,
+                round_trips,
+            )
+        )
+
+
+def benchmark_dispatch(duration):
+    """
+    Compares finding the command for each request by trying every pattern in turn against
+    looking it up by its mnemonic.
+    """
+    interface = _create_interface()
+    regex_commands = [
+        cmd
+        for cmd in interface.bound_commands
+        if not isinstance(cmd.matcher, (MnemonicMatcher, AnyRequest))
+    ]
+    requests = POLLED_COMMANDS + OTHER_COMMANDS
+
+    for name, bound_commands in (
+        ("regex scan", regex_commands),
+        ("mnemonic", interface.bound_commands),
+    ):
+        lines_per_second = _rate(
+            functools.partial(_process_all, interface, requests, bound_commands), duration
+        ) * len(requests)
+        print("{:<12} {:>10.0f} lines/s".format(name, lines_per_second))
+
+
+def benchmark_metrics(duration):
+    """
+    Measures the cost of counting and timing every command.
+    """
+    interface = _create_interface()
+    requests = POLLED_COMMANDS + OTHER_COMMANDS
+
+    for name, enabled in (("disabled", False), ("enabled", True)):
+        if enabled:
+            interface.device.enable_command_metrics()
+        lines_per_second = _rate(
+            functools.partial(_process_all, interface, requests), duration
+        ) * len(requests)
+        print("{:<12} {:>10.0f} lines/s".format(name, lines_per_second))
+
+
+async def _start_host_and_query(device_count, port):
+    """
+    Starts a host and waits for every device to answer *IDN?.
+    """
+    host = DeviceHost(device_count, port)
+    await host.start()
+    try:
+        for index in range(device_count):
+            reader, writer = await asyncio.open_connection(host.bind_address, port + index)
+            writer.write(b"*IDN?\n")
+            await reader.readline()
+            writer.close()
+            await writer.wait_closed()
+    finally:
+        await host.stop()
+
+
+def benchmark_host(duration, device_counts=(1, 10, 100), port=57000):
+    """
+    Measures the memory used per hosted device and the time from creating a multi-device host
+    to every device having answered its first *IDN?.
+    """
+    for device_count in device_counts:
+        tracemalloc.start()
+        DeviceHost(device_count, port)
+        memory, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        start = time.perf_counter()
+        asyncio.run(_start_host_and_query(device_count, port))
+        startup = time.perf_counter() - start
+
+        print(
+            "{:>4} devices {:>8.1f} kB/device {:>8.1f} ms to first replies".format(
+                device_count, memory / device_count / 1024, startup * 1000
+            )
+        )
+
+
+def benchmark_cycle(duration, device_counts=(1, 10, 100, 1000), cycle_delay=0.001):
+    """
+    Measures the cost of a device cycle while every device is ramping its output, which should
+    stay flat as the number of devices grows.
+    """
+    for device_count in device_counts:
+        devices = []
+        for _ in range(device_count):
+            device = SimulatedKeithley2290()
+            device.ramp_rate = 1.0
+            device.load_resistance = 1e7
+            device.volt = 10000.0
+            device.process(cycle_delay)
+            devices.append(device)
+
+        cycles_per_second = _rate(
+            functools.partial(_process_devices, devices, cycle_delay), duration
+        )
+        print(
+            "{:>5} devices {:>10.0f} cycles/s {:>8.2f} us/device-tick".format(
+                device_count,
+                cycles_per_second,
+                1e6 / (cycles_per_second * device_count),
+            )
+        )
+
+
+def benchmark_fleet(duration, channel_counts=(1, 10, 100, 1000, 10000), cycle_delay=0.001):
+    """
+    Compares stepping the channels of a fleet together against stepping the same number of
+    separate devices, with every channel ramping its output into a load.
+    """
+    from lewis_emulators.keithley_2290.fleet import Fleet
+
+    try:
+        Fleet(1)
+    except ImportError as error:
+        print("Skipped, the fleet needs NumPy: {}".format(error))
+        return
+
+    for channel_count in channel_counts:
+        fleet = Fleet(channel_count)
+        devices = [SimulatedKeithley2290() for _ in range(channel_count)]
+        for device in devices + fleet.channels:
+            device.ramp_rate = 1.0
+            device.load_resistance = 1e7
+            device.volt = 10000.0
+
+        for name, process in (
+            ("devices", functools.partial(_process_devices, devices, cycle_delay)),
+            ("fleet", functools.partial(fleet.process, cycle_delay)),
+        ):
+            ticks_per_second = _rate(process, duration) * channel_count
+            print(
+                "{:>6} channels {:<8} {:>12.0f} channel-ticks/s".format(
+                    channel_count, name, ticks_per_second
+                )
+            )
+
+
+def benchmark_waveform(duration, size=1000):
+    """
+    Compares reading a full capture buffer with one WAVE? against reading the same number of
+    current samples with IOUT?, one request each.
+    """
+    interface = _create_interface()
+    interface.device.enable_capture(size=size)
+    interface.device.run_for(size / interface.device.capture_rate)
+
+    for name, request, samples in (("IOUT?", "IOUT?", 1), ("WAVE?", "WAVE?", size)):
+        requests_per_second = _rate(functools.partial(_process, interface, request), duration)
+        print(
+            "{:<8} {:>10.0f} requests/s {:>12.0f} samples/s {:>6.0f} round trips".format(
+                name, requests_per_second, requests_per_second * samples, size / samples
+            )
+        )
+
+
+# Run in a fresh interpreter to time the emulator's own start up, without Lewis' discovery
+_STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+from lewis_emulators.keithley_2290 import SimulatedKeithley2290
+from lewis_emulators.keithley_2290.interfaces import Keithley2290StreamInterface
+imported = time.perf_counter()
+interface = Keithley2290StreamInterface()
+interface.device = SimulatedKeithley2290()
+bound = time.perf_counter()
+print(imported - start, bound - imported)
+"""
+
+
+def _first_idn_reply(command, port, timeout=30.0):
+    """
+    Starts an emulator process and returns the time from starting it to its first *IDN? reply.
+    """
+    start = time.perf_counter()
+    emulator = subprocess.Popen(
+        command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=_SYSTEM_TESTS_DIR
+    )
+    try:
+        while True:
+            try:
+                with socket.create_connection(("127.0.0.1", port), 1) as client:
+                    client.sendall(b"*IDN?\n")
+                    if client.makefile("rb").readline():
+                        return time.perf_counter() - start
+            except OSError:
+                pass
+            if emulator.poll() is not None or time.perf_counter() - start > timeout:
+                raise RuntimeError("Emulator did not answer *IDN?")
+            time.sleep(0.001)
+    finally:
+        emulator.terminate()
+        emulator.wait()
+
+
+def benchmark_startup(duration, port=57000, runs=5):
+    """
+    Measures the time from starting a Lewis process to the emulator's first *IDN? reply, and how
+    much of it the emulator's imports and the binding of its interface take.
+    """
+    lewis = [
+        sys.executable,
+        "-m",
+        "lewis",
+        "-a",
+        _SYSTEM_TESTS_DIR,
+        "-k",
+        "lewis_emulators",
+        "keithley_2290",
+        "-p",
+        "stream: {{bind_address: 127.0.0.1, port: {}}}".format(port),
+    ]
+    first_replies = [_first_idn_reply(lewis, port) for _ in range(runs)]
+
+    imports = []
+    binds = []
+    for _ in range(runs):
+        output = subprocess.check_output(
+            [sys.executable, "-c", _STARTUP_SCRIPT], cwd=_SYSTEM_TESTS_DIR
+        )
+        imported, bound = (float(value) for value in output.split())
+        imports.append(imported)
+        binds.append(bound)
+
+    for name, times in (
+        ("lewis to first *IDN?", first_replies),
+        ("imports", imports),
+        ("interface binding", binds),
+    ):
+        print(
+            "{:<22} {:>8.1f} ms median {:>8.1f} ms min".format(
+                name, statistics.median(times) * 1000, min(times) * 1000
+            )
+        )
+
+
+BENCHMARKS = {
+    "batched": benchmark_batched,
+    "cycle": benchmark_cycle,
+    "dispatch": benchmark_dispatch,
+    "fleet": benchmark_fleet,
+    "host": benchmark_host,
+    "metrics": benchmark_metrics,
+    "startup": benchmark_startup,
+    "waveform": benchmark_waveform,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keithley 2290 emulator benchmarks")
+    parser.add_argument(
+        "benchmarks", nargs="*", help="Benchmarks to run: {}".format(", ".join(sorted(BENCHMARKS)))
+    )
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds per measurement")
+    args = parser.parse_args()
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: {}".format(", ".join(sorted(unknown))))
+
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        print("== {}".format(name))
+        BENCHMARKS[name](args.duration)
+
+
+if __name__ == "__main__":
+    main()
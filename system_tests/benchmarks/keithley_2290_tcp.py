@@ -0,0 +1,331 @@
+##################################################
+#
+# Benchmark File
+#
+# Throughput and latency of the Keithley 2290 emulator over TCP, replaying the
+# commands that the IOC's scanned records send, at the ratio of their SCAN rates.
+# Run from the system_tests directory, e.g.
+#     python -m benchmarks.keithley_2290_tcp --devices 1,10 --connections 1,10,100
+#
+# By default a multi-device host is started in a separate process for each device
+# count, which answers with the asyncio stream server. --server stream starts one
+# Lewis process per device instead, using Lewis' own stream adapter, and --server
+# asyncio_stream one using the emulator's asyncio adapter, to compare them. Use
+# --address and --port to measure an emulator that is already running, in which
+# case --devices is the number of consecutive ports to spread the connections over.
+#
+# Prints one JSON object per measurement, or writes them to --output as JSON lines.
+#
+# The host can inject faults to measure the throughput lost over a degraded link, e.g.
+#     --fault drop:0.01 --fault delay:0.05:0.9
+#
+##################################################
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import time
+from fractions import Fraction
+from functools import reduce
+from math import gcd
+
+SUPPORT_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir, "Keithley_2290Sup"
+)
+DB_FILE = os.path.join(SUPPORT_DIR, "devKeithley2290.db")
+PROTOCOL_FILE = os.path.join(SUPPORT_DIR, "devKeithley2290.proto")
+
+_RECORD = re.compile(r"record\(\s*\w+\s*,\s*\"([^\"]*)\"\s*\)\s*\{(.*?)\n\}", re.DOTALL)
+_FIELD = re.compile(r"field\(\s*(\w+)\s*,\s*\"([^\"]*)\"\s*\)")
+_PROTOCOL = re.compile(r"^(\w+)\s*\{\s*out\s+\"([^\"]*)\"\s*;", re.MULTILINE)
+_PERIODIC_SCAN = re.compile(r"^([0-9.]+) second$")
+_MACRO_DEFAULT = re.compile(r"\$\(\w+=([^)]*)\)")
+
+# Links that process the record they point to, in the order that they are processed
+_PROCESSING_LINKS = ("OUT", "LNK1", "LNK2", "LNK3", "LNK4", "LNK5", "LNK6", "FLNK")
+
+
+def _processed(records, name, seen=None):
+    """
+    Yields the names of the records processed by a record through its forward links, the links
+    of a fanout and the output of a calcout that writes to a PROC field every time, in order.
+    """
+    if seen is None:
+        seen = {name}
+    fields = dict(_FIELD.findall(records.get(name, "")))
+    for field in _PROCESSING_LINKS:
+        link = fields.get(field)
+        if link is None:
+            continue
+        target = link.split()[0].replace("$(P)", "")
+        if field == "OUT" and (
+            not target.endswith(".PROC") or fields.get("OOPT", "Every Time") != "Every Time"
+        ):
+            continue
+        target = target.split(".")[0]
+        if target in seen:
+            continue
+        seen.add(target)
+        yield target
+        for processed in _processed(records, target, seen):
+            yield processed
+
+
+def load_command_mix(db_file=DB_FILE, protocol_file=PROTOCOL_FILE):
+    """
+    Finds the commands sent by the periodically scanned stream records, and by the stream records
+    that they process, and how often each is sent. Records whose scan is changed at run time are
+    counted at the scan in the database, and macros at their defaults.
+
+    :return: A list of (command, requests per second) pairs, in the order of the records.
+    """
+    with open(protocol_file) as protocols:
+        commands = dict(_PROTOCOL.findall(protocols.read()))
+    with open(db_file) as db:
+        records = {name.replace("$(P)", ""): record for name, record in _RECORD.findall(db.read())}
+
+    mix = []
+    for name, record in records.items():
+        scan = _PERIODIC_SCAN.match(
+            _MACRO_DEFAULT.sub(r"\1", dict(_FIELD.findall(record)).get("SCAN", ""))
+        )
+        if scan is None:
+            continue
+        for processed in [name] + list(_processed(records, name)):
+            fields = dict(_FIELD.findall(records.get(processed, "")))
+            if fields.get("DTYP") == "stream":
+                protocol = fields["INP"].split()[1]
+                mix.append((commands[protocol], 1 / float(scan.group(1))))
+    return mix
+
+
+def _command_cycle(mix):
+    """
+    Repeats each command of the mix in proportion to its rate, so that sending the cycle over
+    and over gives the same ratio of commands as the IOC.
+    """
+    rates = [Fraction(rate).limit_denominator(100) for _, rate in mix]
+    denominator = reduce(lambda a, b: a * b // gcd(a, b), (rate.denominator for rate in rates))
+    counts = [int(rate * denominator) for rate in rates]
+    divisor = reduce(gcd, counts)
+    cycle = []
+    for (command, _), count in zip(mix, counts):
+        cycle.extend([command.encode() + b"\n"] * (count // divisor))
+    return cycle
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def _client(address, port, cycle, deadline, latencies, errors):
+    """
+    Sends the command cycle over and over, one request at a time like a StreamDevice port,
+    until the deadline and records the latency of every reply.
+    """
+    reader, writer = await asyncio.open_connection(address, port)
+    try:
+        while True:
+            for request in cycle:
+                start = time.perf_counter()
+                writer.write(request)
+                try:
+                    await asyncio.wait_for(reader.readline(), 1.0)
+                except asyncio.TimeoutError:
+                    errors.append(request)
+                    continue
+                except ConnectionError:
+                    # The emulator dropped the connection, e.g. one more than it can serve
+                    errors.append(request)
+                    return
+                end = time.perf_counter()
+                latencies.append(end - start)
+                if end >= deadline:
+                    return
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+
+async def _measure(address, port, device_count, connection_count, cycle, duration):
+    latencies = []
+    errors = []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            _client(
+                address, port + index % device_count, cycle, start + duration, latencies, errors
+            )
+            for index in range(connection_count)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "devices": device_count,
+        "connections": connection_count,
+        "duration": elapsed,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "requests_per_second": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+    }
+
+
+def _wait_for_port(processes, port):
+    deadline = time.monotonic() + 30
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+            return
+        except OSError:
+            if any(process.poll() is not None for process in processes):
+                raise RuntimeError("Emulator exited before listening on port {}".format(port))
+            if time.monotonic() > deadline:
+                raise RuntimeError("Emulator did not listen on port {}".format(port))
+            time.sleep(0.1)
+
+
+def _start_emulators(server, device_count, port, cycle_delay, faults):
+    """
+    Starts the emulators in separate processes and waits until every device accepts
+    connections.
+
+    :return: The emulator processes.
+    """
+    system_tests_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+    if server != "host":
+        commands = [
+            [
+                "lewis",
+                "-a",
+                system_tests_dir,
+                "-k",
+                "lewis_emulators",
+                "keithley_2290",
+                "-p",
+                "{}: {{bind_address: 127.0.0.1, port: {}}}".format(server, port + index),
+                "-c",
+                str(cycle_delay),
+            ]
+            for index in range(device_count)
+        ]
+    else:
+        commands = [
+            [
+                sys.executable,
+                "-m",
+                "lewis_emulators.keithley_2290.host",
+                "--devices",
+                str(device_count),
+                "--port",
+                str(port),
+                "--cycle-delay",
+                str(cycle_delay),
+            ]
+            + [argument for fault in faults for argument in ("--fault", fault)]
+        ]
+
+    processes = [
+        subprocess.Popen(command, cwd=system_tests_dir, stderr=subprocess.DEVNULL)
+        for command in commands
+    ]
+    try:
+        for index in range(device_count):
+            _wait_for_port(processes, port + index)
+    except RuntimeError:
+        _stop_emulators(processes)
+        raise
+    return processes
+
+
+def _stop_emulators(processes):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        process.wait()
+
+
+def _counts(value):
+    return [int(count) for count in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keithley 2290 emulator TCP benchmark")
+    parser.add_argument("--devices", type=_counts, default=[1], help="Comma-separated counts")
+    parser.add_argument(
+        "--connections", type=_counts, default=[1, 10, 100], help="Comma-separated counts"
+    )
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per measurement")
+    parser.add_argument(
+        "--server",
+        choices=("host", "stream", "asyncio_stream"),
+        default="host",
+        help="Emulator to start, the host or Lewis with the given protocol",
+    )
+    parser.add_argument("--address", default=None, help="Address of an emulator already running")
+    parser.add_argument("--port", type=int, default=57000, help="Port of the first device")
+    parser.add_argument("--cycle-delay", type=float, default=0.1, help="Cycle delay of the host")
+    parser.add_argument("--output", default=None, help="File to append JSON lines to")
+    parser.add_argument(
+        "--fault",
+        action="append",
+        default=[],
+        help="Fault for the host to inject, as kind:probability[:delay]",
+    )
+    args = parser.parse_args()
+
+    mix = load_command_mix()
+    cycle = _command_cycle(mix)
+    environment = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mix": {command: rate for command, rate in mix},
+        "faults": args.fault,
+        "server": args.server if args.address is None else args.address,
+    }
+
+    output = sys.stdout if args.output is None else open(args.output, "a")
+    try:
+        for device_count in args.devices:
+            emulators = []
+            if args.address is None:
+                emulators = _start_emulators(
+                    args.server, device_count, args.port, args.cycle_delay, args.fault
+                )
+            try:
+                for connection_count in args.connections:
+                    result = asyncio.run(
+                        _measure(
+                            args.address or "127.0.0.1",
+                            args.port,
+                            device_count,
+                            connection_count,
+                            cycle,
+                            args.duration,
+                        )
+                    )
+                    result.update(environment)
+                    output.write(json.dumps(result, sort_keys=True) + "\n")
+                    output.flush()
+            finally:
+                _stop_emulators(emulators)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
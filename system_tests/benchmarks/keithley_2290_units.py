@@ -0,0 +1,164 @@
+##################################################
+#
+# Benchmark File
+#
+# Polling of many Keithley 2290 units on one IOC, as loaded from
+# keithley2290Units.substitutions, against the emulator's multi-device host. Each unit
+# has a connection of its own, like its asyn port, and sends the commands of the idle
+# poll one at a time once a period, either all at the start of the period (lockstep)
+# or at phases spread evenly over it (staggered). Run from the system_tests directory, e.g.
+#     python -m benchmarks.keithley_2290_units --units 10,100 --duration 10
+#
+# Measures the latency of each poll, from when it was due to its last reply, and the
+# CPU used by the host, which is read from /proc and so only measured on Linux.
+#
+# Prints one JSON object per measurement, or writes them to --output as JSON lines.
+#
+##################################################
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+
+from .keithley_2290_tcp import (
+    _counts,
+    _percentile,
+    _start_emulators,
+    _stop_emulators,
+    load_command_mix,
+)
+
+MODES = ("lockstep", "staggered")
+
+
+def _cpu_seconds(pid):
+    """
+    :return: The user and system CPU time used by a process so far, or None if it can't be read.
+    """
+    try:
+        with open("/proc/{}/stat".format(pid)) as stat:
+            # After the command name, which may contain spaces, utime and stime are fields 12-13
+            fields = stat.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def phases(unit_count, period, mode):
+    """
+    :return: The phase of each unit's poll in seconds into the period, as POLL_PHASE would be set.
+    """
+    if mode == "lockstep":
+        return [0.0] * unit_count
+    return [unit * period / unit_count for unit in range(unit_count)]
+
+
+async def _unit(address, port, poll, start, phase, period, deadline, latencies):
+    """
+    Sends the poll once a period at its phase, one request at a time like a StreamDevice port,
+    until the deadline and records the latency of each poll.
+    """
+    reader, writer = await asyncio.open_connection(address, port)
+    try:
+        due = start + phase
+        while due < deadline:
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+            for request in poll:
+                writer.write(request)
+                await reader.readline()
+            latencies.append(time.perf_counter() - due)
+            due += period
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+
+async def _measure(address, port, poll, unit_phases, period, duration, host_pid):
+    latencies = []
+    # Starting a moment from now, so that every unit is connected before the first poll is due
+    start = time.perf_counter() + 0.5
+    cpu_start = None if host_pid is None else _cpu_seconds(host_pid)
+    await asyncio.gather(
+        *(
+            _unit(address, port + index, poll, start, phase, period, start + duration, latencies)
+            for index, phase in enumerate(unit_phases)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    cpu_end = None if host_pid is None else _cpu_seconds(host_pid)
+
+    latencies.sort()
+    host_cpu = None
+    if cpu_start is not None and cpu_end is not None:
+        host_cpu = (cpu_end - cpu_start) / elapsed
+    return {
+        "units": len(unit_phases),
+        "period": period,
+        "duration": elapsed,
+        "polls": len(latencies),
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000,
+        "host_cpu": host_cpu,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keithley 2290 multi-unit polling benchmark")
+    parser.add_argument(
+        "--units", type=_counts, default=[1, 10, 100], help="Comma-separated counts"
+    )
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per measurement")
+    parser.add_argument("--period", type=float, default=1.0, help="Idle scan period in seconds")
+    parser.add_argument("--modes", default=",".join(MODES), help="Comma-separated poll modes")
+    parser.add_argument("--port", type=int, default=57000, help="Port of the first device")
+    parser.add_argument("--cycle-delay", type=float, default=0.1, help="Cycle delay of the host")
+    parser.add_argument("--output", default=None, help="File to append JSON lines to")
+    args = parser.parse_args()
+    modes = args.modes.split(",")
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error("unknown modes: {}".format(", ".join(sorted(unknown))))
+
+    poll = [command.encode() + b"\n" for command, _ in load_command_mix()]
+    environment = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "poll": [request.decode().strip() for request in poll],
+    }
+
+    output = sys.stdout if args.output is None else open(args.output, "a")
+    try:
+        for unit_count in args.units:
+            for mode in modes:
+                # A fresh host for each measurement, so that one doesn't warm it up for the next
+                emulators = _start_emulators("host", unit_count, args.port, args.cycle_delay, [])
+                try:
+                    result = asyncio.run(
+                        _measure(
+                            "127.0.0.1",
+                            args.port,
+                            poll,
+                            phases(unit_count, args.period, mode),
+                            args.period,
+                            args.duration,
+                            emulators[0].pid,
+                        )
+                    )
+                finally:
+                    _stop_emulators(emulators)
+                result["mode"] = mode
+                result.update(environment)
+                output.write(json.dumps(result, sort_keys=True) + "\n")
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,731 @@
+##################################################
+#
+# Emulator Test File
+#
+# In-process tests of the Keithley 2290 emulator, which need neither an IOC nor the
+# IOC Testing Framework and so run once rather than in every test mode. Run from the
+# system_tests directory, e.g.
+#     python -m unittest emulator_tests.keithley_2290
+#
+##################################################
+
+import asyncio
+import concurrent.futures
+import importlib.util
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+
+from fuzzing.keithley_2290 import format_step, fuzz, random_sequence, shrink
+from lewis.core.control_client import ControlClient
+from lewis_emulators.keithley_2290 import SimulatedKeithley2290
+from lewis_emulators.keithley_2290.fleet import Fleet
+from lewis_emulators.keithley_2290.host import DeviceHost
+from lewis_emulators.keithley_2290.interfaces import Keithley2290StreamInterface
+from lewis_emulators.keithley_2290.interfaces.asyncio_stream import process_request
+from lewis_emulators.keithley_2290.interfaces.replies import ReplyEncoder
+from lewis_emulators.keithley_2290.registers import StandardEventStatus, StatusByte
+from lewis_emulators.keithley_2290.trace import write_trace
+
+# The fleet is only tested where NumPy, which it needs, is installed
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+# Scenarios shared with the IOC tests
+SCENARIO_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "scenarios", "keithley_2290.yaml"
+)
+
+# Does what a Lewis process does to start the emulator, noting whether the stream interface's
+# commands have been built before and after the interface is bound to the device
+_STARTUP_SCRIPT = """
+import json, sys
+from lewis.core.devices import DeviceRegistry
+builder = DeviceRegistry("lewis_emulators").device_builder("keithley_2290")
+interface = builder.create_interface("stream")
+lazy_commands = type(interface).__dict__["commands"]
+built_before_binding = lazy_commands._commands is not None
+interface.device = builder.create_device()
+print(json.dumps({
+    "built_before_binding": built_before_binding,
+    "built_after_binding": lazy_commands._commands is not None,
+    "modules": sorted(sys.modules),
+}))
+"""
+
+# Number of random sequences of commands for the fuzz test to run, and the seed they come from
+FUZZ_SEQUENCES = int(os.environ.get("KHLY2290_FUZZ_SEQUENCES", "200"))
+FUZZ_SEED = int(os.environ.get("KHLY2290_FUZZ_SEED", "0"))
+
+# Most memory that processing a request and encoding its reply may allocate at once, in bytes,
+# most of which is the matching of the request
+REPLY_ALLOCATION_BUDGET = int(os.environ.get("KHLY2290_REPLY_ALLOCATION_BUDGET", "4096"))
+
+# Seconds that the tests against a Lewis process poll it for, and the most that a reply may take
+LEWIS_POLL_DURATION = float(os.environ.get("KHLY2290_LEWIS_POLL_DURATION", "3.0"))
+LEWIS_REPLY_TIMEOUT = 2.0
+
+# The requests that the IOC polls or sends most, whose replies repeat while the output is steady
+POLLED_REQUESTS = [b"VOUT?", b"IOUT?", b"LERR?", b"*STB?", b"*IDN?", b"VLIM?", b"TMOD?"]
+
+
+def _free_port():
+    """
+    :return: A local port that nothing is listening on.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def _start_emulator():
+    """
+    Starts the emulator in a fresh interpreter, like Lewis does.
+
+    :return: Dict of what the startup script found, see _STARTUP_SCRIPT.
+    """
+    process = subprocess.run(
+        [sys.executable, "-c", _STARTUP_SCRIPT],
+        stdout=subprocess.PIPE,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+        universal_newlines=True,
+        check=True,
+    )
+    return json.loads(process.stdout)
+
+
+class Keithley2290EmulatorStartupTests(unittest.TestCase):
+    """
+    Tests of what the emulator does when Lewis starts it, which every test run waits for. How
+    long it takes is measured by the startup benchmark.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.startup = _start_emulator()
+
+    def test_WHEN_lewis_starts_emulator_THEN_commands_only_built_once_interface_bound(self):
+        self.assertFalse(self.startup["built_before_binding"])
+        self.assertTrue(self.startup["built_after_binding"])
+
+    def test_WHEN_lewis_starts_emulator_THEN_numpy_not_imported(self):
+        self.assertNotIn("numpy", self.startup["modules"])
+
+
+class Keithley2290EmulatorFuzzTests(unittest.TestCase):
+    """
+    Tests of the emulator's register semantics against a reference model, with random sequences
+    of commands processed in-process.
+    """
+
+    def test_WHEN_fuzzing_commands_THEN_emulator_agrees_with_reference_model(self):
+        shrunk, failure, _ = fuzz(FUZZ_SEQUENCES, seed=FUZZ_SEED)
+        if shrunk is not None:
+            self.fail(
+                "{}, after:\n{}".format(failure, "\n".join(format_step(step) for step in shrunk))
+            )
+
+    def test_GIVEN_failing_sequence_WHEN_shrinking_THEN_only_failing_step_left(self):
+        failing_step = ("request", "VLIM 0.0")
+        sequence = random_sequence(random.Random(0), 100)
+        sequence.insert(50, failing_step)
+        self.assertEqual(shrink(sequence, lambda steps: failing_step in steps), [failing_step])
+
+
+class Keithley2290StatusByteTests(unittest.TestCase):
+    """
+    Tests of the emulator's status byte and the registers that set its bits, run in-process.
+    """
+
+    def setUp(self):
+        self.device = SimulatedKeithley2290()
+        self.device.process(0.0)
+
+    def test_WHEN_status_bits_change_THEN_status_byte_follows_every_transition(self):
+        # Without service requests or event status bits, which are covered separately
+        self.device.service_request_enable = 0
+        self.device.event_status_enable = 0
+        self.assertEqual(self.device.stat_byte, 1)
+
+        # V trip and ESB set by an external voltage beyond the limit, ESB cleared by reading it
+        self.device.volt_limit = 4000.0
+        self.device.volt_external(5000.0)
+        self.assertEqual(self.device.stat_byte, 35)
+        self.assertEqual(self.device.esb_alert_bit, 1)
+        self.assertEqual(self.device.stat_byte, 3)
+        self.device.volt_external(100.0)
+        self.assertEqual(self.device.stat_byte, 1)
+
+        # I trip and ESB set by a current beyond the trip, I trip cleared by clearing the trip
+        self.device.curr = 2000e-6
+        self.assertEqual(self.device.stat_byte, 37)
+        self.device.trip = 0
+        self.assertEqual(self.device.stat_byte, 33)
+        self.assertEqual(self.device.esb_alert_bit, 1)
+        self.assertEqual(self.device.stat_byte, 1)
+
+        # I lim and ESB set by a current beyond the limit, I lim cleared by raising the limit
+        self.device.curr_limit = 100e-6
+        self.assertEqual(self.device.stat_byte, 1)
+        self.device.curr = 500e-6
+        self.assertEqual(self.device.stat_byte, 41)
+        self.device.curr_limit = 1050e-6
+        self.assertEqual(self.device.stat_byte, 33)
+        self.assertEqual(self.device.esb_alert_bit, 1)
+        self.assertEqual(self.device.stat_byte, 1)
+
+        # I trip and ESB set by lowering the trip below the current, all cleared by CLS
+        self.device.curr_trip = 50e-6
+        self.assertEqual(self.device.stat_byte, 37)
+        self.device.clear_status()
+        self.assertEqual(self.device.stat_byte, 1)
+
+        # MSS set by HV on being rejected, cleared by reading it
+        self.device.high_voltage_enable_switch = 0
+        self.device.volt_ON = 1
+        self.assertEqual(self.device.stat_byte, 65)
+        self.assertEqual(self.device.MSS_bit, 1)
+        self.assertEqual(self.device.stat_byte, 1)
+
+        # HV on, stable and HV on bits are not cleared by reading them
+        self.device.high_voltage_enable_switch = 1
+        self.device.volt_ON = 1
+        self.assertEqual(self.device.stat_byte, 129)
+        self.assertEqual(self.device.stable_bit, 1)
+        self.assertEqual(self.device.volt_on_bit, 1)
+        self.assertEqual(self.device.stat_byte, 129)
+        self.device.volt_ON = 0
+        self.assertEqual(self.device.stat_byte, 1)
+
+        # Both trips set and cleared together
+        self.device.trip = 1
+        self.assertEqual(self.device.stat_byte, 7)
+        self.device.trip = 0
+        self.assertEqual(self.device.stat_byte, 1)
+
+    def test_WHEN_current_limit_lowered_below_current_THEN_current_limited_and_esb_set(self):
+        self.device.curr = 500e-6
+
+        self.device.curr_limit = 100e-6
+
+        self.assertEqual(self.device._registers.curr, 100e-6)
+        self.assertEqual(
+            self.device.stat_byte, StatusByte.STABLE | StatusByte.CURR_LIMIT | StatusByte.ESB
+        )
+
+    def test_GIVEN_execution_error_enabled_WHEN_errors_THEN_only_it_sets_esb(self):
+        self.device.event_status_enable = StandardEventStatus.EXECUTION_ERROR
+
+        self.device.reject_command()
+        self.assertEqual(self.device.stat_byte, StatusByte.STABLE)
+        self.device.volt = 20000.0  # Beyond the limit
+        self.assertEqual(self.device.stat_byte, StatusByte.STABLE | StatusByte.ESB)
+
+    def test_WHEN_voltage_limit_set_below_output_THEN_rejected(self):
+        self.device.volt = 3000.0
+
+        self.device.volt_limit = 2000.0
+
+        self.assertEqual(self.device.volt_limit, 10000.0)
+        self.assertEqual(self.device.execution_error, 1)
+
+    def test_GIVEN_output_ramping_WHEN_voltage_limit_set_below_setpoint_THEN_rejected(self):
+        self.device.ramp_rate = 100.0
+        self.device.volt = 3000.0
+        self.device.run_for(1.0)
+
+        self.device.volt_limit = 2000.0
+
+        self.assertEqual(self.device.volt, 100.0)
+        self.assertEqual(self.device.volt_limit, 10000.0)
+        self.assertEqual(self.device.execution_error, 1)
+
+    def test_WHEN_voltage_limit_set_to_setpoint_THEN_accepted(self):
+        self.device.volt = 3000.0
+
+        self.device.volt_limit = 3000.0
+
+        self.assertEqual(self.device.volt_limit, 3000.0)
+        self.assertEqual(self.device.execution_error, 0)
+
+
+class Keithley2290WaveformCaptureTests(unittest.TestCase):
+    """
+    Tests of the emulator's waveform capture, read by devKeithley2290Waveform.db.
+    """
+
+    def setUp(self):
+        self.device = SimulatedKeithley2290()
+        self.device.process(0.0)
+        self.device.enable_capture(sample_rate=1000.0, size=1000)
+
+    def _waveforms(self):
+        volts, currs = self.device.waveforms.split(";")
+        return [float(volt) for volt in volts.split(",")], [float(c) for c in currs.split(",")]
+
+    def test_WHEN_capturing_for_ten_minutes_THEN_only_latest_samples_kept_in_same_buffer(self):
+        buffer = self.device._capture.volts
+        self.device.run_for(600.0)
+        volts, currs = self._waveforms()
+        self.assertEqual(len(volts), 1000)
+        self.assertEqual(len(currs), 1000)
+        self.assertIs(self.device._capture.volts, buffer)
+
+    def test_WHEN_current_trips_THEN_capture_frozen_with_samples_up_to_trip(self):
+        self.device.ramp_rate = 1000.0
+        self.device.load_resistance = 1e6
+        self.device.volt = 2000.0  # 2 mA into the load once ramped, beyond the 1.05 mA trip
+        self.device.run_for(3.0)
+
+        self.assertTrue(self.device.capture_frozen)
+        volts, currs = self._waveforms()
+        self.assertGreater(currs[-1], self.device.curr_trip)
+        self.assertLess(max(currs[:-1]), currs[-1])
+        self.assertEqual(volts, sorted(volts))
+
+        self.device.run_for(1.0)
+        self.assertEqual(self._waveforms(), (volts, currs))
+        self.device.rearm_capture()
+        self.device.run_for(1.0)
+        self.assertFalse(self.device.capture_frozen)
+        self.assertEqual(self._waveforms()[1][-1], 0)
+
+
+class Keithley2290ScenarioTests(unittest.TestCase):
+    """
+    Tests of the emulator's scenarios, run in-process on a paused clock.
+    """
+
+    def setUp(self):
+        self.device = SimulatedKeithley2290()
+        self.device.process(0.0)
+
+    def test_WHEN_running_interlock_scenario_THEN_each_change_made_at_its_time(self):
+        self.device.start_scenario("interlock_then_trip", SCENARIO_FILE)
+
+        self.device.run_for(1.5)
+        self.assertFalse(self.device.high_voltage_enable_switch)
+        self.assertFalse(self.device.volt_ON)
+        self.assertEqual(self.device.stat_byte & StatusByte.MSS, StatusByte.MSS)
+
+        self.device.run_for(1.0)
+        self.assertTrue(self.device.volt_ON)
+        self.assertEqual(self.device.volt, 0.0)
+
+        self.device.run_for(3.0)
+        self.assertFalse(self.device.scenario_running)
+        self.assertEqual(self.device.volt, 2000.0)
+        self.assertTrue(self.device.trip)
+
+    def test_WHEN_loading_scenario_with_unknown_attribute_THEN_rejected_before_running(self):
+        scenario_dir = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, scenario_dir)
+        scenario_file = os.path.join(scenario_dir, "typo.json")
+        with open(scenario_file, "w") as scenario:
+            json.dump(
+                {"version": 1, "scenarios": {"typo": [{"set": {"volt_limt": 100.0}}]}}, scenario
+            )
+        self.addCleanup(os.remove, scenario_file)
+
+        with self.assertRaises(ValueError):
+            self.device.start_scenario("typo", scenario_file)
+        self.assertFalse(self.device.scenario_running)
+        self.assertEqual(self.device.scenario_names, [])
+
+
+class Keithley2290DefaultsTests(unittest.TestCase):
+    """
+    Tests of whether the emulator reports being at its defaults, which lets the IOC tests skip
+    resetting it.
+    """
+
+    def setUp(self):
+        self.device = SimulatedKeithley2290()
+        self.device.process(0.0)
+
+    def test_WHEN_emulator_fresh_THEN_at_defaults(self):
+        self.assertTrue(self.device.at_defaults)
+
+    def test_WHEN_emulator_changes_kept_by_reset_THEN_not_at_defaults(self):
+        for change, undo in (
+            (self.device.enable_faults, self.device.disable_faults),
+            (self.device.enable_capture, self.device.disable_capture),
+            (self.device.pause, self.device.resume),
+            (
+                lambda: setattr(self.device, "simulation_speed", 10.0),
+                lambda: setattr(self.device, "simulation_speed", 1.0),
+            ),
+        ):
+            change()
+            self.device.reset()
+            self.assertFalse(self.device.at_defaults, change)
+            undo()
+            self.assertTrue(self.device.at_defaults, undo)
+
+
+class Keithley2290BatchedQueryTests(unittest.TestCase):
+    """
+    Tests of ";"-separated batched queries, processed in-process.
+    """
+
+    def setUp(self):
+        self.interface = Keithley2290StreamInterface()
+        self.interface.device = SimulatedKeithley2290()
+        self.interface.device.process(0.0)
+        self.interface.device.enable_command_metrics()
+
+    def test_WHEN_batched_query_has_unknown_part_THEN_error_names_it_and_request_counted_once(self):
+        reply = process_request(self.interface, b"VOUT?;BOGUS?")
+
+        self.assertIn("matched BOGUS?", reply)
+        metrics = self.interface.device.command_metrics
+        self.assertEqual(metrics.requests, 1)
+        self.assertEqual(metrics.unmatched, 1)
+
+    def test_WHEN_batched_query_THEN_parts_timed_but_request_counted_once(self):
+        self.assertEqual(process_request(self.interface, b"VOUT?;*STB?"), "0.0;1")
+
+        metrics = self.interface.device.command_metrics
+        self.assertEqual(metrics.requests, 1)
+        self.assertEqual(metrics.counts()["get_volt"], 1)
+        self.assertEqual(metrics.counts()["get_stat_byte"], 1)
+
+
+class Keithley2290DeviceHostTests(unittest.TestCase):
+    """
+    Tests of the multi-device host, serving on local ports.
+    """
+
+    def setUp(self):
+        self.port = _free_port()
+        self.backdoor_port = _free_port()
+
+    def _serve(self, host, use_backdoor):
+        """
+        Runs a host until a client in another thread has finished with the backdoor of its first
+        device.
+
+        :param use_backdoor: Function called with the proxy of the device in the backdoor.
+        :return: What the function returned.
+        """
+
+        def client():
+            control_client = ControlClient(port=self.backdoor_port)
+            try:
+                return use_backdoor(control_client.get_object("device"))
+            finally:
+                # Closed by the thread that used it, as a zmq socket can't be shared by threads
+                control_client._socket.close()
+                control_client._socket.context.term()
+
+        async def serve():
+            await host.start()
+            try:
+                done = asyncio.get_running_loop().run_in_executor(None, client)
+                while not done.done():
+                    host.process(0.0)
+                    await asyncio.sleep(0.01)
+                return done.result()
+            finally:
+                await host.stop()
+
+        return asyncio.run(serve())
+
+    def test_WHEN_host_restarted_on_same_ports_THEN_devices_and_backdoors_served(self):
+        # Both kept, as a restart in the same process would, so that nothing is closed on the
+        # first host being garbage collected
+        hosts = [DeviceHost(1, self.port, self.backdoor_port) for _ in range(2)]
+        for host in hosts:
+            self.assertTrue(self._serve(host, lambda device: device.connected))
+
+    @unittest.skipUnless(HAS_NUMPY, "The fleet needs NumPy")
+    def test_GIVEN_fleet_WHEN_setting_register_over_backdoor_THEN_channel_set(self):
+        host = DeviceHost(2, self.port, self.backdoor_port, fleet=True)
+
+        def set_volt_limit(device):
+            device.volt_limit = 5000.0
+            return device.volt_limit
+
+        self.assertEqual(self._serve(host, set_volt_limit), 5000.0)
+        self.assertEqual(host.fleet.volt_limit.tolist(), [5000.0, 10000.0])
+
+
+class Keithley2290LewisTests(unittest.TestCase):
+    """
+    Tests of the emulator served by a Lewis process, as the IOC tests run it, with clients
+    polling it from threads of their own.
+    """
+
+    def setUp(self):
+        self.port = _free_port()
+        self.backdoor_port = _free_port()
+        self.lewis = subprocess.Popen(
+            [sys.executable, "-m", "lewis", "-k", "lewis_emulators", "keithley_2290"]
+            + ["-p", "stream: {{bind_address: 127.0.0.1, port: {}}}".format(self.port)]
+            + ["-r", "127.0.0.1:{}".format(self.backdoor_port), "-c", "0.05", "-o", "none"],
+            env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+        )
+        self.addCleanup(self._stop_lewis)
+        deadline = time.monotonic() + 30.0
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1.0).close()
+                break
+            except OSError:
+                if self.lewis.poll() is not None or time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def _stop_lewis(self):
+        self.lewis.terminate()
+        self.lewis.wait()
+
+    def _use_backdoor(self, use_backdoor):
+        control_client = ControlClient(port=self.backdoor_port)
+        try:
+            return use_backdoor(control_client.get_object("device"))
+        finally:
+            control_client._socket.close()
+            control_client._socket.context.term()
+
+    def _poll(self, client, requests, stop):
+        """
+        Sends the requests all at once and waits for a line back for each, over and over until
+        stopped.
+
+        :return: The number of lines received.
+        """
+        with client:
+            client.settimeout(LEWIS_REPLY_TIMEOUT)
+            lines = client.makefile("rb")
+            received = 0
+            while not stop.is_set():
+                client.sendall(b"".join(request + b"\n" for request in requests))
+                for _ in requests:
+                    lines.readline()
+                    received += 1
+            return received
+
+    def _poll_concurrently(self, *request_lists):
+        """
+        Polls with a client per list of requests at once for LEWIS_POLL_DURATION. The clients
+        connect in the order given, and Lewis sends unsolicited lines to the last to connect.
+
+        :return: The number of lines each client received.
+        """
+        clients = [socket.create_connection(("127.0.0.1", self.port)) for _ in request_lists]
+        stop = threading.Event()
+        with concurrent.futures.ThreadPoolExecutor(len(clients)) as executor:
+            polls = [
+                executor.submit(self._poll, client, requests, stop)
+                for client, requests in zip(clients, request_lists)
+            ]
+            time.sleep(LEWIS_POLL_DURATION)
+            stop.set()
+            return [poll.result() for poll in polls]
+
+    def test_GIVEN_reply_delay_fault_WHEN_polled_concurrently_THEN_delayed_replies_sent(self):
+        self._use_backdoor(
+            lambda device: device.add_fault("delay", 0.0, None, 1.0, ["get_volt"], 0.1)
+        )
+
+        # Many delayed replies are sent in each cycle, while the other client keeps the adapter
+        # busy processing requests
+        received = self._poll_concurrently([b"*STB?", b"IOUT?", b"VLIM?"], [b"VOUT?"] * 20)
+
+        self.assertIsNone(self.lewis.poll())
+        for count in received:
+            self.assertGreater(count, 0)
+        self.assertGreater(self._use_backdoor(lambda device: device.fault_counts["delay"]), 0)
+
+    def test_GIVEN_trips_requesting_service_WHEN_polled_concurrently_THEN_requests_sent(self):
+        def trip_every_cycle(device):
+            device.service_request_enable = StatusByte.TRIPS
+            device.add_fault("trip", 0.0, None, 1000.0)
+
+        self._use_backdoor(trip_every_cycle)
+
+        # The other clients clear the trip, so that it trips and requests service again
+        received = self._poll_concurrently([b"TCLR;*STB?"] * 20, [b"IOUT?"] * 20, [b"VOUT?"])
+
+        self.assertIsNone(self.lewis.poll())
+        for count in received:
+            self.assertGreater(count, 0)
+        self.assertGreater(self._use_backdoor(lambda device: device.fault_counts["trip"]), 0)
+
+
+@unittest.skipUnless(HAS_NUMPY, "The fleet needs NumPy")
+class Keithley2290FleetTests(unittest.TestCase):
+    """
+    Tests of the channels of a fleet doing what separate devices do, run in-process.
+    """
+
+    def setUp(self):
+        self.fleet = Fleet(3)
+        self.fleet.process(0.0)
+        self.channel = self.fleet.channels[1]
+        self.others = [self.fleet.channels[0], self.fleet.channels[2]]
+
+    def test_WHEN_running_channel_for_a_while_THEN_whole_fleet_ramps(self):
+        for channel in self.fleet.channels:
+            channel.ramp_rate = 100.0
+            channel.volt = 1000.0
+
+        self.channel.run_for(5.0)
+
+        for channel in self.fleet.channels:
+            self.assertAlmostEqual(channel.volt, 500.0)
+            self.assertAlmostEqual(channel.simulated_time, 5.0)
+
+    def test_WHEN_processing_channel_on_its_own_THEN_rejected(self):
+        with self.assertRaises(RuntimeError):
+            self.channel.process(0.1)
+
+    def test_WHEN_running_scenario_on_channel_THEN_only_it_changed(self):
+        self.channel.start_scenario("interlock_then_trip", SCENARIO_FILE)
+
+        self.fleet.run_for(5.5)
+
+        self.assertFalse(self.channel.scenario_running)
+        self.assertEqual(self.channel.volt, 2000.0)
+        self.assertTrue(self.channel.trip)
+        for channel in self.others:
+            self.assertEqual(channel.volt, 0.0)
+            self.assertFalse(channel.trip)
+        self.assertEqual(self.fleet.active_channels, set())
+
+    def test_WHEN_trip_fault_starts_THEN_channel_trips_at_its_start(self):
+        self.channel.enable_faults()
+        self.channel.add_fault("trip", start=1.0, probability=100.0)
+
+        self.fleet.run_for(0.5)
+        self.assertFalse(self.channel.trip)
+        self.fleet.run_for(1.0)
+        self.assertTrue(self.channel.trip)
+        for channel in self.others:
+            self.assertFalse(channel.trip)
+
+    def test_WHEN_capturing_channel_THEN_its_ramp_captured(self):
+        self.channel.ramp_rate = 1000.0
+        self.channel.volt = 1000.0
+        self.channel.enable_capture(sample_rate=100.0, size=100)
+
+        self.fleet.run_for(1.0)
+
+        volts = [float(volt) for volt in self.channel.waveforms.split(";")[0].split(",")]
+        self.assertEqual(volts, sorted(volts))
+        self.assertEqual(volts[-1], 1000.0)
+
+    def test_GIVEN_interlock_WHEN_channel_trips_THEN_group_switched_off_and_trip_captured(self):
+        device = SimulatedKeithley2290()
+        device.process(0.0)
+        interlocked = self.others[0]
+        self.channel.interlock_group = interlocked.interlock_group = 0
+        for tripping in (device, self.channel):
+            tripping.ramp_rate = 1000.0
+            tripping.load_resistance = 1e6
+            tripping.enable_capture(sample_rate=100.0, size=100)
+        interlocked.enable_capture(sample_rate=100.0, size=100)
+        for channel in (device, *self.fleet.channels):
+            channel.volt_ON = 1
+            channel.volt = 2000.0  # 2 mA into the load once ramped, beyond the 1.05 mA trip
+
+        device.run_for(3.0)
+        self.fleet.run_for(3.0)
+
+        self.assertTrue(self.channel.trip)
+        self.assertFalse(self.channel.volt_ON)
+        self.assertTrue(self.channel.capture_frozen)
+        volts, currs = self.channel.waveforms.split(";")
+        # The current up to and at the trip is captured as by a separate device, while the
+        # interlock takes the voltage to 0 over the cycle of the trip
+        self.assertEqual(currs, device.waveforms.split(";")[1])
+        self.assertGreater(float(currs.rsplit(",", 1)[1]), self.channel.curr_trip)
+        self.assertEqual(float(volts.rsplit(",", 1)[1]), 0.0)
+        self.assertFalse(interlocked.trip)
+        self.assertFalse(interlocked.volt_ON)
+        self.assertEqual(interlocked.volt, 0.0)
+        self.assertFalse(interlocked.capture_frozen)
+        self.assertTrue(self.others[1].volt_ON)
+        self.assertEqual(self.others[1].volt, 2000.0)
+
+    def test_WHEN_replaying_trace_on_channel_THEN_its_output_follows_trace_until_end(self):
+        trace_dir = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, trace_dir)
+        trace_file = os.path.join(trace_dir, "ramp.trace")
+        write_trace(trace_file, [0.0, 1.0, 2.0], [0.0, 100.0, 200.0], [0.0, 1e-6, 2e-6])
+        self.addCleanup(os.remove, trace_file)
+        self.channel.insert_mock_data(trace_file)
+
+        self.fleet.run_for(1.5)
+        self.assertTrue(self.channel.replaying)
+        self.assertEqual(self.channel.volt, 100.0)
+        self.fleet.run_for(1.0)
+        self.assertFalse(self.channel.replaying)
+        self.assertEqual(self.channel.volt, 200.0)
+        for channel in self.others:
+            self.assertEqual(channel.volt, 0.0)
+        self.assertEqual(self.fleet.active_channels, set())
+
+
+class Keithley2290ReplyAllocationTests(unittest.TestCase):
+    """
+    Tests of the memory allocated by processing requests and encoding their replies.
+    """
+
+    def setUp(self):
+        self.interface = Keithley2290StreamInterface()
+        self.interface.device = SimulatedKeithley2290()
+        self.interface.device.process(0.0)
+        self.encoder = ReplyEncoder(self.interface.out_terminator, self.interface.constant_replies)
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+
+    def _reply(self, request):
+        return self.encoder.encode(process_request(self.interface, request))
+
+    def test_WHEN_processing_polled_requests_THEN_allocations_per_request_bounded(self):
+        for request in POLLED_REQUESTS:
+            for _ in range(10):
+                self._reply(request)
+            start, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            for _ in range(1000):
+                self._reply(request)
+            current, peak = tracemalloc.get_traced_memory()
+
+            self.assertLessEqual(peak - start, REPLY_ALLOCATION_BUDGET, request)
+            # Nothing kept from one request to the next
+            self.assertLessEqual(current - start, 1024, request)
+
+    def test_WHEN_encoding_integer_and_constant_replies_THEN_same_line_reused(self):
+        replies = [0, 1, 255, self.interface.device.idn]
+        lines = [self.encoder.encode(reply) for reply in replies]
+
+        self.assertEqual(lines[:3], [b"0\n", b"1\n", b"255\n"])
+        self.assertEqual(lines[3], b"KEITHLEY INSTRUMENTS INC., emulator\n")
+        for reply, line in zip(replies, lines):
+            self.assertIs(self.encoder.encode(reply), line)
+
+    def test_WHEN_encoding_other_replies_THEN_each_formatted_as_it_is(self):
+        for reply, line in [
+            (0.0, b"0.0\n"),
+            (-0.0, b"-0.0\n"),
+            (1.5e-05, b"1.5e-05\n"),
+            (256, b"256\n"),
+            (-1, b"-1\n"),
+            (True, b"True\n"),
+            ("Voltage set to: 0.0", b"Voltage set to: 0.0\n"),
+        ]:
+            self.assertEqual(self.encoder.encode(reply), line)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,620 @@
+##################################################
+#
+# Fuzzing File
+#
+# Differential fuzzing of the Keithley 2290 emulator's register semantics. Random
+# sequences of commands, backdoor changes and device cycles are processed by the stream
+# interface's handlers in-process, without sockets, and every reply and the registers
+# after every step are compared with a reference model of the 2290's status byte.
+# A failing sequence is shrunk to a minimal one before it is reported.
+# Run from the system_tests directory, e.g.
+#     python -m fuzzing.keithley_2290 --sequences 10000 --seed 1
+#
+##################################################
+
+import argparse
+import random
+import sys
+import time
+
+from lewis_emulators.keithley_2290 import SimulatedKeithley2290
+from lewis_emulators.keithley_2290.interfaces import Keithley2290StreamInterface
+from lewis_emulators.keithley_2290.registers import Keithley2290Registers
+
+# Status byte bits
+STABLE = 1 << 0
+VOLT_TRIP = 1 << 1
+CURR_TRIP = 1 << 2
+CURR_LIMIT = 1 << 3
+MAV = 1 << 4
+ESB = 1 << 5
+MSS = 1 << 6
+HV_ON = 1 << 7
+
+# Standard Event Status Register bits
+EXECUTION_ERROR = 1 << 4
+COMMAND_ERROR = 1 << 5
+
+# Error code read by LERR? after an execution error
+EXECUTION_ERROR_CODE = 10
+
+# Expected in place of the reply to VSET or VLIM, see ReferenceKeithley2290
+ACKNOWLEDGEMENT = object()
+
+# Values to pick arguments from, around the defaults and the limits of the device
+VOLTS = (0.0, 100.0, 3999.5, 4000.0, 5000.0, 10000.0, 11000.0)
+CURRENTS = (0.0, 50e-6, 100e-6, 500e-6, 1050e-6, 2000e-6)
+RAMP_RATES = (0.0, 100.0, 1000.0)
+LOAD_RESISTANCES = (None, 1e6, 1e7)
+CYCLE_TIMES = (0.0, 0.1, 1.0)
+
+QUERIES = (
+    "*IDN?",
+    "VOUT?",
+    "VLIM?",
+    "IOUT?",
+    "ILIM?",
+    "ITRP?",
+    "SMOD?",
+    "TMOD?",
+    "*STB?",
+    "*STB? 0",
+    "*STB? 5",
+    "*STB? 7",
+    "*ESR? 4",
+    "*ESR? 5",
+    "*SRE?",
+    "LERR?",
+)
+
+
+class ReferenceKeithley2290(object):
+    """
+    How the registers of a 2290 should change and what it should reply, kept as plain integers
+    and floats in the same form as Keithley2290Registers.as_dict rather than with the emulator's
+    registers.
+
+    The model follows these rules, each applied in one place whichever command or change
+    triggers it, rather than the emulator's code for each command:
+    - Setting a status bit that is enabled in the service request enable register requests
+      service, which sets RQS/MSS. RQS/MSS can't itself be enabled.
+    - A trip or the current limit sets its status bit and ESB, however it comes about, and
+      is cleared when the condition goes away. A trip takes the current to 0.
+    - An error sets its Standard Event Status Register bit, and ESB if that bit is enabled.
+    - The ESB and RQS/MSS bits, the error code and the standard event status bits are
+      cleared by being read. Nothing else clears a bit apart from the condition that set it
+      going away, TCLR, *CLS and *RST.
+    - *RST restores every register apart from the enable registers.
+    - A setting beyond its limit is an execution error and is not made.
+    - STABLE is set while the output is at its setpoint.
+
+    The emulator also does some things that the rules don't cover, which the model does on
+    purpose so that they aren't reported on every run. Each is a _quirk_ method, which says
+    why it is kept.
+    """
+
+    def __init__(self):
+        self.state = Keithley2290Registers().as_dict()
+
+    def _set_bits(self, bits):
+        state = self.state
+        rising = bits & ~state["status"] & state["service_request_enable"]
+        state["status"] |= bits
+        if rising:
+            state["status"] |= MSS
+
+    def _clear_bits(self, bits):
+        self.state["status"] &= ~bits
+
+    def _set_bit(self, bit, value):
+        if value:
+            self._set_bits(bit)
+        else:
+            self._clear_bits(bit)
+
+    def _condition(self, bit, present):
+        """
+        Sets a trip or limit status bit and ESB while its condition is present, or clears it.
+        """
+        if present:
+            self._set_bits(bit | ESB)
+        else:
+            self._clear_bits(bit)
+
+    def _read_and_clear(self, register):
+        value = self.state[register]
+        self.state[register] = 0
+        return value
+
+    def _read_and_clear_bit(self, bit):
+        value = int(self.state["status"] & bit != 0)
+        self._clear_bits(bit)
+        return value
+
+    def _execution_error(self):
+        self.state["execution_error"] = 1
+        self.state["error"] = EXECUTION_ERROR_CODE
+        if self.state["event_status_enable"] & EXECUTION_ERROR:
+            self._set_bits(ESB)
+
+    def _check_curr_trip(self):
+        state = self.state
+        tripped = state["curr"] > state["curr_trip"]
+        if tripped:
+            state["curr"] = 0
+        self._condition(CURR_TRIP, tripped)
+
+    def _check_curr_limit(self):
+        state = self.state
+        limited = state["curr"] > state["curr_limit"]
+        if limited:
+            state["curr"] = state["curr_limit"]
+        self._condition(CURR_LIMIT, limited)
+
+    def _set_curr(self, curr):
+        """
+        Sets the current, applying the current trip and then the current limit to it.
+        """
+        self.state["curr"] = curr
+        self._check_curr_trip()
+        self._check_curr_limit()
+
+    def _quirk_limited_current_readback(self):
+        """
+        IOUT? replies with the limit while the current is limited and sets ESB again. Reading
+        a readback changes no other status bit, but the original emulator did this and the IOC
+        tests were written against it.
+        """
+        self._set_bits(ESB)
+        return self.state["curr_limit"]
+
+    def _quirk_high_voltage_rejected(self):
+        """
+        HVON with the interlock open sets RQS/MSS whether or not any bit is enabled for
+        service requests, as the original emulator did. The status byte test and the
+        interlock scenario look for the rejection in it.
+        """
+        self._execution_error()
+        self._set_bits(MSS)
+
+    def _quirk_clear_status(self):
+        """
+        *CLS leaves only STABLE set, even while the high voltage is on or the output is still
+        ramping, as the original emulator did. The status byte test expects a status byte of
+        1 after it.
+        """
+        self.state["status"] = STABLE
+
+    def _quirk_setting_acknowledged(self):
+        """
+        VSET and VLIM are answered with a line of the emulator's own, kept from the original
+        emulator. The IOC's protocols don't read it, so only that a line is sent is checked,
+        not its text.
+        """
+        return ACKNOWLEDGEMENT
+
+    def process(self, request):
+        """
+        :param request: A request as sent to the device, e.g. "VSET 100.0" or "VOUT?;IOUT?".
+        :return: The parts of the reply expected, each a string or ACKNOWLEDGEMENT, or None if
+            there is no reply.
+        """
+        parts = []
+        for part in request.split(";"):
+            reply = self._process(part)
+            if reply is not None:
+                parts.append(reply if reply is ACKNOWLEDGEMENT else str(reply))
+        return parts or None
+
+    def _process(self, request):
+        state = self.state
+        status = state["status"]
+
+        if request == "*IDN?":
+            return state["idn"]
+        if request == "VOUT?":
+            return state["volt"]
+        if request == "VLIM?":
+            return state["volt_limit"]
+        if request == "IOUT?":
+            if status & CURR_LIMIT:
+                return self._quirk_limited_current_readback()
+            return state["curr"]
+        if request == "ILIM?":
+            return state["curr_limit"]
+        if request == "ITRP?":
+            return state["curr_trip"]
+        if request == "SMOD?":
+            return state["setting_mode"]
+        if request == "TMOD?":
+            return state["trip_reset_mode"]
+        if request == "*STB?":
+            return status
+        if request == "*STB? 0":
+            return int(status & STABLE != 0)
+        if request == "*STB? 5":
+            return self._read_and_clear_bit(ESB)
+        if request == "*STB? 7":
+            return int(status & HV_ON != 0)
+        if request == "*ESR? 4":
+            return self._read_and_clear("execution_error")
+        if request == "*ESR? 5":
+            return self._read_and_clear("command_error")
+        if request == "*SRE?":
+            return state["service_request_enable"]
+        if request == "LERR?":
+            return self._read_and_clear("error")
+        if request == "*RST":
+            kept = {
+                "service_request_enable": state["service_request_enable"],
+                "event_status_enable": state["event_status_enable"],
+            }
+            self.state = Keithley2290Registers().as_dict()
+            self.state.update(kept)
+            return None
+        if request == "*CLS":
+            self._quirk_clear_status()
+            return None
+        if request == "TCLR":
+            self._clear_bits(VOLT_TRIP | CURR_TRIP)
+            return None
+        if request == "HVON":
+            if not state["high_voltage_enable_switch"]:
+                self._quirk_high_voltage_rejected()
+            else:
+                self._set_bits(HV_ON)
+            return None
+        if request == "HVOF":
+            self._clear_bits(HV_ON)
+            return None
+
+        command, argument = request.split(" ")
+        if command == "VSET":
+            volt = float(argument)
+            if volt > state["volt_limit"]:
+                self._execution_error()
+            else:
+                state["volt_setpoint"] = volt
+                if state["ramp_rate"] <= 0:
+                    state["volt"] = volt
+                self._set_bit(STABLE, state["volt"] == volt)
+            return self._quirk_setting_acknowledged()
+        if command == "VLIM":
+            volt_limit = float(argument)
+            # The output may still be ramping towards its setpoint, which is then beyond it
+            if max(state["volt"], state["volt_setpoint"]) > volt_limit:
+                self._execution_error()
+            else:
+                state["volt_limit"] = volt_limit
+            return self._quirk_setting_acknowledged()
+        if command == "ILIM":
+            state["curr_limit"] = float(argument)
+            self._check_curr_limit()
+            return None
+        if command == "ITRP":
+            state["curr_trip"] = float(argument)
+            self._check_curr_trip()
+            return None
+        if command == "TMOD":
+            state["trip_reset_mode"] = int(argument)
+            return None
+        if command == "*SRE":
+            state["service_request_enable"] = int(argument) & ~MSS
+            return None
+        if command == "ESE":
+            state["event_status_enable"] = int(argument)
+            return None
+        raise ValueError("Unknown request {}".format(request))
+
+    def set(self, name, value):
+        """
+        Makes the same change as setting an attribute of the device, or calling one of its
+        methods, over the backdoor.
+        """
+        state = self.state
+        if name == "curr":
+            self._set_curr(value)
+        elif name == "volt_external":
+            # An output driven beyond the limit trips, which takes it to 0
+            tripped = value > state["volt_limit"]
+            self._condition(VOLT_TRIP, tripped)
+            state["volt"] = state["volt_setpoint"] = 0 if tripped else value
+            self._set_bits(STABLE)
+        else:
+            state[name] = value
+
+    def cycle(self, dt):
+        """
+        Moves the output towards the setpoint at the ramp rate and updates the load current.
+        """
+        state = self.state
+        volt = state["volt"]
+        setpoint = state["volt_setpoint"]
+        if volt != setpoint:
+            step = state["ramp_rate"] * dt
+            if state["ramp_rate"] <= 0 or abs(setpoint - volt) <= step:
+                volt = setpoint
+            elif setpoint > volt:
+                volt += step
+            else:
+                volt -= step
+            state["volt"] = volt
+            self._set_bit(STABLE, volt == setpoint)
+
+        if state["load_resistance"] and not state["status"] & CURR_TRIP:
+            self._set_curr(volt / state["load_resistance"])
+
+
+def _reply_matches(reply, expected):
+    """
+    :param reply: The emulator's reply.
+    :param expected: The parts of the reply expected by the model, see process.
+    :return: Whether the reply is the one expected.
+    """
+    if expected is None or reply is None:
+        return reply is expected
+    parts = reply.split(";")
+    return len(parts) == len(expected) and all(
+        part != "" if expected_part is ACKNOWLEDGEMENT else part == expected_part
+        for part, expected_part in zip(parts, expected)
+    )
+
+
+def _format_expected(expected):
+    if expected is None:
+        return repr(None)
+    return repr(
+        ";".join("<acknowledgement>" if part is ACKNOWLEDGEMENT else part for part in expected)
+    )
+
+
+def _check_invariants(state):
+    """
+    :return: A description of the first invariant that the registers break, or None.
+    """
+    status = state["status"]
+    if not 0 <= status <= 0xFF:
+        return "status byte {} is not a byte".format(status)
+    if status & MAV:
+        return "MAV is set but replies are never queued"
+    if state["service_request_enable"] & MSS:
+        return "RQS/MSS is enabled in the service request enable register"
+    if status & CURR_TRIP and state["curr"] != 0:
+        return "current trip is set but the current is {}".format(state["curr"])
+    if state["curr"] > state["curr_limit"]:
+        return "current {} is beyond the current limit {}".format(
+            state["curr"], state["curr_limit"]
+        )
+    if state["volt"] > state["volt_limit"]:
+        return "voltage {} is beyond the voltage limit {}".format(
+            state["volt"], state["volt_limit"]
+        )
+    return None
+
+
+def random_step(rng):
+    """
+    :return: A random step, as one of ("request", request), ("set", attribute, value),
+        ("call", method, argument) or ("cycle", seconds).
+    """
+    kind = rng.random()
+    if kind < 0.45:
+        return ("request", rng.choice(QUERIES))
+    if kind < 0.75:
+        return ("request", _random_setting(rng))
+    if kind < 0.8:
+        parts = [rng.choice(QUERIES + (_random_setting(rng),)) for _ in range(rng.randint(2, 4))]
+        return ("request", ";".join(parts))
+    if kind < 0.9:
+        return rng.choice(
+            (
+                ("set", "curr", rng.choice(CURRENTS)),
+                ("call", "volt_external", rng.choice(VOLTS)),
+                ("set", "high_voltage_enable_switch", rng.randint(0, 1)),
+                ("set", "ramp_rate", rng.choice(RAMP_RATES)),
+                ("set", "load_resistance", rng.choice(LOAD_RESISTANCES)),
+            )
+        )
+    return ("cycle", rng.choice(CYCLE_TIMES))
+
+
+def _random_setting(rng):
+    return rng.choice(
+        (
+            "VSET {!r}".format(rng.choice(VOLTS)),
+            "VLIM {!r}".format(rng.choice(VOLTS)),
+            "ILIM {!r}".format(rng.choice(CURRENTS)),
+            "ITRP {!r}".format(rng.choice(CURRENTS)),
+            "TMOD {}".format(rng.randint(0, 1)),
+            "*SRE {}".format(rng.randint(0, 0xFF)),
+            "ESE {}".format(rng.choice((0, EXECUTION_ERROR, COMMAND_ERROR, 0xFF))),
+            "HVON",
+            "HVOF",
+            "TCLR",
+            "*CLS",
+            "*RST",
+        )
+    )
+
+
+def random_sequence(rng, length):
+    return [random_step(rng) for _ in range(length)]
+
+
+def _create_interface():
+    interface = Keithley2290StreamInterface()
+    interface.device = SimulatedKeithley2290()
+    # The state machine enters its state on the first cycle and only runs it from the second
+    interface.device.process(0.0)
+    return interface
+
+
+def _process(interface, request):
+    """
+    Processes a request with the command that the Lewis stream handler would pick, letting any
+    exception raised by the handler through rather than turning it into an error reply.
+    """
+    request = request.encode()
+    for cmd in interface.bound_commands:
+        if cmd.can_process(request):
+            return cmd.process_request(request)
+    raise RuntimeError("None of the device's commands matched {}.".format(request))
+
+
+def run_sequence(sequence):
+    """
+    Runs a sequence of steps on a new emulator and on the reference model.
+
+    :return: A description of the first difference from the model or broken invariant and the
+        index of the step that caused it, or None if there wasn't one.
+    """
+    interface = _create_interface()
+    device = interface.device
+    model = ReferenceKeithley2290()
+
+    for index, step in enumerate(sequence):
+        kind = step[0]
+        try:
+            if kind == "request":
+                reply = _process(interface, step[1])
+                expected_reply = model.process(step[1])
+                if not _reply_matches(reply, expected_reply):
+                    return "replied {!r}, expected {}".format(
+                        reply, _format_expected(expected_reply)
+                    ), index
+            elif kind == "set":
+                setattr(device, step[1], step[2])
+                model.set(step[1], step[2])
+            elif kind == "call":
+                getattr(device, step[1])(step[2])
+                model.set(step[1], step[2])
+            else:
+                device.process(step[1])
+                model.cycle(step[1])
+        except Exception as error:
+            return "raised {!r}".format(error), index
+
+        state = device._registers.as_dict()
+        if state != model.state:
+            differences = sorted(
+                "{}={!r} (expected {!r})".format(name, value, model.state.get(name))
+                for name, value in state.items()
+                if value != model.state.get(name)
+            )
+            return "registers differ: {}".format(", ".join(differences)), index
+
+        broken = _check_invariants(state)
+        if broken is not None:
+            return broken, index
+    return None
+
+
+def _fails(sequence):
+    return run_sequence(sequence) is not None
+
+
+def _simpler_steps(step):
+    """
+    Yields simpler versions of a step to try in its place, simplest first.
+    """
+    if step[0] == "request" and ";" in step[1]:
+        for part in step[1].split(";"):
+            yield ("request", part)
+    elif step[0] == "request" and " " in step[1] and step[1] not in QUERIES:
+        command, argument = step[1].split(" ")
+        for simpler in ("0", "0.0", "1", "1.0"):
+            if simpler != argument:
+                yield ("request", "{} {}".format(command, simpler))
+    elif step[0] in ("set", "call", "cycle"):
+        for simpler in (0, 0.0, 1, 1.0):
+            if step[-1] != simpler:
+                yield step[:-1] + (simpler,)
+
+
+def shrink(sequence, fails=_fails):
+    """
+    Shrinks a failing sequence by removing chunks of steps, halving the chunk size whenever no
+    chunk can be removed, and then simplifying the steps that are left, one at a time.
+
+    :param sequence: The failing sequence of steps.
+    :param fails: Called with a sequence, whether it still fails.
+    :return: A sequence that still fails, from which no single step can be removed.
+    """
+    sequence = list(sequence)
+    chunk = max(1, len(sequence) // 2)
+    while True:
+        start = 0
+        removed = False
+        while start < len(sequence):
+            candidate = sequence[:start] + sequence[start + chunk :]
+            if candidate and fails(candidate):
+                sequence = candidate
+                removed = True
+            else:
+                start += chunk
+        if chunk == 1 and not removed:
+            break
+        if not removed:
+            chunk = max(1, chunk // 2)
+
+    for index in range(len(sequence)):
+        for simpler in _simpler_steps(sequence[index]):
+            candidate = sequence[:index] + [simpler] + sequence[index + 1 :]
+            if fails(candidate):
+                sequence = candidate
+                break
+    return sequence
+
+
+def format_step(step):
+    if step[0] == "request":
+        return step[1]
+    if step[0] == "set":
+        return "<backdoor> {} = {!r}".format(step[1], step[2])
+    if step[0] == "call":
+        return "<backdoor> {}({!r})".format(step[1], step[2])
+    return "<cycle> {!r} s".format(step[1])
+
+
+def fuzz(sequences, length=50, seed=0):
+    """
+    Runs random sequences of steps until one fails.
+
+    :return: (shrunk failing sequence, description of its failure, steps run), or
+        (None, None, steps run) if none failed.
+    """
+    rng = random.Random(seed)
+    steps = 0
+    for _ in range(sequences):
+        sequence = random_sequence(rng, length)
+        failure = run_sequence(sequence)
+        if failure is not None:
+            steps += failure[1] + 1
+            shrunk = shrink(sequence[: failure[1] + 1])
+            return shrunk, run_sequence(shrunk)[0], steps
+        steps += length
+    return None, None, steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Keithley 2290 emulator fuzzer")
+    parser.add_argument("--sequences", type=int, default=1000, help="Sequences to run")
+    parser.add_argument("--length", type=int, default=50, help="Steps per sequence")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the random sequences")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    shrunk, failure, steps = fuzz(args.sequences, args.length, args.seed)
+    elapsed = time.perf_counter() - start
+    print("{} steps in {:.1f} s, {:.0f} steps/s".format(steps, elapsed, steps / elapsed))
+    if shrunk is None:
+        print("No failures")
+        return
+    print("Failed: {}".format(failure))
+    for step in shrunk:
+        print("    {}".format(format_step(step)))
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+##################################################
+#
+# Waveform capture
+#
+# Samples the output voltage and current at a fixed rate into a ring buffer that is
+# allocated once, when capture starts, so that memory stays bounded however long it
+# runs. The output is taken to move in a straight line between device cycles, which
+# are much further apart than the samples.
+#
+# The buffer is frozen when the output trips, so that it keeps the samples leading up
+# to the trip until it is re-armed, and it is read in one reply by the WAVE? command.
+#
+##################################################
+
+from array import array
+
+# Samples kept, by default one second's worth at the default rate
+DEFAULT_SIZE = 1000
+DEFAULT_SAMPLE_RATE = 1000.0
+
+
+class WaveformCapture(object):
+    """
+    The latest samples of the output voltage and current, oldest first once read.
+    """
+
+    __slots__ = (
+        "sample_rate",
+        "volts",
+        "currs",
+        "count",
+        "frozen",
+        "_next",
+        "_until_sample",
+        "_volt",
+        "_curr",
+        "_tripped",
+    )
+
+    def __init__(self, sample_rate=DEFAULT_SAMPLE_RATE, size=DEFAULT_SIZE, volt=0.0, curr=0.0):
+        """
+        :param sample_rate: Samples per second of simulated time.
+        :param size: Number of samples kept.
+        :param volt: Output voltage at the start in V, the first sample.
+        :param curr: Output current at the start in A, the first sample.
+        """
+        if sample_rate <= 0 or size < 1:
+            raise ValueError("The sample rate and size of a capture must be positive")
+        self.sample_rate = float(sample_rate)
+        self.volts = array("d", bytes(8 * size))
+        self.currs = array("d", bytes(8 * size))
+        self.count = 0
+        self.frozen = False
+        self._next = 0
+        self._until_sample = 1.0 / self.sample_rate
+        self._volt = volt
+        self._curr = curr
+        self._tripped = False
+        self._add(volt, curr)
+
+    def __len__(self):
+        return len(self.volts)
+
+    def _add(self, volt, curr):
+        index = self._next
+        self.volts[index] = volt
+        self.currs[index] = curr
+        index += 1
+        self._next = 0 if index == len(self.volts) else index
+        if self.count < len(self.volts):
+            self.count += 1
+
+    def advance(self, dt, volt, curr, tripped, curr_at_trip=None):
+        """
+        Adds the samples due over a device cycle, unless the capture is frozen, and freezes it
+        if the output has just tripped.
+
+        :param dt: Simulated time since the last cycle in seconds.
+        :param volt: Output voltage at the end of the cycle in V.
+        :param curr: Output current at the end of the cycle in A.
+        :param tripped: Whether the output is tripped at the end of the cycle.
+        :param curr_at_trip: Current that caused a current trip in A, which took the output
+            current to 0, or None.
+        """
+        tripping = tripped and not self._tripped
+        if tripping and curr_at_trip is not None:
+            curr = curr_at_trip
+
+        if self.frozen:
+            self._volt = volt
+            self._curr = curr
+            self._tripped = tripped
+            return
+
+        period = 1.0 / self.sample_rate
+        until_sample = self._until_sample
+        if until_sample <= dt:
+            start_volt = self._volt
+            start_curr = self._curr
+            volt_slope = (volt - start_volt) / dt
+            curr_slope = (curr - start_curr) / dt
+
+            # Only the last len(self) samples of a long cycle would be kept
+            due = int((dt - until_sample) * self.sample_rate) + 1
+            if due > len(self.volts):
+                until_sample += (due - len(self.volts)) * period
+
+            while until_sample <= dt:
+                self._add(
+                    start_volt + volt_slope * until_sample, start_curr + curr_slope * until_sample
+                )
+                until_sample += period
+        self._until_sample = until_sample - dt
+        self._volt = volt
+        self._curr = curr
+
+        if tripping:
+            # The sample at the trip, which may fall between two of the regular samples
+            self._add(volt, curr)
+            self.frozen = True
+        self._tripped = tripped
+
+    def rearm(self):
+        """
+        Carries on capturing after a trip froze the capture.
+        """
+        self.frozen = False
+
+    def samples(self):
+        """
+        :return: (voltages, currents), each an array of the samples kept, oldest first.
+        """
+        if self.count < len(self.volts):
+            return self.volts[: self.count], self.currs[: self.count]
+        start = self._next
+        return self.volts[start:] + self.volts[:start], self.currs[start:] + self.currs[:start]
+
+    def to_reply(self):
+        """
+        :return: The samples as "<voltages>;<currents>", each separated by ",", oldest first.
+        """
+        volts, currents = self.samples()
+        return "{};{}".format(
+            ",".join(["%g" % volt for volt in volts]), ",".join(["%g" % curr for curr in currents])
+        )
@@ -0,0 +1,33 @@
+class SimulationClock(object):
+    """
+    The device's own clock, which turns the wall-clock time between cycles into simulated time.
+    It can run faster or slower than real time, be paused and be stepped while paused.
+    """
+
+    __slots__ = ("speed", "paused", "time", "_step")
+
+    def __init__(self, speed=1.0):
+        # Simulated seconds per wall-clock second
+        self.speed = speed
+        self.paused = False
+        # Simulated seconds since the device started
+        self.time = 0.0
+        self._step = 0.0
+
+    def step(self, seconds):
+        """
+        Moves the clock on by seconds on the next cycle, whether or not it is paused.
+        """
+        self._step += seconds
+
+    def advance(self, dt):
+        """
+        :param dt: Wall-clock time since the last cycle in seconds.
+        :return: The simulated time since the last cycle in seconds.
+        """
+        simulated_dt = self._step
+        self._step = 0.0
+        if not self.paused:
+            simulated_dt += dt * self.speed
+        self.time += simulated_dt
+        return simulated_dt
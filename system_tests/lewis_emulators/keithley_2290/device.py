@@ -13,13 +13,31 @@
 ##################################################
 
 
+import json
+import os
 from collections import OrderedDict
 
 from lewis.core.logging import has_log
 from lewis.devices import StateMachineDevice
 
+from .clock import SimulationClock
+from .registers import Keithley2290Registers, StandardEventStatus, StatusByte
 from .states import DefaultState
 
+# The capture, fault, metrics, scenario, snapshot and trace modules are imported by the methods
+# that use them, so that creating a device doesn't import what only those features need
+
+# Environment variables naming a snapshot file to load when a device is created and a snapshot
+# in it to restore, e.g. to start the emulator in the state that a test scenario needs
+SNAPSHOT_FILE_VARIABLE = "KHLY2290_SNAPSHOT_FILE"
+SNAPSHOT_VARIABLE = "KHLY2290_SNAPSHOT"
+
+# Setpoints whose commands are counted, see count_setpoint_write
+SETPOINTS = ("volt", "curr_limit", "curr_trip")
+
+# Registers that *RST does not change, or that are compared separately
+_KEPT_ON_RESET = ("event_status_enable", "status")
+
 
 @has_log
 class SimulatedKeithley2290(StateMachineDevice):
@@ -27,213 +45,768 @@ class SimulatedKeithley2290(StateMachineDevice):
     Simulated Keithley2290 High-voltage power supply
     """
 
+    # Called with the status byte when the device requests service, set by the interface
+    service_request_listener = None
+
+    # Counts and times the commands processed by the interface while enabled
+    command_metrics = None
+
+    # Injects faults into the replies and the output while enabled
+    faults = None
+
+    # Called with each reply that a fault delayed once it is due, set by the interface
+    delayed_reply_listener = None
+
+    def __init__(self, snapshot_file=None, snapshot=None, **kwargs):
+        """
+        :param snapshot_file: File of snapshots to load, see snapshots.py, by default the one
+            named by $KHLY2290_SNAPSHOT_FILE if it is set.
+        :param snapshot: Name of the snapshot to restore, by default $KHLY2290_SNAPSHOT if set.
+        :param kwargs: Passed on to StateMachineDevice.
+        """
+        # Snapshot name -> registers, kept by *RST
+        self._snapshots = {}
+        # Scenario name -> compiled scenario, kept by *RST
+        self._scenarios = {}
+        # Setpoint -> number of commands that set it, kept by *RST
+        self._setpoint_writes = dict.fromkeys(SETPOINTS, 0)
+        # Waveform capture of the output while enabled, kept by *RST
+        self._capture = None
+        super(SimulatedKeithley2290, self).__init__(**kwargs)
+
+        if snapshot_file is None:
+            snapshot_file = os.environ.get(SNAPSHOT_FILE_VARIABLE)
+        if snapshot is None:
+            snapshot = os.environ.get(SNAPSHOT_VARIABLE)
+        if snapshot_file:
+            self.load_snapshots(snapshot_file)
+        if snapshot:
+            self.restore_snapshot(snapshot)
+
     def _initialize_data(self):
         """
         Initialize the device's attributes necessary for testing.
         """
-        # Device name - 39 chars max
-        self._idn = "KEITHLEY INSTRUMENTS INC., emulator"
-        self._volt = 0.0
-        self._volt_limit = 10000.0
-        self._curr = 0.0
-        self._curr_limit = 1050.0 * 1e-6
-        self._curr_trip = 1050.0 * 1e-6
-        self._trip_reset_mode = 0
-        self._high_voltage_enable_switch = 1
-        self._error = 0
-        self._execution_error = 0
+        self._registers = Keithley2290Registers()
+        self._status = self._registers.status
+        self._status.on_service_request = self._request_service
+        self._service_request_pending = False
+        self._replay = None
+        self._scenario_run = None
+        # Load current that caused the last current trip, which took the current to 0
+        self._curr_at_trip = 0.0
+        self._clock = SimulationClock()
         self.connected = True
-        # Bit 0 - Stable  - Indicates that the VSET or ILIM value is stable.
-        # Bit 1 - V trip  - Indicates that a voltage trip has occurred.
-        # Bit 2 - I trip  - Indicates that a current trip has occurred.
-        # Bit 3 - I lim   - Indicates that a current limit condition has occurred.
-        # Bit 4 - MAV     - Indicates message available in the GPIB output queue.
-        # Bit 5 - ESB     - Indicates that an unmasked bit in the Standard Event Status Register has been set.
-        # Bit 6 - RQS/MSS - Request for Service/Master Summary Status.
-        # Bit 7 - HV on   - Indicates that the high voltage is on.
-        self._stat_byte = 1
-        self._error = 0
 
     def reset(self):
+        self.stop_replay()
+        self.stop_scenario()
+        # *RST does not change the enable registers, nor the simulation's clock
+        service_request_enable = self._status.service_request_enable
+        event_status_enable = self._registers.event_status_enable
+        clock = self._clock
         self._initialize_data()
+        self._status.service_request_enable = service_request_enable
+        self._registers.event_status_enable = event_status_enable
+        self._clock = clock
+
+    def process(self, dt=0):
+        """
+        Runs a cycle of the device, with the wall-clock time since the last cycle turned into
+        simulated time by the device's clock.
+        """
+        super(SimulatedKeithley2290, self).process(self._clock.advance(dt))
+
+    @property
+    def simulation_speed(self):
+        return self._clock.speed
+
+    @simulation_speed.setter
+    def simulation_speed(self, new_simulation_speed):
+        """Used by Lewis backdoor, simulated seconds per wall-clock second"""
+        self._clock.speed = new_simulation_speed
+
+    @property
+    def simulated_time(self):
+        return self._clock.time
+
+    @property
+    def paused(self):
+        return self._clock.paused
+
+    def pause(self):
+        """Used by Lewis backdoor, stops simulated time until resume or step is called"""
+        self._clock.paused = True
+
+    def resume(self):
+        """Used by Lewis backdoor"""
+        self._clock.paused = False
+
+    def step(self, seconds):
+        """Used by Lewis backdoor, moves simulated time on by seconds in the next cycle"""
+        self._clock.step(seconds)
+
+    def enable_command_metrics(self):
+        """Used by Lewis backdoor, starts counting and timing commands from zero"""
+        from .metrics import CommandMetrics
+
+        self.command_metrics = CommandMetrics()
+
+    def disable_command_metrics(self):
+        """Used by Lewis backdoor"""
+        self.command_metrics = None
+
+    def get_command_metrics(self, format="json"):
+        """
+        Used by Lewis backdoor, the command metrics as "json" or "prometheus" text.
+        """
+        if self.command_metrics is None:
+            return None
+        if format == "prometheus":
+            return self.command_metrics.to_prometheus()
+        return self.command_metrics.to_json()
+
+    @property
+    def command_counts(self):
+        """
+        Used by Lewis backdoor, the number of calls of each command since the command metrics were
+        enabled, as JSON.
+        """
+        if self.command_metrics is None:
+            return None
+        return json.dumps(self.command_metrics.counts(), sort_keys=True)
+
+    @property
+    def requests_received(self):
+        """
+        Used by Lewis backdoor, the number of requests, i.e. round trips, since the command
+        metrics were enabled.
+        """
+        if self.command_metrics is None:
+            return None
+        return self.command_metrics.requests
+
+    def enable_faults(self, seed=0):
+        """Used by Lewis backdoor, starts injecting faults with no faults scheduled"""
+        from .faults import FaultEngine
+
+        self.faults = FaultEngine(seed)
+
+    def disable_faults(self):
+        """Used by Lewis backdoor"""
+        self.faults = None
+
+    def add_fault(self, kind, start=0.0, duration=None, probability=1.0, commands=None, delay=0.0):
+        """
+        Used by Lewis backdoor, schedules a fault, see faults.py. Enables faults if they aren't.
+
+        :param kind: "delay", "drop", "truncate", "garble", "command_error" or "trip".
+        :param start: Seconds of simulated time from now until the fault starts.
+        :param duration: Seconds of simulated time the fault lasts for, or None for ever.
+        :param probability: Chance of each command being hit, or for "trip" of a trip a second.
+        :param commands: Names of the commands that can be hit, e.g. ["get_curr"], or None for all.
+        :param delay: Reply delay in seconds for "delay".
+        """
+        from .faults import Fault
+
+        if self.faults is None:
+            self.enable_faults()
+        start += self._clock.time
+        end = None if duration is None else start + duration
+        self.faults.add(Fault(kind, start, end, probability, commands, delay))
+
+    @property
+    def fault_counts(self):
+        return None if self.faults is None else dict(self.faults.counts)
+
+    def process_faults(self, dt):
+        """
+        Sends the delayed replies that are due and trips the output at random, if faults are
+        enabled. Called once per cycle by the state machine.
+
+        :param dt: Time since the last cycle in seconds.
+        """
+        faults = self.faults
+        if faults is None:
+            return
+
+        now = self._clock.time
+        for reply in faults.due_replies(now):
+            if self.delayed_reply_listener is not None:
+                self.delayed_reply_listener(reply)
+
+        if faults.trips(now, dt):
+            if faults.random_choice((StatusByte.VOLT_TRIP, StatusByte.CURR_TRIP)) == (
+                StatusByte.VOLT_TRIP
+            ):
+                self._status.volt_trip = 1
+            else:
+                self._curr_at_trip = self._registers.curr
+                self._registers.curr = 0
+                self._status.curr_trip = 1
+            self._status.esb = 1
+
+    def enable_capture(self, sample_rate=None, size=None):
+        """
+        Used by Lewis backdoor, starts capturing the output into a new buffer, see capture.py.
+
+        :param sample_rate: Samples per second of simulated time, by default 1000.
+        :param size: Number of samples kept, by default 1000.
+        """
+        from .capture import DEFAULT_SAMPLE_RATE, DEFAULT_SIZE, WaveformCapture
+
+        self._capture = WaveformCapture(
+            DEFAULT_SAMPLE_RATE if sample_rate is None else sample_rate,
+            DEFAULT_SIZE if size is None else size,
+            self._registers.volt,
+            self._registers.curr,
+        )
+
+    def disable_capture(self):
+        """Used by Lewis backdoor"""
+        self._capture = None
+
+    @property
+    def capture_rate(self):
+        return 0.0 if self._capture is None else self._capture.sample_rate
+
+    @capture_rate.setter
+    def capture_rate(self, new_capture_rate):
+        """Used by Lewis backdoor, samples per second, 0 to stop capturing"""
+        if new_capture_rate <= 0:
+            self.disable_capture()
+        else:
+            size = None if self._capture is None else len(self._capture)
+            self.enable_capture(new_capture_rate, size)
+
+    @property
+    def capture_frozen(self):
+        return self._capture is not None and self._capture.frozen
+
+    def rearm_capture(self):
+        """Used by Lewis backdoor, carries on capturing after a trip froze the capture"""
+        if self._capture is not None:
+            self._capture.rearm()
+
+    @property
+    def waveforms(self):
+        """
+        The captured output voltages and currents, see WaveformCapture.to_reply.
+        """
+        if self._capture is None:
+            raise ValueError("Waveform capture is not enabled")
+        return self._capture.to_reply()
+
+    def capture_output(self, dt):
+        """
+        Samples the output over the last cycle, if capture is enabled. Called once per cycle by
+        the state machine.
+
+        :param dt: Time since the last cycle in seconds.
+        """
+        capture = self._capture
+        if capture is None:
+            return
+
+        status = self._status
+        capture.advance(
+            dt,
+            self._registers.volt,
+            self._registers.curr,
+            status.value & StatusByte.TRIPS != 0,
+            self._curr_at_trip if status.curr_trip else None,
+        )
+
+    def run_for(self, seconds, cycle_time=0.1):
+        """
+        Used by Lewis backdoor, runs as many cycles as seconds of simulated time take, one after
+        another without waiting for the wall clock, e.g. to soak the device for a day in minutes.
+
+        :param seconds: Simulated time to run for in seconds.
+        :param cycle_time: Simulated time of each cycle in seconds.
+        """
+        cycles = int(round(seconds / cycle_time))
+        state_machine_process = super(SimulatedKeithley2290, self).process
+        for _ in range(cycles):
+            self._clock.time += cycle_time
+            state_machine_process(cycle_time)
+
+    def _execution_error(self):
+        self._registers.execution_error = 1
+        self._registers.error = 10  # Execution error
+        if self._registers.event_status_enable & StandardEventStatus.EXECUTION_ERROR:
+            self._status.esb = 1
+
+    def reject_command(self):
+        """
+        Sets the command error, for a command that the device did not accept.
+        """
+        self._registers.command_error = 1
+        if self._registers.event_status_enable & StandardEventStatus.COMMAND_ERROR:
+            self._status.esb = 1
+
+    def _request_service(self):
+        """
+        Sets RQS/MSS and sends the status byte to the listener on the next cycle.
+        """
+        self._status.mss = 1
+        self._service_request_pending = True
+
+    def process_service_requests(self):
+        """
+        Sends any pending service request to the listener. Called once per cycle by the state
+        machine, with the device lock held, so the listener must not wait for the line to be
+        sent. It is sent between replies, but can still reach the IOC while a record is waiting
+        for a reply, see get_service_request in devKeithley2290.proto.
+        """
+        if self._service_request_pending:
+            self._service_request_pending = False
+            if self.service_request_listener is not None:
+                self.service_request_listener(self._status.value)
+
+    @property
+    def service_request_enable(self):
+        return self._status.service_request_enable
+
+    @service_request_enable.setter
+    def service_request_enable(self, new_service_request_enable):
+        self._status.service_request_enable = new_service_request_enable & ~StatusByte.MSS
+
+    @property
+    def event_status_enable(self):
+        return self._registers.event_status_enable
+
+    @event_status_enable.setter
+    def event_status_enable(self, new_event_status_enable):
+        self._registers.event_status_enable = new_event_status_enable
 
     def clear_status(self):
-        self._stat_byte = 1
+        self._status.value = StatusByte.STABLE
 
     @property
-    def idn(self):
-        return self._idn
+    def at_defaults(self):
+        """
+        Used by Lewis backdoor, whether the device is as *RST and *CLS would leave it, apart from
+        the enable registers which they do not change, and has none of the faults, capture or
+        clock changes that they keep.
+        """
+        defaults = Keithley2290Registers()
+        clock = self._clock
+        return (
+            self.connected
+            and not self._service_request_pending
+            and self._replay is None
+            and not self.scenario_running
+            and self.faults is None
+            and self._capture is None
+            and clock.speed == 1.0
+            and not clock.paused
+            and self._status.value == defaults.status.value
+            and all(
+                getattr(self._registers, name) == getattr(defaults, name)
+                for name in Keithley2290Registers.__slots__
+                if name not in _KEPT_ON_RESET
+            )
+        )
+
+    def count_setpoint_write(self, setpoint):
+        """
+        Counts a command that sets one of SETPOINTS, called by the interface.
+        """
+        self._setpoint_writes[setpoint] += 1
 
     @property
-    def error(self):
-        return self._error
+    def setpoint_writes(self):
+        """
+        Used by Lewis backdoor, the number of VSET, ILIM and ITRP commands received, to compare
+        with the number of setpoint puts to the IOC, which coalesces them.
+        """
+        return sum(self._setpoint_writes.values())
+
+    @property
+    def setpoint_writes_by_setpoint(self):
+        return dict(self._setpoint_writes)
+
+    def reset_setpoint_writes(self):
+        """Used by Lewis backdoor"""
+        self._setpoint_writes = dict.fromkeys(SETPOINTS, 0)
+
+    def take_snapshot(self, name):
+        """Used by Lewis backdoor, keeps a copy of every register under a name"""
+        self._snapshots[name] = self._registers.as_dict()
+
+    def restore_snapshot(self, name):
+        """
+        Used by Lewis backdoor, sets every register from a snapshot in one call rather than
+        driving the device into that state command by command. Stops any replay and drops any
+        pending service request.
+        """
+        state = self._snapshots.get(name)
+        if state is None:
+            raise ValueError(
+                "No snapshot named {}, there are: {}".format(name, ", ".join(self.snapshot_names))
+            )
+        self.stop_replay()
+        self._registers.restore(state)
+        self._service_request_pending = False
+
+    def delete_snapshot(self, name):
+        """Used by Lewis backdoor"""
+        self._snapshots.pop(name, None)
+
+    @property
+    def snapshot_names(self):
+        return sorted(self._snapshots)
+
+    def save_snapshots(self, path):
+        """Used by Lewis backdoor, writes every snapshot to a file, see snapshots.py"""
+        from .snapshots import save_snapshots
+
+        save_snapshots(path, self._snapshots)
+
+    def load_snapshots(self, path):
+        """Used by Lewis backdoor, adds the snapshots in a file, replacing any of the same name"""
+        from .snapshots import load_snapshots
+
+        self._snapshots.update(load_snapshots(path))
+
+    def load_scenarios(self, path):
+        """
+        Used by Lewis backdoor, compiles the scenarios in a YAML or JSON file, see scenarios.py,
+        replacing any of the same name.
+        """
+        from .scenarios import compile_scenario, load_scenarios
+
+        for name, steps in load_scenarios(path).items():
+            self._scenarios[name] = compile_scenario(name, steps, self)
+
+    def start_scenario(self, name, path=None):
+        """
+        Used by Lewis backdoor, runs a scenario from the next cycle on, stopping any that is
+        running. *RST stops it, as it does a replay.
+
+        :param name: Name of the scenario.
+        :param path: File to load the scenarios from first, or None if they have been loaded.
+        """
+        from .scenarios import ScenarioRun
+
+        if path is not None:
+            self.load_scenarios(path)
+        scenario = self._scenarios.get(name)
+        if scenario is None:
+            raise ValueError(
+                "No scenario named {}, there are: {}".format(name, ", ".join(self.scenario_names))
+            )
+        self._scenario_run = ScenarioRun(scenario)
+
+    def stop_scenario(self):
+        """Used by Lewis backdoor"""
+        self._scenario_run = None
+
+    @property
+    def scenario_names(self):
+        return sorted(self._scenarios)
+
+    @property
+    def scenario_running(self):
+        return self._scenario_run is not None and not self._scenario_run.finished
+
+    @property
+    def scenario_changes_made(self):
+        """
+        Used by Lewis backdoor, the number of changes made by the running or last scenario.
+        """
+        return 0 if self._scenario_run is None else self._scenario_run.changes_made
+
+    def run_scenario(self, dt):
+        """
+        Makes the changes of the running scenario that are due, if one is running. Called at the
+        start of each cycle by the state machine.
+
+        :param dt: Time since the last cycle in seconds.
+        """
+        run = self._scenario_run
+        if run is None or run.finished:
+            return
+
+        for change in run.advance(dt):
+            try:
+                change()
+            except Exception:
+                # Rather than letting it stop the simulation
+                self.log.exception("Scenario %s stopped by a failed change", run.scenario.name)
+                self._scenario_run = None
+                return
+            if self._scenario_run is not run:
+                return  # Stopped by the change, e.g. by a reset
+
+    @property
+    def idn(self):
+        return self._registers.idn
 
     @property
     def volt(self):
-        return self._volt
+        return self._registers.volt
 
     def volt_external(self, new_volt):
         """Used by Lewis backdoor"""
-        if new_volt > self._volt_limit:
+        if new_volt > self._registers.volt_limit:
             new_volt = 0
-            self._stat_byte |= 1 << 1
-            self._stat_byte |= 1 << 5  # Set ESB bit
+            self._status.volt_trip = 1
+            self._status.esb = 1
         else:
-            self._stat_byte &= ~(1 << 1)
+            self._status.volt_trip = 0
 
-        self._volt = new_volt
+        self._registers.volt = new_volt
+        self._registers.volt_setpoint = new_volt
+        self._status.stable = 1
 
     @volt.setter
     def volt(self, new_volt):
         if new_volt > self.volt_limit:
-            self._execution_error = 1
-            self._error = 10
+            self._execution_error()
         else:
-            self._volt = new_volt
+            self._registers.volt_setpoint = new_volt
+            if self._registers.ramp_rate <= 0:
+                self._registers.volt = new_volt
+            self._status.stable = self._registers.volt == new_volt
+
+    @property
+    def volt_setpoint(self):
+        return self._registers.volt_setpoint
+
+    @property
+    def ramp_rate(self):
+        return self._registers.ramp_rate
+
+    @ramp_rate.setter
+    def ramp_rate(self, new_ramp_rate):
+        """Used by Lewis backdoor, slew rate of the output in V/s or 0 to follow immediately"""
+        self._registers.ramp_rate = new_ramp_rate
+
+    @property
+    def load_resistance(self):
+        return self._registers.load_resistance
+
+    @load_resistance.setter
+    def load_resistance(self, new_load_resistance):
+        """Used by Lewis backdoor, load in Ohms or None to set the current directly"""
+        self._registers.load_resistance = new_load_resistance
+
+    def update_output(self, dt):
+        """
+        Moves the output voltage towards the setpoint by at most one cycle's worth of ramp and
+        updates the load current. Called once per cycle by the state machine.
+
+        :param dt: Time since the last cycle in seconds.
+        """
+        if self._replay is not None:
+            self._replay_trace(dt)
+            return
+
+        registers = self._registers
+        volt = registers.volt
+        setpoint = registers.volt_setpoint
+
+        if volt != setpoint:
+            step = registers.ramp_rate * dt
+            if registers.ramp_rate <= 0 or abs(setpoint - volt) <= step:
+                volt = setpoint
+            elif setpoint > volt:
+                volt += step
+            else:
+                volt -= step
+            registers.volt = volt
+            self._status.stable = volt == setpoint
+
+        if registers.load_resistance and not self._status.curr_trip:
+            self.curr = volt / registers.load_resistance
+
+    def insert_mock_data(self, trace_file, speed=1.0):
+        """
+        Used by Lewis backdoor, replays a recorded trace of the output, see trace.py, instead of
+        ramping to the setpoint until the trace ends or stop_replay is called.
+
+        :param trace_file: Path of the trace file.
+        :param speed: Seconds of the trace replayed per second of device time.
+        """
+        from .trace import TraceReplay
+
+        self.stop_replay()
+        self._replay = TraceReplay(trace_file, speed)
+        self.log.info("Replaying %d samples from %s", len(self._replay), trace_file)
+
+    def stop_replay(self):
+        """Used by Lewis backdoor"""
+        if self._replay is not None:
+            self._replay.close()
+            self._replay = None
+
+    @property
+    def replaying(self):
+        return self._replay is not None
+
+    def _replay_trace(self, dt):
+        sample = self._replay.advance(dt)
+        if sample is not None:
+            volt, curr, events = sample
+            self.volt_external(volt)
+            self.curr = curr
+            if events & StatusByte.VOLT_TRIP:
+                self._status.volt_trip = 1
+                self._status.esb = 1
+            if events & StatusByte.CURR_TRIP:
+                self._status.curr_trip = 1
+                self._status.esb = 1
+        if self._replay.finished:
+            self.stop_replay()
 
     @property
     def stable_bit(self):
-        return (self._stat_byte >> 0) & 1  # Reading the register does not cause it to be cleared
+        return self._status.stable  # Reading the register does not cause it to be cleared
 
     @property
     def esb_alert_bit(self):
-        _esb_alert_bit = (self._stat_byte >> 5) & 1
-        self._stat_byte &= ~(1 << 5)  # Reading the register causes it to be cleared
-        return _esb_alert_bit
+        return self._status.read_esb()  # Reading the register causes it to be cleared
 
     @property
     def MSS_bit(self):
-        _MSS_bit = (self._stat_byte >> 6) & 1
-        self._stat_byte &= ~(1 << 6)  # Reading the register causes it to be cleared
-        return _MSS_bit
+        return self._status.read_mss()  # Reading the register causes it to be cleared
 
     @property
     def volt_on_bit(self):
-        return (self._stat_byte >> 7) & 1  # Reading the register does not cause it to be cleared
+        return self._status.hv_on  # Reading the register does not cause it to be cleared
 
     @property
     def high_voltage_enable_switch(self):
-        return self._high_voltage_enable_switch
+        return self._registers.high_voltage_enable_switch
 
     @high_voltage_enable_switch.setter
     def high_voltage_enable_switch(self, enable):
-        self._high_voltage_enable_switch = enable
+        self._registers.high_voltage_enable_switch = enable
 
     @property
     def execution_error(self):
-        old_execution_error = self._execution_error
-        self._execution_error = 0  # Reading the register causes it to be cleared
+        old_execution_error = self._registers.execution_error
+        self._registers.execution_error = 0  # Reading the register causes it to be cleared
         return old_execution_error
 
+    @property
+    def command_error(self):
+        old_command_error = self._registers.command_error
+        self._registers.command_error = 0  # Reading the register causes it to be cleared
+        return old_command_error
+
     @property
     def error(self):
-        old_error = self._error
-        self._error = 0  # Reading the register causes it to be cleared
+        old_error = self._registers.error
+        self._registers.error = 0  # Reading the register causes it to be cleared
         return old_error
 
     @property
     def volt_ON(self):
-        return (self._stat_byte >> 7) & 1
+        return self._status.hv_on
 
     @volt_ON.setter
     def volt_ON(self, new_volt_ON):
-        if new_volt_ON and not self._high_voltage_enable_switch:
-            self._execution_error = 1
-            self._error = 10  # Execution error
-            self._stat_byte |= 1 << 6  # Set MSS bit
+        if new_volt_ON and not self._registers.high_voltage_enable_switch:
+            self._execution_error()
+            self._status.mss = 1
             return
 
-        if new_volt_ON:
-            self._stat_byte |= 1 << 7
-        else:
-            self._stat_byte &= ~(1 << 7)
+        self._status.hv_on = new_volt_ON
 
     @property
     def volt_limit(self):
-        return self._volt_limit
+        return self._registers.volt_limit
 
     @volt_limit.setter
     def volt_limit(self, new_volt_limit):
-        if self._volt > self._volt_limit:
-            self._execution_error = 1
-            self._error = 10
+        # Neither below the output nor below the setpoint it may still be ramping towards
+        if max(self._registers.volt, self._registers.volt_setpoint) > new_volt_limit:
+            self._execution_error()
         else:
-            self._volt_limit = new_volt_limit
+            self._registers.volt_limit = new_volt_limit
 
     @property
     def curr(self):
-        if (self._stat_byte & (1 << 3)) != 0:
-            self._stat_byte |= 1 << 5  # Set ESB bit
-            return self._curr_limit
+        if self._status.curr_limit:
+            self._status.esb = 1
+            return self._registers.curr_limit
         else:
-            return self._curr
+            return self._registers.curr
 
     @curr.setter
     def curr(self, new_curr):
-        if new_curr > self._curr_trip:
+        if new_curr > self._registers.curr_trip:
+            self._curr_at_trip = new_curr
             new_curr = 0
-            self._stat_byte |= 1 << 2
-            self._stat_byte |= 1 << 5  # Set ESB bit
+            self._status.curr_trip = 1
+            self._status.esb = 1
         else:
-            self._stat_byte &= ~(1 << 2)
+            self._status.curr_trip = 0
 
-        if new_curr > self._curr_limit:
-            self._stat_byte |= 1 << 3
-            self._stat_byte |= 1 << 5  # Set ESB bit
-            new_curr = self._curr_limit
+        if new_curr > self._registers.curr_limit:
+            self._status.curr_limit = 1
+            self._status.esb = 1
+            new_curr = self._registers.curr_limit
         else:
-            self._stat_byte &= ~(1 << 3)
-        self._curr = new_curr
+            self._status.curr_limit = 0
+        self._registers.curr = new_curr
 
     @property
     def curr_trip(self):
-        return self._curr_trip
+        return self._registers.curr_trip
 
     @curr_trip.setter
     def curr_trip(self, new_curr_trip):
-        self._curr_trip = new_curr_trip
-        if self._curr > self._curr_trip:
-            self._curr = 0
-            self._stat_byte |= 1 << 2
-            self._stat_byte |= 1 << 5  # Set ESB bit
+        self._registers.curr_trip = new_curr_trip
+        if self._registers.curr > new_curr_trip:
+            self._curr_at_trip = self._registers.curr
+            self._registers.curr = 0
+            self._status.curr_trip = 1
+            self._status.esb = 1
         else:
-            self._stat_byte &= ~(1 << 2)
+            self._status.curr_trip = 0
 
     @property
     def curr_limit(self):
-        return self._curr_limit
+        return self._registers.curr_limit
 
     @curr_limit.setter
     def curr_limit(self, new_curr_limit):
-        self._curr_limit = new_curr_limit
-        if self._curr > self._curr_limit:
-            self._stat_byte |= 1 << 3
-            self._curr = new_curr_limit
+        self._registers.curr_limit = new_curr_limit
+        if self._registers.curr > new_curr_limit:
+            self._status.curr_limit = 1
+            self._status.esb = 1
+            self._registers.curr = new_curr_limit
         else:
-            self._stat_byte &= ~(1 << 3)
+            self._status.curr_limit = 0
 
     @property
     def trip_reset_mode(self):
-        return self._trip_reset_mode
+        return self._registers.trip_reset_mode
 
     @trip_reset_mode.setter
     def trip_reset_mode(self, new_trip_reset_mode):
-        self._trip_reset_mode = new_trip_reset_mode
+        self._registers.trip_reset_mode = new_trip_reset_mode
+
+    @property
+    def setting_mode(self):
+        return self._registers.setting_mode
 
     @property
     def stat_byte(self):
-        return self._stat_byte
+        return self._status.value
 
     @property
     def trip(self):
-        return (self._stat_byte & 6) != 0
+        return (self._status.value & StatusByte.TRIPS) != 0
 
     @trip.setter
     def trip(self, new_trip):
-        if new_trip != 0:
-            self._stat_byte |= 6
-        else:
-            self._stat_byte &= ~6
+        self._status.volt_trip = new_trip != 0
+        self._status.curr_trip = new_trip != 0
 
     def _get_state_handlers(self):
         """
@@ -0,0 +1,140 @@
+import random
+
+# Kinds of fault that act on the reply to a command
+DELAY = "delay"
+DROP = "drop"
+TRUNCATE = "truncate"
+GARBLE = "garble"
+# Commands are rejected with a command error (*ESR? 5) rather than processed
+COMMAND_ERROR = "command_error"
+# The output trips, on voltage or current, at random
+TRIP = "trip"
+
+KINDS = (DELAY, DROP, TRUNCATE, GARBLE, COMMAND_ERROR, TRIP)
+
+_GARBLE_CHARACTERS = "0123456789.+-eE?;*#ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+class Fault(object):
+    """
+    A fault that is active from start until end in simulated time.
+    """
+
+    __slots__ = ("kind", "start", "end", "probability", "commands", "delay")
+
+    def __init__(self, kind, start, end, probability, commands, delay):
+        """
+        :param kind: One of KINDS.
+        :param start: Simulated time the fault starts at, in seconds.
+        :param end: Simulated time the fault ends at, in seconds, or None for never.
+        :param probability: Chance of the fault hitting each command, or for TRIP of the output
+            tripping in each second.
+        :param commands: Names of the commands that the fault can hit, e.g. "get_curr", or None
+            for all of them.
+        :param delay: Reply delay in seconds, for DELAY.
+        """
+        if kind not in KINDS:
+            raise ValueError("Unknown fault {}, expected one of {}".format(kind, ", ".join(KINDS)))
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.probability = probability
+        self.commands = None if commands is None else frozenset(commands)
+        self.delay = delay
+
+    def is_active(self, time):
+        return self.start <= time and (self.end is None or time < self.end)
+
+    def applies_to(self, command, time):
+        return self.is_active(time) and (self.commands is None or command in self.commands)
+
+
+class FaultEngine(object):
+    """
+    Injects scheduled faults into the replies and the output of the device. All of the random
+    decisions come from one seeded generator, so a run with the same seed, schedule and
+    requests injects the same faults.
+    """
+
+    def __init__(self, seed=0):
+        self._random = random.Random(seed)
+        self.faults = []
+        # Replies held back by DELAY faults, as (due time, reply)
+        self._delayed = []
+        # Number of times each kind of fault has been injected
+        self.counts = dict.fromkeys(KINDS, 0)
+
+    def add(self, fault):
+        self.faults.append(fault)
+
+    def _hits(self, kind, command, time):
+        for fault in self.faults:
+            if (
+                fault.kind == kind
+                and fault.applies_to(command, time)
+                and self._random.random() < fault.probability
+            ):
+                self.counts[kind] += 1
+                return fault
+        return None
+
+    def rejects(self, command, time):
+        """
+        :return: Whether the command is rejected with a command error instead of being processed.
+        """
+        return self._hits(COMMAND_ERROR, command, time) is not None
+
+    def apply(self, command, reply, time):
+        """
+        Applies the faults to the reply to a command.
+
+        :return: The reply to send now, which is None if it is dropped or delayed.
+        """
+        if reply is None:
+            return None
+
+        if self._hits(DROP, command, time) is not None:
+            return None
+
+        reply = str(reply)
+        if reply and self._hits(TRUNCATE, command, time) is not None:
+            reply = reply[: self._random.randrange(len(reply))]
+        if reply and self._hits(GARBLE, command, time) is not None:
+            position = self._random.randrange(len(reply))
+            reply = (
+                reply[:position] + self._random.choice(_GARBLE_CHARACTERS) + reply[position + 1 :]
+            )
+
+        fault = self._hits(DELAY, command, time)
+        if fault is not None:
+            self._delayed.append((time + fault.delay, reply))
+            return None
+        return reply
+
+    def due_replies(self, time):
+        """
+        :return: The delayed replies that are due by the given simulated time, oldest first.
+        """
+        if not self._delayed:
+            return []
+        due = [reply for due_time, reply in self._delayed if due_time <= time]
+        if due:
+            self._delayed = [delayed for delayed in self._delayed if delayed[0] > time]
+        return due
+
+    def trips(self, time, dt):
+        """
+        :return: Whether the output trips during a cycle of dt seconds ending at time.
+        """
+        for fault in self.faults:
+            if (
+                fault.kind == TRIP
+                and fault.is_active(time)
+                and self._random.random() < fault.probability * dt
+            ):
+                self.counts[TRIP] += 1
+                return True
+        return False
+
+    def random_choice(self, options):
+        return self._random.choice(options)
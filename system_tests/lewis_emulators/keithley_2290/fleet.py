@@ -0,0 +1,337 @@
+##################################################
+#
+# Fleet model
+#
+# Simulates many 2290 channels at once, with the readbacks, limits, trips and status
+# bytes of all of them held in NumPy arrays and stepped together each tick. Each
+# channel is also a SimulatedKeithley2290 whose registers are views onto the arrays,
+# so it can be bound to the usual stream interface and answers commands in the same
+# way as a separate device.
+#
+# Channels can share an interlock: a trip on any channel of a group switches off the
+# high voltage of every channel in the group.
+#
+# The channels share the fleet's clock, so changing the simulation speed of one, or
+# pausing or stepping it, does the same to all of them. A channel running a scenario,
+# injecting faults, capturing its output or replaying a trace is also cycled on its own
+# for those, in the same order as a separate device, after the fleet's tick.
+#
+# Requires NumPy, which the rest of the emulator does not. It is imported when a fleet
+# is created rather than with the module, as Lewis imports every module of the
+# emulator when it starts and NumPy takes longer to import than the rest of it.
+#
+##################################################
+
+import math
+
+from .clock import SimulationClock
+from .device import SimulatedKeithley2290
+from .registers import Keithley2290Registers, StatusByte
+
+# No interlock group
+NO_INTERLOCK = -1
+
+
+def _array_field(name, convert):
+    """
+    Creates a property for one channel's element of one of the fleet's arrays.
+    """
+
+    def getter(self):
+        return convert(getattr(self._fleet, name)[self._index])
+
+    def setter(self, new_value):
+        getattr(self._fleet, name)[self._index] = new_value
+
+    return property(getter, setter)
+
+
+def _load_resistance_getter(self):
+    load_resistance = float(self._fleet.load_resistance[self._index])
+    return None if math.isnan(load_resistance) else load_resistance
+
+
+def _load_resistance_setter(self, new_load_resistance):
+    self._fleet.load_resistance[self._index] = (
+        math.nan if new_load_resistance is None else new_load_resistance
+    )
+
+
+class ChannelStatusByte(StatusByte):
+    """
+    The status byte of one channel of a fleet.
+    """
+
+    __slots__ = ("_fleet", "_index")
+
+    value = _array_field("status", int)
+    service_request_enable = _array_field("service_request_enable", int)
+
+    def __init__(self, fleet, index):
+        self._fleet = fleet
+        self._index = index
+        super(ChannelStatusByte, self).__init__()
+
+
+class ChannelRegisters(Keithley2290Registers):
+    """
+    The registers of one channel of a fleet. The ones that the fleet steps each tick are kept
+    in its arrays, the rest are kept in the channel.
+    """
+
+    __slots__ = ("_fleet", "_index")
+
+    volt = _array_field("volt", float)
+    volt_setpoint = _array_field("volt_setpoint", float)
+    volt_limit = _array_field("volt_limit", float)
+    ramp_rate = _array_field("ramp_rate", float)
+    load_resistance = property(_load_resistance_getter, _load_resistance_setter)
+    curr = _array_field("curr", float)
+    curr_limit = _array_field("curr_limit", float)
+    curr_trip = _array_field("curr_trip", float)
+
+    def __init__(self, fleet, index):
+        self._fleet = fleet
+        self._index = index
+        super(ChannelRegisters, self).__init__()
+        self.status = ChannelStatusByte(fleet, index)
+
+
+class FleetChannel(SimulatedKeithley2290):
+    """
+    One channel of a fleet, which answers commands like a separate device but whose output is
+    stepped by the fleet.
+    """
+
+    # Load current that caused the last current trip, which the fleet sets when it trips
+    _curr_at_trip = _array_field("curr_at_trip", float)
+
+    def __init__(self, fleet, index):
+        self._fleet = fleet
+        self._index = index
+        super(FleetChannel, self).__init__()
+
+    def _initialize_data(self):
+        super(FleetChannel, self)._initialize_data()
+        self._registers = ChannelRegisters(self._fleet, self._index)
+        self._status = self._registers.status
+        self._status.on_service_request = self._request_service
+        self._clock = self._fleet.clock
+
+    def _request_service(self):
+        super(FleetChannel, self)._request_service()
+        self._fleet.pending_service_requests.add(self._index)
+
+    def process(self, dt=0):
+        """
+        The fleet cycles all of its channels at once, see Fleet.process.
+        """
+        raise RuntimeError("The channels of a fleet are cycled by Fleet.process")
+
+    def run_for(self, seconds, cycle_time=0.1):
+        """
+        Used by Lewis backdoor, runs the whole fleet for seconds of simulated time, see
+        Fleet.run_for.
+        """
+        self._fleet.run_for(seconds, cycle_time)
+
+    def update_output(self, dt):
+        """
+        Replays the trace of the output, if one is being replayed. The fleet steps the output of
+        all of its channels otherwise, see Fleet.tick.
+        """
+        if self._replay is not None:
+            self._replay_trace(dt)
+
+    def enable_faults(self, seed=0):
+        super(FleetChannel, self).enable_faults(seed)
+        self._fleet.active_channels.add(self._index)
+
+    def enable_capture(self, sample_rate=None, size=None):
+        super(FleetChannel, self).enable_capture(sample_rate, size)
+        self._fleet.active_channels.add(self._index)
+
+    def insert_mock_data(self, trace_file, speed=1.0):
+        super(FleetChannel, self).insert_mock_data(trace_file, speed)
+        self._fleet.active_channels.add(self._index)
+
+    def start_scenario(self, name, path=None):
+        super(FleetChannel, self).start_scenario(name, path)
+        self._fleet.active_channels.add(self._index)
+
+    @property
+    def _active(self):
+        """
+        Whether the channel has anything to do in a cycle besides what the fleet does for it.
+        """
+        return (
+            self.scenario_running
+            or self.faults is not None
+            or self._capture is not None
+            or self._replay is not None
+        )
+
+    @property
+    def interlock_group(self):
+        return int(self._fleet.interlock_group[self._index])
+
+    @interlock_group.setter
+    def interlock_group(self, new_interlock_group):
+        """Used by Lewis backdoor, channels in the same group trip together, -1 for none"""
+        self._fleet.interlock_group[self._index] = new_interlock_group
+
+
+class Fleet(object):
+    """
+    Many 2290 channels simulated together, applying the same ramp, limit, trip and ESB rules as
+    SimulatedKeithley2290 with array operations.
+    """
+
+    def __init__(self, channel_count):
+        import numpy as np
+
+        self.volt = np.empty(channel_count)
+        self.volt_setpoint = np.empty(channel_count)
+        self.volt_limit = np.empty(channel_count)
+        self.ramp_rate = np.empty(channel_count)
+        self.load_resistance = np.empty(channel_count)
+        self.curr = np.empty(channel_count)
+        self.curr_limit = np.empty(channel_count)
+        self.curr_trip = np.empty(channel_count)
+        self.curr_at_trip = np.empty(channel_count)
+        self.status = np.empty(channel_count, dtype=np.uint8)
+        self.service_request_enable = np.zeros(channel_count, dtype=np.uint8)
+        self.interlock_group = np.full(channel_count, NO_INTERLOCK)
+
+        # Channels that have requested service since the last cycle
+        self.pending_service_requests = set()
+        # Channels that may be active, see FleetChannel._active
+        self.active_channels = set()
+        self.clock = SimulationClock()
+
+        # Each channel fills in its defaults
+        self.channels = [FleetChannel(self, index) for index in range(channel_count)]
+
+    def __len__(self):
+        return len(self.channels)
+
+    def process(self, dt):
+        """
+        Runs a cycle of the fleet and sends the service requests of its channels.
+
+        :param dt: Wall-clock time since the last cycle in seconds.
+        """
+        self._cycle(self.clock.advance(dt))
+
+    def run_for(self, seconds, cycle_time=0.1):
+        """
+        Runs as many cycles as seconds of simulated time take, one after another without waiting
+        for the wall clock.
+
+        :param seconds: Simulated time to run for in seconds.
+        :param cycle_time: Simulated time of each cycle in seconds.
+        """
+        for _ in range(int(round(seconds / cycle_time))):
+            self.clock.time += cycle_time
+            self._cycle(cycle_time)
+
+    def _cycle(self, dt):
+        """
+        Runs a cycle of every channel, the scenarios first and the faults, capture and replays
+        after the tick, as DefaultState does for a separate device.
+
+        :param dt: Simulated time since the last cycle in seconds.
+        """
+        active = [self.channels[index] for index in sorted(self.active_channels)]
+        for channel in active:
+            channel.run_scenario(dt)
+        self.tick(dt)
+        for channel in active:
+            channel.update_output(dt)
+            channel.process_faults(dt)
+            channel.capture_output(dt)
+            if not channel._active:
+                self.active_channels.discard(channel._index)
+
+        pending = self.pending_service_requests
+        if pending:
+            self.pending_service_requests = set()
+            for index in sorted(pending):
+                self.channels[index].process_service_requests()
+
+    def tick(self, dt):
+        """
+        Moves every channel's output towards its setpoint, updates the load currents with their
+        trips and limits, applies the interlocks and requests service for the status bits that
+        have been set.
+
+        :param dt: Simulated time since the last tick in seconds.
+        """
+        import numpy as np
+
+        status = self.status
+        old_status = status.copy()
+        volt = self.volt
+        setpoint = self.volt_setpoint
+
+        moving = volt != setpoint
+        if moving.any():
+            ramp_rate = self.ramp_rate
+            difference = setpoint - volt
+            arrived = moving & ((ramp_rate <= 0) | (np.abs(difference) <= ramp_rate * dt))
+            ramping = moving & ~arrived
+            volt[arrived] = setpoint[arrived]
+            volt[ramping] += np.sign(difference[ramping]) * ramp_rate[ramping] * dt
+            stable = volt == setpoint
+            status[moving & stable] |= StatusByte.STABLE
+            status[moving & ~stable] &= ~StatusByte.STABLE & 0xFF
+
+        load_resistance = self.load_resistance
+        loaded = (
+            ~np.isnan(load_resistance)
+            & (load_resistance != 0)
+            & (status & StatusByte.CURR_TRIP == 0)
+        )
+        if loaded.any():
+            curr = volt[loaded] / load_resistance[loaded]
+            tripped = curr > self.curr_trip[loaded]
+            curr_at_trip = self.curr_at_trip[loaded]
+            curr_at_trip[tripped] = curr[tripped]
+            self.curr_at_trip[loaded] = curr_at_trip
+            curr[tripped] = 0
+            limited = curr > self.curr_limit[loaded]
+            curr[limited] = self.curr_limit[loaded][limited]
+            self.curr[loaded] = curr
+
+            loaded_status = status[loaded]
+            loaded_status[tripped] |= StatusByte.CURR_TRIP | StatusByte.ESB
+            loaded_status[limited] |= StatusByte.CURR_LIMIT | StatusByte.ESB
+            loaded_status[~limited] &= ~StatusByte.CURR_LIMIT & 0xFF
+            status[loaded] = loaded_status
+
+        self._apply_interlocks()
+
+        rising = status & ~old_status & self.service_request_enable
+        for index in np.flatnonzero(rising):
+            self.channels[index]._status.on_service_request()
+
+    def _apply_interlocks(self):
+        """
+        Switches off the high voltage of every channel in an interlock group with a tripped
+        channel.
+        """
+        import numpy as np
+
+        status = self.status
+        grouped = self.interlock_group != NO_INTERLOCK
+        tripped = grouped & (status & StatusByte.TRIPS != 0)
+        if not tripped.any():
+            return
+
+        interlocked = np.isin(self.interlock_group, self.interlock_group[tripped])
+        switched_off = interlocked & (status & StatusByte.HV_ON != 0)
+        if switched_off.any():
+            self.volt[switched_off] = 0
+            self.volt_setpoint[switched_off] = 0
+            status[switched_off] &= ~StatusByte.HV_ON & 0xFF
+            status[switched_off] |= StatusByte.STABLE | StatusByte.ESB
@@ -0,0 +1,210 @@
+##################################################
+#
+# Multi-device host
+#
+# Runs many simulated Keithley 2290s in one process, each on its own TCP port,
+# with one asyncio event loop serving all of the connections and device cycles.
+#
+# Usage, from the system_tests directory:
+#     python -m lewis_emulators.keithley_2290.host --devices 40 --port 57000 --backdoor-port 58000
+#
+# Device i listens on port + i and, if enabled, has its own Lewis backdoor on
+# backdoor-port + i that exposes it as "device", like a separate Lewis process would.
+#
+# Faults can be injected into every device from the start with e.g.
+#     --fault drop:0.01 --fault delay:0.05:0.9 --fault-seed 1
+# where each --fault is kind:probability[:delay], see faults.py.
+#
+# With --fleet, the devices are the channels of one fleet, see fleet.py, whose outputs
+# are stepped together with NumPy rather than one device at a time.
+#
+##################################################
+
+import argparse
+import asyncio
+import inspect
+import time
+
+from lewis.core.control_server import ControlServer, ExposedObject
+from lewis.core.logging import has_log
+
+from .device import SimulatedKeithley2290
+from .interfaces import Keithley2290StreamInterface
+from .interfaces.asyncio_stream import AsyncioStreamServer
+
+# Members hidden from the backdoors: those that the devices inherit from Lewis, as a Lewis
+# process hides them, but not those that the channels of a fleet inherit from the device
+_BACKDOOR_EXCLUDE = sorted(
+    {name for base in inspect.getmro(SimulatedKeithley2290)[1:] for name in dir(base)}
+)
+
+
+@has_log
+class DeviceHost(object):
+    """
+    Hosts several simulated devices in one process on consecutive TCP ports.
+    """
+
+    def __init__(
+        self,
+        device_count,
+        port,
+        backdoor_port=None,
+        bind_address="127.0.0.1",
+        cycle_delay=0.1,
+        fleet=False,
+    ):
+        self.port = port
+        self.backdoor_port = backdoor_port
+        self.bind_address = bind_address
+        self.cycle_delay = cycle_delay
+
+        self.fleet = None
+        if fleet:
+            # Only imported when needed, as it is the only part of the emulator that uses NumPy
+            from .fleet import Fleet
+
+            self.fleet = Fleet(device_count)
+            devices = self.fleet.channels
+        else:
+            devices = [SimulatedKeithley2290() for _ in range(device_count)]
+
+        self.devices = []
+        self.interfaces = []
+        for device in devices:
+            interface = Keithley2290StreamInterface()
+            interface.device = device
+            self.devices.append(device)
+            self.interfaces.append(interface)
+
+        self._servers = []
+        self._control_servers = []
+        self._running = False
+
+    async def start(self):
+        """
+        Starts listening on all of the device and backdoor ports.
+        """
+        for index, interface in enumerate(self.interfaces):
+            server = AsyncioStreamServer(interface, self.bind_address, self.port + index)
+            await server.start()
+            self._servers.append(server)
+
+            if self.backdoor_port is not None:
+                control_server = ControlServer(
+                    {"device": ExposedObject(interface.device, exclude=_BACKDOOR_EXCLUDE)},
+                    "{}:{}".format(self.bind_address, self.backdoor_port + index),
+                )
+                control_server.start_server()
+                self._control_servers.append(control_server)
+
+        self.log.info(
+            "Hosting %d devices on ports %d-%d",
+            len(self.devices),
+            self.port,
+            self.port + len(self.devices) - 1,
+        )
+
+    async def run(self):
+        """
+        Starts the servers and runs the device cycles until stopped.
+        """
+        await self.start()
+        self._running = True
+        last_cycle = time.monotonic()
+        try:
+            while self._running:
+                await asyncio.sleep(self.cycle_delay)
+                now = time.monotonic()
+                self.process(now - last_cycle)
+                last_cycle = now
+        finally:
+            await self.stop()
+
+    def process(self, delta):
+        """
+        Runs one cycle of every device and handles any pending backdoor requests.
+
+        :param delta: Time since the last cycle in seconds.
+        """
+        if self.fleet is not None:
+            self.fleet.process(delta)
+        else:
+            for device in self.devices:
+                device.process(delta)
+        for control_server in self._control_servers:
+            control_server.process()
+
+    async def stop(self):
+        """
+        Stops listening on all of the device and backdoor ports, so that they can be bound again.
+        """
+        self._running = False
+        for server in self._servers:
+            await server.stop()
+        self._servers = []
+        for control_server in self._control_servers:
+            _stop_control_server(control_server)
+        self._control_servers = []
+
+
+def _stop_control_server(control_server):
+    """
+    Closes the socket of a backdoor. Lewis' ControlServer has no way of stopping, as a Lewis
+    process only ever stops by exiting.
+    """
+    socket = control_server._socket
+    if socket is not None:
+        control_server._socket = None
+        socket.close(linger=0)
+        socket.context.term()
+
+
+def _fault(value):
+    kind, probability, delay = (value.split(":") + ["0"])[:3]
+    return kind, float(probability), float(delay)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many simulated Keithley 2290s")
+    parser.add_argument("-n", "--devices", type=int, default=1, help="Number of devices")
+    parser.add_argument("-p", "--port", type=int, default=57000, help="Port of the first device")
+    parser.add_argument(
+        "-b", "--backdoor-port", type=int, default=None, help="Backdoor port of the first device"
+    )
+    parser.add_argument("--bind-address", default="127.0.0.1")
+    parser.add_argument("--cycle-delay", type=float, default=0.1, help="Seconds between cycles")
+    parser.add_argument(
+        "--fault",
+        type=_fault,
+        action="append",
+        default=[],
+        help="Fault to inject into every device, as kind:probability[:delay]",
+    )
+    parser.add_argument("--fault-seed", type=int, default=0, help="Seed of the first device")
+    parser.add_argument(
+        "--fleet", action="store_true", help="Simulate the devices as one fleet, needs NumPy"
+    )
+    args = parser.parse_args()
+
+    host = DeviceHost(
+        args.devices,
+        args.port,
+        args.backdoor_port,
+        args.bind_address,
+        args.cycle_delay,
+        args.fleet,
+    )
+    if args.fault:
+        for index, device in enumerate(host.devices):
+            device.enable_faults(args.fault_seed + index)
+            for kind, probability, delay in args.fault:
+                device.add_fault(kind, probability=probability, delay=delay)
+    try:
+        asyncio.run(host.run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,3 @@
-from .stream_interface import Keithley2290StreamInterface
+from .stream_interface import Keithley2290AsyncioStreamInterface, Keithley2290StreamInterface
 
-__all__ = ["Keithley2290StreamInterface"]
+__all__ = ["Keithley2290AsyncioStreamInterface", "Keithley2290StreamInterface"]
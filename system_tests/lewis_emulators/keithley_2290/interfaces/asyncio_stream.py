@@ -0,0 +1,191 @@
+import asyncio
+import inspect
+import threading
+import time
+
+from lewis.core.adapters import Adapter
+from lewis.core.logging import has_log
+
+from .replies import ReplyEncoder
+
+
+def process_request(interface, request):
+    """
+    Processes a request in the same way as the Lewis stream handler does.
+
+    :param interface: The stream interface bound to the device.
+    :param request: The request as bytes, without terminator.
+    :return: The reply or None if there is nothing to send back.
+    """
+    try:
+        cmd = next((cmd for cmd in interface.bound_commands if cmd.can_process(request)), None)
+        if cmd is None:
+            raise RuntimeError("None of the device's commands matched.")
+        return cmd.process_request(request)
+    except Exception as error:
+        return interface.handle_error(request, error)
+
+
+@has_log
+class AsyncioStreamServer(object):
+    """
+    Serves a stream interface over TCP from an asyncio event loop, answering each request as
+    soon as its terminator arrives. Any number of clients can be connected at once, e.g. an
+    IOC, a diagnostic console and a monitoring scraper, each getting the replies to its own
+    requests. Unsolicited lines, such as service requests, are sent to all of them.
+    """
+
+    def __init__(self, interface, bind_address, port, device_lock=None):
+        """
+        :param interface: The stream interface, already bound to its device.
+        :param bind_address: Address to listen on.
+        :param port: Port to listen on.
+        :param device_lock: Lock held while processing a request, for a device that is also
+            used by another thread.
+        """
+        self.interface = interface
+        self.bind_address = bind_address
+        self.port = port
+        self.device_lock = threading.Lock() if device_lock is None else device_lock
+
+        self._in_terminator = interface.in_terminator.encode()
+        self._encoder = ReplyEncoder(
+            interface.out_terminator, getattr(interface, "constant_replies", ())
+        )
+        self._server = None
+        self._loop = None
+        self._loop_thread = None
+        self._writers = set()
+
+    @property
+    def client_count(self):
+        return len(self._writers)
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._server = await asyncio.start_server(self._serve, self.bind_address, self.port)
+        self.interface.handler = self
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._writers):
+            writer.close()
+        await self._server.wait_closed()
+        self._server = None
+        # Let the connection handlers see their clients closing
+        await asyncio.sleep(0)
+
+    def unsolicited_reply(self, reply):
+        """
+        Sends a line to every client, from any thread.
+        """
+        if self._loop is None:
+            return
+        if threading.get_ident() == self._loop_thread:
+            self._broadcast(reply)
+        else:
+            self._loop.call_soon_threadsafe(self._broadcast, reply)
+
+    def _broadcast(self, reply):
+        line = self._encoder.encode(reply)
+        for writer in self._writers:
+            writer.write(line)
+
+    async def _serve(self, reader, writer):
+        self._writers.add(writer)
+        try:
+            while True:
+                request = await reader.readuntil(self._in_terminator)
+                with self.device_lock:
+                    reply = process_request(self.interface, request[: -len(self._in_terminator)])
+                if reply is not None:
+                    writer.write(self._encoder.encode(reply))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+
+class AsyncioStreamAdapter(Adapter):
+    """
+    Serves a stream interface from an asyncio event loop, so that requests are answered as soon
+    as they arrive rather than on the next cycle of the simulation, and so that any number of
+    clients can be connected to the device at once.
+
+    Lewis 1.4 and later run each adapter in an event loop of their own and await its methods,
+    in which case the server runs in that loop. Earlier versions call them from the simulation's
+    cycle, in which case the server runs in a thread of its own.
+    """
+
+    default_options = {"bind_address": "0.0.0.0", "port": 9999}
+
+    def __init__(self, options=None):
+        super(AsyncioStreamAdapter, self).__init__(options)
+        self._server = None
+        self._loop = None
+        self._thread = None
+
+    def _create_server(self):
+        self._server = AsyncioStreamServer(
+            self.interface, self._options.bind_address, self._options.port, self.device_lock
+        )
+        return self._server
+
+    if inspect.iscoroutinefunction(Adapter.handle):
+
+        async def start_server(self):
+            if self._server is not None:
+                return
+            await self._create_server().start()
+            self.log.info("Listening on %s:%s", self._options.bind_address, self._options.port)
+
+        async def stop_server(self):
+            if self._server is None:
+                return
+            await self._server.stop()
+            self._server = None
+
+        async def handle(self, cycle_delay=0.1):
+            """
+            Requests are handled by the server as they arrive, so there is nothing to do in the
+            adapter's loop but wait.
+            """
+            await asyncio.sleep(cycle_delay)
+
+    else:
+
+        def start_server(self):
+            if self._server is not None:
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+            self._thread.start()
+            asyncio.run_coroutine_threadsafe(self._create_server().start(), self._loop).result()
+            self.log.info("Listening on %s:%s", self._options.bind_address, self._options.port)
+
+        def stop_server(self):
+            if self._server is None:
+                return
+            asyncio.run_coroutine_threadsafe(self._server.stop(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._server = None
+            self._loop = None
+            self._thread = None
+
+        def handle(self, cycle_delay=0.1):
+            """
+            Requests are handled by the server's own thread as they arrive, so there is nothing
+            to do in the simulation's cycle but wait.
+            """
+            time.sleep(cycle_delay)
+
+    @property
+    def is_running(self):
+        return self._server is not None
@@ -0,0 +1,157 @@
+import re
+
+from lewis.adapters.stream import PatternMatcher, regex
+
+# Characters that end the literal text at the start of a regular expression
+_SPECIAL_CHARACTERS = set("()[]{}|^$.*+?")
+_QUANTIFIERS = set("*+?{")
+
+
+def _literal_prefix(pattern):
+    """
+    Splits a regular expression into the literal text it starts with and the rest of it.
+
+    :param pattern: The regular expression, as built by CmdBuilder.
+    :return: (literal prefix, rest of the pattern)
+    """
+    literal = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "\\" and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+            literal.append(pattern[i + 1])
+            i += 2
+        elif char == "\\" or char in _SPECIAL_CHARACTERS:
+            break
+        else:
+            literal.append(char)
+            i += 1
+
+    if i < len(pattern) and pattern[i] in _QUANTIFIERS and literal:
+        # The last character is optional or repeated, so it isn't part of the prefix
+        literal.pop()
+        i -= 2 if pattern[i - 2 : i - 1] == "\\" else 1
+
+    return "".join(literal), pattern[i:]
+
+
+class MnemonicMatcher(PatternMatcher):
+    """
+    Finds the bound command for a request from its mnemonic with dictionary lookups instead of
+    trying every regular expression in turn.
+
+    Commands without arguments, e.g. "*STB? 0", are looked up by the whole request. Commands
+    with arguments, e.g. "VSET 100", are looked up by their literal prefix and only those
+    commands' expressions are then used to parse the arguments. Commands whose pattern doesn't
+    start with literal text, e.g. batched queries, are tried in turn after that, so every
+    request that can be processed goes through the dispatcher.
+    """
+
+    def __init__(self, bound_commands):
+        super(MnemonicMatcher, self).__init__("<mnemonic dispatch>")
+
+        self._exact = {}
+        self._by_prefix = {}
+        self._unindexed = []
+
+        for cmd in bound_commands:
+            matcher = cmd.matcher
+            if type(matcher) is not regex or matcher.compiled_pattern.flags & re.IGNORECASE:
+                self._unindexed.append(cmd)
+                continue
+
+            prefix, rest = _literal_prefix(matcher.pattern)
+            if not prefix:
+                self._unindexed.append(cmd)
+                continue
+
+            prefix = prefix.encode()
+            if rest in ("", "$"):
+                self._exact.setdefault(prefix, cmd)
+            if rest != "$":
+                self._by_prefix.setdefault(prefix, []).append(cmd)
+
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._by_prefix}, reverse=True)
+
+        self._last_request = None
+        self._last_cmd = None
+
+    @property
+    def arg_count(self):
+        return 2
+
+    @property
+    def argument_mappings(self):
+        return None
+
+    def find(self, request):
+        """
+        Finds the bound command that processes a request.
+
+        :param request: The request as bytes, without terminator.
+        :return: The bound command or None if no command can process the request.
+        """
+        if request is self._last_request:
+            return self._last_cmd
+
+        cmd = self._exact.get(request)
+        if cmd is None:
+            cmd = next(
+                (
+                    candidate
+                    for length in self._prefix_lengths
+                    for candidate in self._by_prefix.get(request[:length], ())
+                    if candidate.can_process(request)
+                ),
+                None,
+            )
+        if cmd is None:
+            cmd = next((cmd for cmd in self._unindexed if cmd.can_process(request)), None)
+
+        self._last_request = request
+        self._last_cmd = cmd
+        return cmd
+
+    def match(self, request):
+        cmd = self.find(request)
+        return None if cmd is None else [cmd, request]
+
+
+class AnyRequest(PatternMatcher):
+    """
+    Matches every request, to catch the ones that no command matched.
+    """
+
+    def __init__(self):
+        super(AnyRequest, self).__init__("<any request>")
+
+    @property
+    def arg_count(self):
+        return 1
+
+    @property
+    def argument_mappings(self):
+        return None
+
+    def match(self, request):
+        return [request]
+
+
+class LazyCommands(object):
+    """
+    The commands of a stream interface, built the first time they are used rather than when the
+    interface is defined. Lewis imports the interfaces of every emulator it discovers, so this
+    saves compiling the commands' regular expressions unless the interface is actually bound.
+    """
+
+    def __init__(self, build):
+        """
+        :param build: Function that returns the commands.
+        """
+        self._build = build
+        self._commands = None
+
+    def __get__(self, instance, owner):
+        if self._commands is None:
+            self._commands = self._build()
+        return self._commands
@@ -0,0 +1,52 @@
+##################################################
+#
+# Reply encoding
+#
+# Turns the replies of the stream interface into the lines sent, terminator included.
+# The lines of the replies that repeat exactly are built once and the same bytes object
+# is sent again: the integers, which cover the status byte, its bits and the error
+# codes, and the constant strings such as the identity. Floats are formatted every
+# time, as a line kept for 0.0 would also be sent for -0.0, which is equal to it.
+#
+##################################################
+
+# Integer replies below this, which covers the status byte, are encoded up front
+_ENCODED_INTS = 256
+
+# Terminator -> the lines of the integer replies, shared by every encoder using the terminator
+_int_lines = {}
+
+
+class ReplyEncoder(object):
+    """
+    Encodes replies into lines, reusing the lines of the integer and constant replies.
+    """
+
+    __slots__ = ("terminator", "_ints", "_constants")
+
+    def __init__(self, out_terminator, constants=()):
+        """
+        :param out_terminator: Terminator of each line, as a str.
+        :param constants: String replies whose lines are built up front, e.g. the identity.
+        """
+        self.terminator = out_terminator.encode()
+        self._ints = _int_lines.get(self.terminator)
+        if self._ints is None:
+            self._ints = _int_lines[self.terminator] = tuple(
+                b"%d" % value + self.terminator for value in range(_ENCODED_INTS)
+            )
+        self._constants = {reply: reply.encode() + self.terminator for reply in constants}
+
+    def encode(self, reply):
+        """
+        :param reply: The reply returned by the interface, not None.
+        :return: The bytes of the line to send.
+        """
+        reply_type = type(reply)
+        if reply_type is int and 0 <= reply < _ENCODED_INTS:
+            return self._ints[reply]
+        if reply_type is str:
+            line = self._constants.get(reply)
+            if line is not None:
+                return line
+        return str(reply).encode() + self.terminator
@@ -12,11 +12,17 @@
 #
 ##################################################
 
-from lewis.adapters.stream import StreamInterface
+import asyncio
+import time
+
+from lewis.adapters.stream import Func, StreamInterface
 from lewis.core.logging import has_log
-from lewis.utils.command_builder import CmdBuilder
 from lewis.utils.replies import conditional_reply
 
+from ..registers import IDN
+from .asyncio_stream import AsyncioStreamAdapter
+from .dispatcher import AnyRequest, LazyCommands, MnemonicMatcher
+
 
 class Mode(object):
     MODES = []
@@ -28,10 +34,18 @@ class OutputMode(Mode):
     MODES = [ON, OFF]
 
 
-@has_log
-class Keithley2290StreamInterface(StreamInterface):
-    # Commands that we expect via serial during normal operation
-    commands = {
+# A float as the IOC formats it with %g, which has an exponent for small and large values,
+# e.g. "ILIM 5e-05"
+_FLOAT = r"[+-]?\d+\.?\d*(?:[eE][+-]?\d+)?"
+
+
+def _build_commands():
+    """
+    Commands that we expect via serial during normal operation.
+    """
+    from lewis.utils.command_builder import CmdBuilder
+
+    return {
         # Readback values
         CmdBuilder("get_idn").escape("*IDN?").eos().build(),
         CmdBuilder("get_volt").escape("VOUT?").eos().build(),
@@ -43,28 +57,123 @@ class Keithley2290StreamInterface(StreamInterface):
         CmdBuilder("get_trip_reset_mode").escape("TMOD?").eos().build(),
         CmdBuilder("get_stat_byte").escape("*STB?").eos().build(),
         CmdBuilder("get_execution_error").escape("*ESR? 4").eos().build(),
+        CmdBuilder("get_command_error").escape("*ESR? 5").eos().build(),
         CmdBuilder("get_stable_bit").escape("*STB? 0").eos().build(),
         CmdBuilder("get_esb_alert_bit").escape("*STB? 5").eos().build(),
         CmdBuilder("get_volt_on_bit").escape("*STB? 7").eos().build(),
         # Error handling
-        CmdBuilder("reset").escape("*RST").build(),
-        CmdBuilder("clear_status").escape("*CLS").build(),
+        CmdBuilder("reset").escape("*RST").eos().build(),
+        CmdBuilder("clear_status").escape("*CLS").eos().build(),
         CmdBuilder("get_error").escape("LERR?").eos().build(),
         CmdBuilder("clear_trip").escape("TCLR").eos().build(),
         # Setting values
         CmdBuilder("set_volt_ON").escape("HV").arg("OF|ON").eos().build(),
-        CmdBuilder("set_trip_reset_mode").escape("TMOD ").int().build(),
-        CmdBuilder("set_volt").escape("VSET ").float().eos().build(),
-        CmdBuilder("set_volt_limit").escape("VLIM ").float().eos().build(),
-        CmdBuilder("set_curr_limit").escape("ILIM ").float().eos().build(),
-        CmdBuilder("set_curr_trip").escape("ITRP ").float().eos().build(),
+        CmdBuilder("set_trip_reset_mode").escape("TMOD ").int().eos().build(),
+        CmdBuilder("set_volt").escape("VSET ").arg(_FLOAT, float).eos().build(),
+        CmdBuilder("set_volt_limit").escape("VLIM ").arg(_FLOAT, float).eos().build(),
+        CmdBuilder("set_curr_limit").escape("ILIM ").arg(_FLOAT, float).eos().build(),
+        CmdBuilder("set_curr_trip").escape("ITRP ").arg(_FLOAT, float).eos().build(),
+        CmdBuilder("get_service_request_enable").escape("*SRE?").eos().build(),
         CmdBuilder("set_service_request_enable").escape("*SRE ").int().eos().build(),
         CmdBuilder("set_event_status_enable").escape("ESE ").int().eos().build(),
+        # Waveform capture, only understood by the emulator
+        CmdBuilder("get_waveforms").escape("WAVE?").eos().build(),
+        CmdBuilder("get_capture_rate").escape("WCAP?").eos().build(),
+        CmdBuilder("set_capture_rate").escape("WCAP ").arg(_FLOAT, float).eos().build(),
+        CmdBuilder("rearm_capture").escape("WARM").eos().build(),
+        # Batched queries, e.g. "VOUT?;IOUT?;*STB?", answered in a single reply
+        CmdBuilder("get_multicommands").get_multicommands(";").build(),
     }
 
+
+@has_log
+class Keithley2290StreamInterface(StreamInterface):
+    commands = LazyCommands(_build_commands)
+
     in_terminator = "\n"
     out_terminator = "\n"
 
+    # Replies whose encoded lines are built once by the asyncio server, see replies.py
+    constant_replies = (IDN,)
+
+    def _bind_device(self):
+        """
+        Binds the commands as usual, then puts a dispatcher keyed on the command mnemonic in
+        front of them so that requests are not tried against every pattern in turn. The
+        dispatcher finds every request that a command can process, so anything that gets past
+        it is unmatched.
+        """
+        super(Keithley2290StreamInterface, self)._bind_device()
+        self._dispatcher = MnemonicMatcher(self.bound_commands)
+        self.bound_commands.insert(0, Func(self._dispatch, self._dispatcher))
+        self.bound_commands.insert(1, Func(self._unmatched, AnyRequest()))
+        self.device.service_request_listener = self._send_service_request
+        self.device.delayed_reply_listener = self._send_unsolicited
+        self._batching = False
+
+    def _send_unsolicited(self, reply):
+        """
+        Sends a line to the connected client outside of the reply to a request. This is called
+        from the device's cycle, which holds the device lock, so the line is handed to the
+        adapter's event loop without waiting for it to be sent: the loop may itself be waiting
+        for the lock to process a request. The Lewis 1.4 handler's unsolicited_reply waits, so
+        its line is pushed in the same way as its replies instead.
+        """
+        handler = getattr(self, "handler", None)
+        if handler is None or not self.device.connected:
+            return
+        push = getattr(handler, "_push", None)
+        loop = getattr(getattr(handler, "_stream_server", None), "_loop", None)
+        if push is None or loop is None:
+            # Earlier versions of Lewis, and the asyncio server, send it without waiting
+            handler.unsolicited_reply(reply)
+        elif not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(push(reply), loop)
+
+    def _send_service_request(self, stat_byte):
+        """
+        Sends an unsolicited "SRQ <status byte>" line to the connected client.
+        """
+        self._send_unsolicited("SRQ {}".format(stat_byte))
+
+    def _dispatch(self, cmd, request):
+        """
+        Processes a request with the command found for its mnemonic, timing it if the device's
+        command metrics are enabled and injecting faults into it if its faults are enabled.
+        The commands of a batched query are only hit by faults as part of the whole line.
+        """
+        device = self._device
+        faults = None if self._batching else device.faults
+        if faults is not None:
+            command = cmd.func.__name__
+            now = device.simulated_time
+            if faults.rejects(command, now):
+                device.reject_command()
+                return None
+
+        metrics = device.command_metrics
+        if metrics is None:
+            reply = cmd.process_request(request)
+        else:
+            if not self._batching:
+                metrics.requests += 1
+            start = time.perf_counter()
+            try:
+                reply = cmd.process_request(request)
+            finally:
+                metrics.add(cmd.func.__name__, time.perf_counter() - start)
+
+        if faults is not None:
+            return faults.apply(command, reply, now)
+        return reply
+
+    def _unmatched(self, request):
+        metrics = self._device.command_metrics
+        if metrics is not None:
+            metrics.requests += 1
+            metrics.unmatched += 1
+        raise RuntimeError("None of the device's commands matched.")
+
     @conditional_reply("connected")
     def reset(self):
         """
@@ -119,8 +228,9 @@ class Keithley2290StreamInterface(StreamInterface):
         """
         Sets requested voltage.
         """
+        self._device.count_setpoint_write("volt")
         self._device.volt = value
-        return "Voltage set to: " + str(value)
+        return "Voltage set to: {}".format(value)
 
     @conditional_reply("connected")
     def get_volt(self):
@@ -132,7 +242,7 @@ class Keithley2290StreamInterface(StreamInterface):
         Sets requested voltage limit.
         """
         self._device.volt_limit = value
-        return "Voltage limit set to: " + str(value)
+        return "Voltage limit set to: {}".format(value)
 
     @conditional_reply("connected")
     def get_volt_limit(self):
@@ -142,6 +252,10 @@ class Keithley2290StreamInterface(StreamInterface):
     def get_execution_error(self):
         return self._device.execution_error
 
+    @conditional_reply("connected")
+    def get_command_error(self):
+        return self._device.command_error
+
     @conditional_reply("connected")
     def get_stable_bit(self):
         return self._device.stable_bit
@@ -164,6 +278,7 @@ class Keithley2290StreamInterface(StreamInterface):
 
     @conditional_reply("connected")
     def set_curr_limit(self, value):
+        self._device.count_setpoint_write("curr_limit")
         self._device.curr_limit = value
 
     @conditional_reply("connected")
@@ -175,6 +290,7 @@ class Keithley2290StreamInterface(StreamInterface):
         """
         Sets the current trip value.
         """
+        self._device.count_setpoint_write("curr_trip")
         self._device.curr_trip = value
 
     @conditional_reply("connected")
@@ -195,19 +311,97 @@ class Keithley2290StreamInterface(StreamInterface):
         """
         return self._device.stat_byte
 
+    @conditional_reply("connected")
+    def get_service_request_enable(self):
+        return self._device.service_request_enable
+
     @conditional_reply("connected")
     def set_service_request_enable(self, new_SRE):
-        # only stubbed here
-        return
+        """
+        Sets the status byte bits that cause a service request when they are set.
+        """
+        self._device.service_request_enable = new_SRE
 
     @conditional_reply("connected")
     def set_event_status_enable(self, new_ESE):
-        # only stubbed here
-        return
+        """
+        Sets the Standard Event Status Register bits that set the ESB bit.
+        """
+        self._device.event_status_enable = new_ESE
+
+    @conditional_reply("connected")
+    def get_waveforms(self):
+        """
+        Gets the captured output voltages and currents in one reply, "<voltages>;<currents>"
+        with the samples of each separated by ",", oldest first.
+        """
+        return self._device.waveforms
+
+    @conditional_reply("connected")
+    def get_capture_rate(self):
+        return self._device.capture_rate
+
+    @conditional_reply("connected")
+    def set_capture_rate(self, new_rate):
+        """
+        Starts capturing the output at a number of samples per second, or stops at 0.
+        """
+        self._device.capture_rate = new_rate
+
+    @conditional_reply("connected")
+    def rearm_capture(self):
+        """
+        Carries on capturing after a trip froze the capture.
+        """
+        self._device.rearm_capture()
+
+    def get_multicommands(self, command, other_commands):
+        """
+        Processes a ";"-separated line of commands and replies to all of the queries at once.
+        The individual replies are joined with ";" in the same order as the queries.
+        """
+        replies = []
+        self._batching = True
+        try:
+            for part_command in [command] + other_commands.split(";"):
+                reply = self._process_part_command(part_command)
+                if reply is not None:
+                    replies.append(reply)
+        finally:
+            self._batching = False
+        return ";".join(replies) if replies else None
+
+    def _process_part_command(self, part_command):
+        if part_command == "":
+            return None
+        request = part_command.encode()
+        cmd = self._dispatcher.find(request)
+        if cmd is None:
+            metrics = self._device.command_metrics
+            if metrics is not None:
+                metrics.unmatched += 1
+            raise RuntimeError("None of the device's commands matched {}.".format(part_command))
+        return self._dispatch(cmd, request)
 
     @has_log
     def handle_error(self, request, error):
+        metrics = self._device.command_metrics
+        if metrics is not None:
+            metrics.errors += 1
         err = "An error occurred at request {}: {}".format(str(request), str(error))
         print(err)
         self.log.info(err)
         return str(err)
+
+
+class Keithley2290AsyncioStreamInterface(Keithley2290StreamInterface):
+    """
+    The same commands, served by an asyncio server that answers each request as soon as it
+    arrives and accepts many clients at once. Selected with "-p asyncio_stream".
+    """
+
+    protocol = "asyncio_stream"
+
+    @property
+    def adapter(self):
+        return AsyncioStreamAdapter
@@ -0,0 +1,115 @@
+import json
+from bisect import bisect_left
+
+# Upper bounds of the latency histogram buckets in seconds, the last one catches the rest
+LATENCY_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, float("inf"))
+
+
+class CommandStatistics(object):
+    """
+    Number of calls and latency histogram of one command.
+    """
+
+    __slots__ = ("count", "total_time", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total_time = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total_time += seconds
+        self.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+
+
+class CommandMetrics(object):
+    """
+    Counts and times the commands processed by the stream interface, along with the requests
+    received, the requests that no command matched and the errors passed to handle_error.
+
+    A batched query is one request, and so one round trip, however many commands it holds.
+    """
+
+    def __init__(self):
+        self.commands = {}
+        self.requests = 0
+        self.unmatched = 0
+        self.errors = 0
+
+    def add(self, command, seconds):
+        """
+        :param command: Name of the command's handler, e.g. "get_curr".
+        :param seconds: Time taken to process the request.
+        """
+        statistics = self.commands.get(command)
+        if statistics is None:
+            statistics = self.commands[command] = CommandStatistics()
+        statistics.add(seconds)
+
+    def counts(self):
+        """
+        :return: The number of calls of each command.
+        """
+        return {command: statistics.count for command, statistics in self.commands.items()}
+
+    def as_dict(self):
+        return {
+            "commands": {
+                command: {
+                    "count": statistics.count,
+                    "total_time": statistics.total_time,
+                    "buckets": dict(zip(_bucket_labels(), statistics.buckets)),
+                }
+                for command, statistics in self.commands.items()
+            },
+            "requests": self.requests,
+            "unmatched": self.unmatched,
+            "errors": self.errors,
+        }
+
+    def to_json(self):
+        return json.dumps(self.as_dict(), sort_keys=True)
+
+    def to_prometheus(self):
+        """
+        Formats the metrics in the Prometheus text exposition format.
+        """
+        lines = [
+            "# HELP keithley2290_command_duration_seconds Time taken to process each command.",
+            "# TYPE keithley2290_command_duration_seconds histogram",
+        ]
+        for command, statistics in sorted(self.commands.items()):
+            cumulative = 0
+            for label, count in zip(_bucket_labels(), statistics.buckets):
+                cumulative += count
+                lines.append(
+                    "keithley2290_command_duration_seconds_bucket"
+                    '{{command="{}",le="{}"}} {}'.format(command, label, cumulative)
+                )
+            lines.append(
+                'keithley2290_command_duration_seconds_sum{{command="{}"}} {!r}'.format(
+                    command, statistics.total_time
+                )
+            )
+            lines.append(
+                'keithley2290_command_duration_seconds_count{{command="{}"}} {}'.format(
+                    command, statistics.count
+                )
+            )
+        lines += [
+            "# HELP keithley2290_requests_total Requests received, each one round trip.",
+            "# TYPE keithley2290_requests_total counter",
+            "keithley2290_requests_total {}".format(self.requests),
+            "# HELP keithley2290_unmatched_requests_total Requests that no command matched.",
+            "# TYPE keithley2290_unmatched_requests_total counter",
+            "keithley2290_unmatched_requests_total {}".format(self.unmatched),
+            "# HELP keithley2290_errors_total Requests that ended in handle_error.",
+            "# TYPE keithley2290_errors_total counter",
+            "keithley2290_errors_total {}".format(self.errors),
+        ]
+        return "\n".join(lines) + "\n"
+
+
+def _bucket_labels():
+    return ["+Inf" if bound == float("inf") else repr(bound) for bound in LATENCY_BUCKETS]
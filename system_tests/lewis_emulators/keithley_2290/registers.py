@@ -0,0 +1,169 @@
+# Replied to *IDN?
+IDN = "KEITHLEY INSTRUMENTS INC., emulator"
+
+
+def _bit(bit, doc):
+    """
+    Creates a property for one bit of StatusByte.value.
+    """
+    mask = 1 << bit
+
+    def getter(self):
+        return (self.value >> bit) & 1
+
+    def setter(self, new_value):
+        if new_value:
+            rising = mask & ~self.value & self.service_request_enable
+            self.value |= mask
+            if rising and self.on_service_request is not None:
+                self.on_service_request()
+        else:
+            self.value &= ~mask
+
+    return property(getter, setter, doc=doc)
+
+
+class StatusByte(object):
+    """
+    The 2290 status byte, with a property for each bit.
+
+    The ESB and RQS/MSS bits are cleared by being read, see read_esb and read_mss.
+    All other bits are only changed by the device.
+
+    When a bit that is enabled in service_request_enable is set, on_service_request is called.
+    """
+
+    __slots__ = ("value", "service_request_enable", "on_service_request")
+
+    STABLE = 1 << 0
+    VOLT_TRIP = 1 << 1
+    CURR_TRIP = 1 << 2
+    TRIPS = VOLT_TRIP | CURR_TRIP
+    CURR_LIMIT = 1 << 3
+    ESB = 1 << 5
+    MSS = 1 << 6
+    HV_ON = 1 << 7
+
+    stable = _bit(0, "Indicates that the VSET or ILIM value is stable.")
+    volt_trip = _bit(1, "Indicates that a voltage trip has occurred.")
+    curr_trip = _bit(2, "Indicates that a current trip has occurred.")
+    curr_limit = _bit(3, "Indicates that a current limit condition has occurred.")
+    message_available = _bit(4, "Indicates message available in the GPIB output queue.")
+    esb = _bit(
+        5, "Indicates that an unmasked bit in the Standard Event Status Register has been set."
+    )
+    mss = _bit(6, "Request for Service/Master Summary Status.")
+    hv_on = _bit(7, "Indicates that the high voltage is on.")
+
+    def __init__(self, value=STABLE, service_request_enable=0):
+        self.value = value
+        # The RQS/MSS bit can't be enabled, it is the summary of the enabled bits
+        self.service_request_enable = service_request_enable & ~StatusByte.MSS
+        self.on_service_request = None
+
+    def read_esb(self):
+        """
+        Reads the ESB bit, which clears it.
+        """
+        esb = self.esb
+        self.esb = 0
+        return esb
+
+    def read_mss(self):
+        """
+        Reads the RQS/MSS bit, which clears it.
+        """
+        mss = self.mss
+        self.mss = 0
+        return mss
+
+
+class StandardEventStatus(object):
+    """
+    The bits of the 2290 Standard Event Status Register, which set the ESB bit of the status
+    byte when they are enabled in the event status enable register.
+    """
+
+    EXECUTION_ERROR = 1 << 4
+    COMMAND_ERROR = 1 << 5
+
+
+class Keithley2290Registers(object):
+    """
+    The settings and readbacks of a 2290, kept in slots rather than in the device's __dict__.
+    """
+
+    __slots__ = (
+        "idn",
+        "volt",
+        "volt_setpoint",
+        "volt_limit",
+        "ramp_rate",
+        "load_resistance",
+        "curr",
+        "curr_limit",
+        "curr_trip",
+        "trip_reset_mode",
+        "setting_mode",
+        "high_voltage_enable_switch",
+        "error",
+        "execution_error",
+        "command_error",
+        "event_status_enable",
+        "status",
+    )
+
+    def __init__(self):
+        # Device name - 39 chars max
+        self.idn = IDN
+        self.volt = 0.0
+        self.volt_setpoint = 0.0
+        self.volt_limit = 10000.0
+        # Slew rate of the output in V/s, 0 for an output that follows the setpoint immediately
+        self.ramp_rate = 0.0
+        # Load on the output in Ohms, None for a current that is only set over the backdoor
+        self.load_resistance = None
+        self.curr = 0.0
+        self.curr_limit = 1050.0 * 1e-6
+        self.curr_trip = 1050.0 * 1e-6
+        self.trip_reset_mode = 0
+        # Returned by SMOD?, 0 when the settings are made over the bus
+        self.setting_mode = 0
+        self.high_voltage_enable_switch = 1
+        self.error = 0
+        self.execution_error = 0
+        self.command_error = 0
+        self.event_status_enable = 0
+        self.status = StatusByte()
+
+    def as_dict(self):
+        """
+        :return: The value of every register by name, with the status byte as its value and
+            its service request enable register.
+        """
+        state = {
+            name: getattr(self, name)
+            for name in Keithley2290Registers.__slots__
+            if name != "status"
+        }
+        state["status"] = self.status.value
+        state["service_request_enable"] = self.status.service_request_enable
+        return state
+
+    def restore(self, state):
+        """
+        Sets every register from a dict made by as_dict, or to its default if the dict doesn't
+        have it, without requesting service for the status bits that are set.
+        """
+        values = Keithley2290Registers().as_dict()
+        unknown = set(state) - set(values)
+        if unknown:
+            raise ValueError("Unknown registers: {}".format(", ".join(sorted(unknown))))
+        values.update(state)
+
+        status = values.pop("status")
+        service_request_enable = values.pop("service_request_enable")
+        for name, value in values.items():
+            setattr(self, name, value)
+        self.status.value = status
+        self.status.service_request_enable = service_request_enable & ~StatusByte.MSS
@@ -0,0 +1,166 @@
+##################################################
+#
+# Scenarios
+#
+# Timelines of changes to a 2290 at simulated times, e.g. the interlock opening and
+# HV on being rejected before the output ramps up and trips, which are loaded from a
+# YAML or JSON file and run inside the emulator rather than each change being a
+# separate backdoor call:
+#     version: 1
+#     scenarios:
+#       interlock_then_trip:
+#         - set: {high_voltage_enable_switch: 0}
+#         - after: 1.0
+#           set: {volt_ON: 1}
+#         - after: 1.0
+#           set: {high_voltage_enable_switch: 1, volt_ON: 1, ramp_rate: 1000.0}
+#         - at: 5.0
+#           call: volt_external
+#           args: [2000.0]
+# Each step sets device attributes, in the order given, and/or calls a device method,
+# either at a time in seconds from the start or after the previous step, by default
+# straight after it. The steps are run together at the start of the first device cycle
+# at or after the simulated time that they are due, so the same scenario always makes
+# the same changes at the same cycles.
+#
+##################################################
+
+from array import array
+from bisect import bisect_right
+from functools import partial
+
+VERSION = 1
+
+_STEP_KEYS = {"at", "after", "set", "call", "args"}
+
+
+def load_scenarios(path):
+    """
+    Reads the scenarios from a YAML or JSON file.
+
+    :return: Dict of scenario name -> list of steps.
+    """
+    # Imported here rather than with the module, as Lewis imports every module of the
+    # emulator when it starts whether or not a scenario is ever run
+    import yaml
+
+    with open(path) as scenario_file:
+        contents = yaml.safe_load(scenario_file)
+    if not isinstance(contents, dict) or contents.get("version") != VERSION:
+        raise ValueError("{} is not a version {} scenario file".format(path, VERSION))
+    return contents["scenarios"]
+
+
+def _time(name, index, step, previous):
+    if "at" in step and "after" in step:
+        raise ValueError("Step {} of {} has both at and after".format(index, name))
+    if "at" in step:
+        time = float(step["at"])
+    else:
+        time = previous + float(step.get("after", 0.0))
+    if time < previous:
+        raise ValueError("Step {} of {} is before the step it follows".format(index, name))
+    return time
+
+
+def _settable(device, attribute):
+    # Looked up on the class, as reading some of the properties clears the register they read
+    member = getattr(type(device), attribute, None)
+    if isinstance(member, property):
+        return member.fset is not None
+    return member is None and attribute in vars(device) and not callable(vars(device)[attribute])
+
+
+def _callable(device, method):
+    return callable(getattr(type(device), method, None))
+
+
+def compile_scenario(name, steps, device):
+    """
+    Turns the steps of a scenario into a timeline of changes to a device, checking that every
+    attribute and method that they name exists so that a mistake fails when the scenario is
+    loaded rather than part way through running it.
+
+    :param name: Name of the scenario.
+    :param steps: List of steps, see load_scenarios.
+    :param device: Device that the scenario changes.
+    :return: The Scenario.
+    """
+    times = array("d")
+    actions = []
+    time = 0.0
+    for index, step in enumerate(steps):
+        unknown = set(step) - _STEP_KEYS
+        if unknown or not ("set" in step or "call" in step):
+            raise ValueError(
+                "Step {} of {} needs set or call, and only at, after or args besides".format(
+                    index, name
+                )
+            )
+        time = _time(name, index, step, time)
+
+        for attribute, value in step.get("set", {}).items():
+            if attribute.startswith("_") or not _settable(device, attribute):
+                raise ValueError("Step {} of {} can't set {}".format(index, name, attribute))
+            times.append(time)
+            actions.append(partial(setattr, device, attribute, value))
+
+        if "call" in step:
+            method = step["call"]
+            if method.startswith("_") or not _callable(device, method):
+                raise ValueError("Step {} of {} can't call {}".format(index, name, method))
+            times.append(time)
+            actions.append(partial(getattr(device, method), *step.get("args", ())))
+
+    return Scenario(name, times, actions)
+
+
+class Scenario(object):
+    """
+    A compiled scenario, the changes to a device and the times from the start that they are due.
+    """
+
+    def __init__(self, name, times, actions):
+        """
+        :param name: Name of the scenario.
+        :param times: Time that each change is due in seconds from the start, ascending.
+        :param actions: Each change, called with no arguments.
+        """
+        self.name = name
+        self.times = times
+        self.actions = actions
+
+    def __len__(self):
+        return len(self.actions)
+
+
+class ScenarioRun(object):
+    """
+    Steps through a scenario in simulated time.
+    """
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.time = 0.0
+        self._next = 0
+
+    def advance(self, dt):
+        """
+        Moves the run on by a device cycle.
+
+        :param dt: Time since the last cycle in seconds.
+        :return: The changes that have become due, in order.
+        """
+        start = self._next
+        end = bisect_right(self.scenario.times, self.time)
+        self.time += dt
+        self._next = end
+        return self.scenario.actions[start:end]
+
+    @property
+    def changes_made(self):
+        return self._next
+
+    @property
+    def finished(self):
+        return self._next == len(self.scenario)
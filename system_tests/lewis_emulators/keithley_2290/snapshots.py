@@ -0,0 +1,44 @@
+##################################################
+#
+# Snapshots
+#
+# Named copies of a 2290's registers, see SimulatedKeithley2290.take_snapshot, which
+# can be saved to and loaded from a JSON file, e.g. to start the emulator in the
+# state that a test scenario needs:
+#     {
+#         "version": 1,
+#         "snapshots": {
+#             "tripped": {"volt_limit": 4000.0, "status": 7, ...}
+#         }
+#     }
+# Registers left out of a snapshot are restored to their defaults.
+#
+##################################################
+
+import json
+
+VERSION = 1
+
+
+def save_snapshots(path, snapshots):
+    """
+    Writes snapshots to a file.
+
+    :param path: File to write.
+    :param snapshots: Dict of snapshot name -> registers, see Keithley2290Registers.as_dict.
+    """
+    with open(path, "w") as snapshot_file:
+        json.dump({"version": VERSION, "snapshots": snapshots}, snapshot_file, indent=4)
+
+
+def load_snapshots(path):
+    """
+    Reads the snapshots from a file written by save_snapshots.
+
+    :return: Dict of snapshot name -> registers.
+    """
+    with open(path) as snapshot_file:
+        contents = json.load(snapshot_file)
+    if contents.get("version") != VERSION:
+        raise ValueError("{} is not a version {} snapshot file".format(path, VERSION))
+    return contents["snapshots"]
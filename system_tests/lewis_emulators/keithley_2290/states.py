@@ -7,3 +7,10 @@ class DefaultState(State):
     """
 
     NAME = "Default"
+
+    def in_state(self, dt):
+        self._context.run_scenario(dt)
+        self._context.update_output(dt)
+        self._context.process_faults(dt)
+        self._context.capture_output(dt)
+        self._context.process_service_requests()
@@ -0,0 +1,144 @@
+##################################################
+#
+# Recorded traces
+#
+# Reads and writes recordings of a 2290's output in a compact columnar file, which
+# is memory-mapped when replayed so that hour-long traces don't have to fit in RAM.
+#
+# File layout, all little-endian:
+#     8 bytes   magic, b"K2290TR1"
+#     8 bytes   number of samples n, unsigned
+#     8n bytes  time of each sample in seconds from the start, double, ascending
+#     8n bytes  output voltage in V, double
+#     8n bytes  output current in A, double
+#     n bytes   trip events at each sample, StatusByte.VOLT_TRIP | StatusByte.CURR_TRIP
+#
+# Convert a CSV recording with time, volt, curr and optionally events columns with:
+#     python -m lewis_emulators.keithley_2290.trace recording.csv recording.trace
+#
+##################################################
+
+import struct
+import sys
+from array import array
+from bisect import bisect_right
+
+MAGIC = b"K2290TR1"
+_HEADER = struct.Struct("<8sQ")
+
+
+def write_trace(path, times, volts, currs, events=None):
+    """
+    Writes a trace file.
+
+    :param path: File to write.
+    :param times: Time of each sample in seconds from the start, ascending.
+    :param volts: Output voltage of each sample in V.
+    :param currs: Output current of each sample in A.
+    :param events: Trip event bits of each sample, or None for no trips.
+    """
+    times = array("d", times)
+    volts = array("d", volts)
+    currs = array("d", currs)
+    events = bytes(len(times)) if events is None else bytes(events)
+    if not len(times) == len(volts) == len(currs) == len(events):
+        raise ValueError("All of the columns of a trace must have the same length")
+    if sys.byteorder != "little":
+        for column in (times, volts, currs):
+            column.byteswap()
+
+    with open(path, "wb") as trace_file:
+        trace_file.write(_HEADER.pack(MAGIC, len(times)))
+        for column in (times, volts, currs):
+            column.tofile(trace_file)
+        trace_file.write(events)
+
+
+class TraceReplay(object):
+    """
+    Steps through a memory-mapped trace file in simulated time.
+    """
+
+    def __init__(self, path, speed=1.0):
+        """
+        :param path: Trace file to replay.
+        :param speed: Seconds of the trace replayed per second of device time.
+        """
+        if sys.byteorder != "little":
+            raise RuntimeError("Trace files can only be replayed on little-endian machines")
+
+        # Imported here rather than with the module, as Lewis imports every module of the
+        # emulator when it starts whether or not a trace is ever replayed
+        import mmap
+
+        self.speed = speed
+        self.time = 0.0
+        self._next = 0
+
+        with open(path, "rb") as trace_file:
+            self._map = mmap.mmap(trace_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count = _HEADER.unpack_from(self._map)
+        if magic != MAGIC or len(self._map) != _HEADER.size + 25 * count:
+            self._map.close()
+            raise ValueError("{} is not a trace file".format(path))
+
+        view = memoryview(self._map)[_HEADER.size :]
+        column = 8 * count
+        self._times = view[:column].cast("d")
+        self._volts = view[column : 2 * column].cast("d")
+        self._currs = view[2 * column : 3 * column].cast("d")
+        self._events = view[3 * column :]
+
+    def __len__(self):
+        return len(self._times)
+
+    @property
+    def finished(self):
+        return self._next >= len(self._times)
+
+    def advance(self, dt):
+        """
+        Moves the replay on by dt seconds of device time.
+
+        :return: (volt, curr, events) of the latest sample reached, with the events of every
+            sample passed over combined so that none are missed at high speeds, or None if no
+            new sample was reached.
+        """
+        self.time += dt * self.speed
+        end = bisect_right(self._times, self.time, self._next)
+        if end == self._next:
+            return None
+
+        events = 0
+        for event in self._events[self._next : end]:
+            events |= event
+        self._next = end
+        return self._volts[end - 1], self._currs[end - 1], events
+
+    def close(self):
+        for column in (self._times, self._volts, self._currs, self._events):
+            column.release()
+        self._map.close()
+
+
+def main():
+    import argparse
+    import csv
+
+    parser = argparse.ArgumentParser(description="Convert a CSV recording to a trace file")
+    parser.add_argument("csv_file", help="CSV with time, volt, curr and optional events columns")
+    parser.add_argument("trace_file")
+    args = parser.parse_args()
+
+    times, volts, currs, events = array("d"), array("d"), array("d"), bytearray()
+    with open(args.csv_file, newline="") as csv_file:
+        for row in csv.DictReader(csv_file):
+            times.append(float(row["time"]))
+            volts.append(float(row["volt"]))
+            currs.append(float(row["curr"]))
+            events.append(int(row.get("events") or 0))
+    write_trace(args.trace_file, times, volts, currs, events)
+
+
+if __name__ == "__main__":
+    main()
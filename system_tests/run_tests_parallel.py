@@ -0,0 +1,140 @@
+##################################################
+#
+# Parallel test runner
+#
+# Runs this directory's tests using the IOC Testing Framework, like run_tests.bat,
+# but in several worker processes at once. Each worker runs one test mode against
+# its own IOC and emulator pair (KHLY2290_01, KHLY2290_02, ...), numbered across
+# all of the test modes so that no two workers' PVs clash, and its own shard of
+# the tests, so the full suite takes roughly 1 / workers of the time.
+#
+# Usage:
+#     python run_tests_parallel.py --workers 8 [arguments for run_tests.py]
+#
+# If KHLY2290_TIMING_REPORT is set, the workers' timing reports are merged into it,
+# and compared against KHLY2290_TIMING_BASELINE if that is set.
+#
+##################################################
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+TEST_MODES = ("RECSIM", "DEVSIM")
+
+
+def _run_tests_script():
+    return os.path.join(
+        os.environ["EPICS_KIT_ROOT"], "support", "IocTestFramework", "master", "run_tests.py"
+    )
+
+
+def _start_worker(test_mode, ioc_number, shard, shard_count, timing_report, extra_args):
+    env = dict(os.environ)
+    env["PYTHONUNBUFFERED"] = "1"
+    env["KHLY2290_TEST_MODE"] = test_mode
+    env["KHLY2290_IOC_NUMBER"] = str(ioc_number)
+    env["KHLY2290_SHARD"] = str(shard)
+    env["KHLY2290_SHARD_COUNT"] = str(shard_count)
+    if timing_report is not None:
+        env["KHLY2290_TIMING_REPORT"] = timing_report
+
+    command = [
+        os.environ.get("PYTHON3", sys.executable),
+        _run_tests_script(),
+        "--test_and_emulator",
+        os.path.dirname(os.path.abspath(__file__)),
+    ] + extra_args
+    # Into a file rather than a pipe, so a chatty worker never blocks waiting for it to be read
+    output = tempfile.TemporaryFile(mode="w+")
+    return subprocess.Popen(command, env=env, stdout=output, stderr=subprocess.STDOUT), output
+
+
+def _merge_timing_reports(worker_reports, timing_report, timing_baseline):
+    durations = {}
+    for worker_report in worker_reports:
+        if os.path.exists(worker_report):
+            with open(worker_report) as report:
+                durations.update(json.load(report))
+            os.remove(worker_report)
+
+    with open(timing_report, "w") as report:
+        json.dump(durations, report, indent=4, sort_keys=True)
+
+    baseline = {}
+    if timing_baseline is not None:
+        with open(timing_baseline) as baseline_report:
+            baseline = json.load(baseline_report)
+
+    print("{:<90} {:>8} {:>8}".format("Test", "Before/s", "After/s"))
+    for test in sorted(set(durations) | set(baseline)):
+        before = baseline.get(test)
+        after = durations.get(test)
+        print(
+            "{:<90} {:>8} {:>8}".format(
+                test,
+                "-" if before is None else "{:.2f}".format(before),
+                "-" if after is None else "{:.2f}".format(after),
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the Keithley 2290 tests in parallel")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of worker processes, split between the test modes",
+    )
+    args, extra_args = parser.parse_known_args()
+
+    shard_count = max(1, args.workers // len(TEST_MODES))
+    timing_report = os.environ.get("KHLY2290_TIMING_REPORT")
+
+    workers = []
+    worker_reports = []
+    for mode_index, test_mode in enumerate(TEST_MODES):
+        for shard in range(1, shard_count + 1):
+            ioc_number = mode_index * shard_count + shard
+            worker_report = None
+            if timing_report is not None:
+                worker_report = "{}.{}".format(timing_report, ioc_number)
+                worker_reports.append(worker_report)
+            name = "{} {}/{}".format(test_mode, shard, shard_count)
+            workers.append(
+                (
+                    name,
+                    _start_worker(
+                        test_mode, ioc_number, shard, shard_count, worker_report, extra_args
+                    ),
+                )
+            )
+
+    failed = []
+    for name, (worker, output) in workers:
+        worker.wait()
+        output.seek(0)
+        for line in output:
+            print("[{}] {}".format(name, line.rstrip()))
+        output.close()
+        if worker.returncode != 0:
+            failed.append(name)
+
+    if timing_report is not None:
+        _merge_timing_reports(
+            worker_reports, timing_report, os.environ.get("KHLY2290_TIMING_BASELINE")
+        )
+
+    if failed:
+        print("Failed: {}".format(", ".join(failed)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,33 +12,70 @@
 #
 ##################################################
 
+import json
+import os
+import tempfile
+import threading
 import time
 import unittest
 
+from lewis_emulators.keithley_2290.registers import Keithley2290Registers, StatusByte
+from lewis_emulators.keithley_2290.snapshots import save_snapshots
+from lewis_emulators.keithley_2290.trace import write_trace
 from utils.channel_access import ChannelAccess
-from utils.ioc_launcher import get_default_ioc_dir
+from utils.ioc_launcher import IOCRegister, get_default_ioc_dir
 from utils.test_modes import TestModes
 from utils.testing import get_running_lewis_and_ioc, skip_if_recsim
 
-DEVICE_PREFIX = "KHLY2290_01"
+# Scenarios run by the emulator, shared with the emulator tests
+SCENARIO_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), os.pardir, "scenarios", "keithley_2290.yaml"
+)
+
+# Set by run_tests_parallel.py, so that each worker has its own IOC and emulator and runs its
+# own shard of the tests
+IOC_NUMBER = int(os.environ.get("KHLY2290_IOC_NUMBER", "1"))
+SHARD = int(os.environ.get("KHLY2290_SHARD", "1"))
+SHARD_COUNT = int(os.environ.get("KHLY2290_SHARD_COUNT", "1"))
+TEST_MODE = os.environ.get("KHLY2290_TEST_MODE")
+
+DEVICE_PREFIX = "KHLY2290_{:02d}".format(IOC_NUMBER)
+EMULATOR_ID = "keithley_2290_{:02d}".format(IOC_NUMBER)
 
 IOCS = [
     {
         "name": DEVICE_PREFIX,
-        "directory": get_default_ioc_dir("KHLY2290"),
+        "directory": get_default_ioc_dir("KHLY2290", iocnum=IOC_NUMBER),
         "macros": {},
         "emulator": "keithley_2290",
+        "emulator_id": EMULATOR_ID,
     },
 ]
 
-TEST_MODES = [TestModes.RECSIM, TestModes.DEVSIM]
+if TEST_MODE is None:
+    TEST_MODES = [TestModes.RECSIM, TestModes.DEVSIM]
+else:
+    TEST_MODES = [getattr(TestModes, TEST_MODE)]
 
 on_off_status = {False: "OFF", True: "ON"}
 
+# How long to wait for a PV to reach its expected value or alarm before failing
+WAIT_TIMEOUT = 10
+
+# How long to count the commands polled by the IOC for, in seconds
+POLL_WINDOW = 3
+
+# The settings cached by the IOC, which it reads when they are set and verifies once a minute
+CACHED_SETTINGS = ("get_volt_limit", "get_curr_limit", "get_curr_trip", "get_trip_reset_mode")
+# The readbacks polled once a second while idle: VOLT, CURR, ERROR and STATUS
+IDLE_REQUESTS_PER_SECOND = 4
+
+# Set to a file name to write the wall-clock time of each test to it as JSON, which
+# run_tests_parallel.py merges and compares against an earlier report
+TIMING_REPORT = os.environ.get("KHLY2290_TIMING_REPORT")
 
-def _insert_reading(class_object, reading):
-    class_object._lewis.backdoor_run_function_on_device("insert_mock_data", [reading])
-    time.sleep(0.5)  # for synchronicity help
+# Test mode and name -> wall-clock time in seconds
+_test_durations = {}
 
 
 class Status(object):
@@ -46,22 +83,100 @@ class Status(object):
     OFF = "OFF"
 
 
+def _write_timing_report():
+    with open(TIMING_REPORT, "w") as report:
+        json.dump(_test_durations, report, indent=4, sort_keys=True)
+
+
+def _iterate_tests(suite):
+    for test in suite:
+        if isinstance(test, unittest.TestSuite):
+            yield from _iterate_tests(test)
+        else:
+            yield test
+
+
+def load_tests(loader, standard_tests, pattern):
+    """
+    Keeps every SHARD_COUNT-th test, starting from this worker's shard, when the tests are
+    sharded.
+    """
+    if SHARD_COUNT == 1:
+        return standard_tests
+    tests = sorted(_iterate_tests(standard_tests), key=lambda test: test.id())
+    return unittest.TestSuite(tests[SHARD - 1 :: SHARD_COUNT])
+
+
 class Keithley2290DeviceTests(unittest.TestCase):
     """
     Tests for the Keithley2290.
     """
 
+    @classmethod
+    def tearDownClass(cls):
+        if TIMING_REPORT is not None:
+            _write_timing_report()
+
     def setUp(self):
-        self._lewis, self._ioc = get_running_lewis_and_ioc("keithley_2290", DEVICE_PREFIX)
+        self._started = time.perf_counter()
+        self._lewis, self._ioc = get_running_lewis_and_ioc(EMULATOR_ID, DEVICE_PREFIX)
         self.ca = ChannelAccess(
-            default_timeout=30, device_prefix=DEVICE_PREFIX, default_wait_time=0.0
+            default_timeout=WAIT_TIMEOUT, device_prefix=DEVICE_PREFIX, default_wait_time=0.0
         )
+        # PV name -> event set by a CA monitor whenever the PV updates, for this test only
+        self._pv_updated = {}
         self.ca.assert_that_pv_exists("IDN")
-        self.ca.set_pv_value("RST", 1)
-        self.ca.set_pv_value("CLS", 1)
+        self._reset()
         off = "OFF"
-        self.ca.assert_that_pv_is("EXECUTION_ERROR", "OK")
-        self.ca.assert_that_pv_is("VOLT_ON", off)
+        self._wait_for_pv("EXECUTION_ERROR", "OK")
+        self._wait_for_pv("VOLT_ON", off)
+
+    def tearDown(self):
+        test_mode = "RECSIM" if IOCRegister.uses_rec_sim else "DEVSIM"
+        _test_durations["{} {}".format(test_mode, self.id())] = time.perf_counter() - self._started
+
+    def _reset(self):
+        """
+        Resets the device with *RST and *CLS, unless the emulator is already as they would leave
+        it, which saves their round trips through the IOC for most tests.
+        """
+        if (
+            IOCRegister.uses_rec_sim
+            or self._lewis.backdoor_get_from_device("at_defaults") != "True"
+        ):
+            self.ca.set_pv_value("RST", 1)
+            self.ca.set_pv_value("CLS", 1)
+
+    def _wait_for_pv(self, pv, expected_value=None, expected_alarm=None, timeout=WAIT_TIMEOUT):
+        """
+        Waits for a PV to have the expected value and/or alarm severity. A CA monitor wakes the
+        wait up on every update of the PV, so it returns as soon as the update arrives rather
+        than on the next poll. The monitor is removed when the test finishes.
+        """
+        updated = self._pv_updated.get(pv)
+        if updated is None:
+            updated = threading.Event()
+            self.addCleanup(self.ca.add_monitor(pv, lambda *args: updated.set()))
+            self._pv_updated[pv] = updated
+
+        deadline = time.monotonic() + timeout
+        while True:
+            updated.clear()
+            value = self.ca.get_pv_value(pv)
+            alarm = self.ca.get_pv_value(pv + ".SEVR")
+            if (expected_value is None or value == expected_value) and (
+                expected_alarm is None or alarm == expected_alarm
+            ):
+                return
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.fail(
+                    "{} is {} with alarm {}, expected {} with alarm {}".format(
+                        pv, value, alarm, expected_value, expected_alarm
+                    )
+                )
+            updated.wait(remaining)
 
     @skip_if_recsim("IDN not implemented in recsim")
     def test_idn(self):
@@ -82,9 +197,8 @@ class Keithley2290DeviceTests(unittest.TestCase):
         self._lewis.backdoor_set_on_device("high_voltage_enable_switch", 1)
         on = "ON"
         self.ca.set_pv_value("VOLT_ON:SP", on)
-        self.ca.set_pv_value("STATUS.PROC", 1)  # Force processing so we don't have to wait 1 second
-        self.ca.assert_that_pv_is("EXECUTION_ERROR", "OK")
-        self.ca.assert_that_pv_is("VOLT_ON", on)
+        self._wait_for_pv("EXECUTION_ERROR", "OK")
+        self._wait_for_pv("VOLT_ON", on)
 
     @skip_if_recsim("no backdoor in recsim")
     def test_WHEN_setting_volt_ON_while_disabled(self):
@@ -92,13 +206,10 @@ class Keithley2290DeviceTests(unittest.TestCase):
         self.ca.assert_setting_setpoint_sets_readback(
             "ON", "VOLT_ON", expected_value="OFF", expected_alarm="NO_ALARM"
         )
-        self.ca.set_pv_value("ERROR.PROC", 1)  # Force processing so we don't have to wait 1 second
-        self.ca.assert_that_pv_is("EXECUTION_ERROR", "ERROR")
+        self._wait_for_pv("EXECUTION_ERROR", "ERROR")
         self._lewis.backdoor_set_on_device("high_voltage_enable_switch", 1)
-        self.ca.set_pv_value(
-            "EXECUTION_ERROR.PROC", 1
-        )  # Force processing to reset the fault condition
-        self.ca.assert_that_pv_is("EXECUTION_ERROR", "OK")
+        self.ca.set_pv_value("CLS", 1)
+        self._wait_for_pv("EXECUTION_ERROR", "OK")
 
     def test_WHEN_setting_volt_OFF(self):
         off = "OFF"
@@ -128,12 +239,11 @@ class Keithley2290DeviceTests(unittest.TestCase):
             volt_limit, "VOLT_LIMIT", expected_value=volt_limit, expected_alarm="NO_ALARM"
         )
         self._lewis.backdoor_set_on_device("volt_external", volt_external)
-        self.ca.assert_that_pv_alarm_is("VOLT_TRIPPED", self.ca.Alarms.MAJOR)
+        self._wait_for_pv("VOLT_TRIPPED", expected_alarm=self.ca.Alarms.MAJOR)
         self.ca.set_pv_value("VOLT_TRIPPED_LATCHED", 0)
         self.ca.set_pv_value("VOLT_TRIPPED", 0)
         self.ca.set_pv_value("VOLT_ON:SP.PROC", 1)
-        self.ca.set_pv_value("STATUS.PROC", 1)  # Force processing so we don't have to wait 1 second
-        self.ca.assert_that_pv_alarm_is("VOLT_TRIPPED", self.ca.Alarms.NONE)
+        self._wait_for_pv("VOLT_TRIPPED", expected_alarm=self.ca.Alarms.NONE)
 
     @skip_if_recsim("no volt_limit side effect recsim")
     def test_WHEN_setting_volt_beyond_volt_limit(self):
@@ -145,11 +255,10 @@ class Keithley2290DeviceTests(unittest.TestCase):
         self.ca.assert_setting_setpoint_sets_readback(
             volt_setpoint, "VOLT", expected_value=0, expected_alarm="NO_ALARM"
         )
-        self.ca.set_pv_value("ERROR.PROC", 1)  # Force processing so we don't have to wait 1 second
-        self.ca.assert_that_pv_alarm_is("EXECUTION_ERROR", self.ca.Alarms.MAJOR)
-        self.ca.set_pv_value("EXECUTION_ERROR.PROC", 1)
-        self.ca.set_pv_value("STATUS.PROC", 1)  # Force processing so we don't have to wait 1 second
-        self.ca.assert_that_pv_alarm_is("VOLT_TRIPPED", self.ca.Alarms.NONE)
+        self._wait_for_pv("EXECUTION_ERROR", expected_alarm=self.ca.Alarms.MAJOR)
+        self.ca.set_pv_value("CLS", 1)
+        self._wait_for_pv("EXECUTION_ERROR", expected_alarm=self.ca.Alarms.NONE)
+        self._wait_for_pv("VOLT_TRIPPED", expected_alarm=self.ca.Alarms.NONE)
 
     @skip_if_recsim("no backdoor in recsim")
     def test_WHEN_setting_curr_beyond_limit(self):
@@ -159,8 +268,14 @@ class Keithley2290DeviceTests(unittest.TestCase):
             curr_limit, "CURR_LIMIT", expected_value=curr_limit, expected_alarm="NO_ALARM"
         )
         self._lewis.backdoor_set_on_device("curr", curr_actual * 1e-6)
-        self.ca.assert_that_pv_is("CURR", curr_limit)
-        self.ca.assert_that_pv_is("CURR_LIMITED", "LIMITED")
+        self._wait_for_pv("CURR", curr_limit)
+        self._wait_for_pv("CURR_LIMITED", "LIMITED")
+
+    def test_WHEN_setting_curr_limit_below_100_uA_THEN_readback_follows(self):
+        # Sent in A with an exponent, e.g. "ILIM 5e-05"
+        self.ca.assert_setting_setpoint_sets_readback(
+            50, "CURR_LIMIT", expected_value=50, expected_alarm="NO_ALARM"
+        )
 
     @skip_if_recsim("no backdoor in recsim")
     def test_WHEN_setting_curr_beyond_trip(self):
@@ -170,25 +285,203 @@ class Keithley2290DeviceTests(unittest.TestCase):
             curr_trip, "CURR_TRIP", expected_value=curr_trip, expected_alarm="NO_ALARM"
         )
         self._lewis.backdoor_set_on_device("curr", curr_actual * 1e-6)
-        self.ca.assert_that_pv_is("CURR", 0)
-        self.ca.assert_that_pv_alarm_is("CURR_TRIPPED", self.ca.Alarms.MAJOR)
+        self._wait_for_pv("CURR", 0)
+        self._wait_for_pv("CURR_TRIPPED", expected_alarm=self.ca.Alarms.MAJOR)
         self.ca.set_pv_value("CLT", 1)
         self.ca.set_pv_value("CURR_TRIPPED_LATCHED", 0)
         self.ca.set_pv_value("CURR_TRIPPED", 0)
         self.ca.set_pv_value("VOLT_ON:SP.PROC", 1)
-        self.ca.set_pv_value("STATUS.PROC", 1)  # Force processing so we don't have to wait 1 second
-        self.ca.assert_that_pv_alarm_is("CURR_TRIPPED", self.ca.Alarms.NONE)
+        self._wait_for_pv("CURR_TRIPPED", expected_alarm=self.ca.Alarms.NONE)
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_GIVEN_ramp_rate_WHEN_setting_volt_THEN_volt_ramps_and_is_stable_once_reached(self):
+        volt_setpoint = 5000.0
+        self._lewis.backdoor_set_on_device("ramp_rate", 1000.0)
+        self.ca.set_pv_value("VOLT:SP", volt_setpoint)
+        self._wait_for_pv("VOLT_STABLE", "NO")
+        self._wait_for_pv("VOLT", volt_setpoint)
+        self._wait_for_pv("VOLT_STABLE", "STABLE")
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_WHEN_burst_of_volt_setpoints_put_THEN_only_latest_sent_to_device(self):
+        puts = 20
+        self._lewis.backdoor_run_function_on_device("reset_setpoint_writes")
+        for put in range(1, puts + 1):
+            self.ca.set_pv_value("VOLT:SP", put * 100.0)
+        self._wait_for_pv("VOLT", puts * 100.0)
+        # One write per coalescing window, which the burst may straddle
+        self.assertLessEqual(int(self._lewis.backdoor_get_from_device("setpoint_writes")), 2)
+
+    def _command_counts_over(self, seconds):
+        """
+        :return: The number of calls of each command by the IOC over the given time.
+        """
+        self._lewis.backdoor_run_function_on_device("enable_command_metrics")
+        time.sleep(seconds)
+        return json.loads(self._lewis.backdoor_get_from_device("command_counts"))
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_GIVEN_idle_WHEN_ramping_THEN_volt_polled_faster_and_settings_not_polled(self):
+        self.addCleanup(self._lewis.backdoor_run_function_on_device, "disable_command_metrics")
+        self._wait_for_pv("VOLT_STABLE", "STABLE")
+        idle = self._command_counts_over(POLL_WINDOW)
+
+        self._lewis.backdoor_set_on_device("ramp_rate", 100.0)
+        self.ca.set_pv_value("VOLT:SP", 2000.0)
+        self._wait_for_pv("VOLT_STABLE", "NO")
+        ramping = self._command_counts_over(POLL_WINDOW)
+
+        # Unless the verify of the cached settings falls in the window
+        for setting in CACHED_SETTINGS:
+            self.assertLessEqual(idle.get(setting, 0), 1)
+            self.assertLessEqual(ramping.get(setting, 0), 1)
+        # Once a second when idle, ten times a second while ramping
+        self.assertLessEqual(idle.get("get_volt", 0), POLL_WINDOW + 1)
+        self.assertGreaterEqual(ramping.get("get_volt", 0), 5 * POLL_WINDOW)
+        self.assertAlmostEqual(ramping.get("get_curr", 0), ramping.get("get_volt", 0), delta=1)
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_GIVEN_idle_THEN_round_trips_only_for_polled_readbacks(self):
+        self.addCleanup(self._lewis.backdoor_run_function_on_device, "disable_command_metrics")
+        self._wait_for_pv("VOLT_STABLE", "STABLE")
+        self._command_counts_over(POLL_WINDOW)
+        requests = int(self._lewis.backdoor_get_from_device("requests_received"))
+
+        # One scan more than the window may fit in it, and one verify of the cached settings
+        expected = IDLE_REQUESTS_PER_SECOND * (POLL_WINDOW + 1) + len(CACHED_SETTINGS) + 1
+        self.assertLessEqual(requests, expected)
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_GIVEN_settings_cached_WHEN_setting_one_THEN_only_it_read_back(self):
+        self.addCleanup(self._lewis.backdoor_run_function_on_device, "disable_command_metrics")
+        self._lewis.backdoor_run_function_on_device("enable_command_metrics")
+        self.ca.assert_setting_setpoint_sets_readback(
+            "AUTO", "TRIP_RESET_MODE", expected_value="AUTO", expected_alarm="NO_ALARM"
+        )
+        counts = json.loads(self._lewis.backdoor_get_from_device("command_counts"))
+
+        self.assertGreaterEqual(counts.get("get_trip_reset_mode", 0), 1)
+        # Unless the verify of the cached settings happened meanwhile
+        for setting in CACHED_SETTINGS:
+            self.assertLessEqual(counts.get(setting, 0), 2)
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_GIVEN_settings_cached_WHEN_reset_THEN_every_setting_read_back(self):
+        self.addCleanup(self._lewis.backdoor_run_function_on_device, "disable_command_metrics")
+        self.ca.set_pv_value("TRIP_RESET_MODE:SP", "AUTO")
+        self._wait_for_pv("TRIP_RESET_MODE", "AUTO")
+        self._lewis.backdoor_run_function_on_device("enable_command_metrics")
+        self.ca.set_pv_value("RST", 1)
+        self._wait_for_pv("TRIP_RESET_MODE", "MAN")
+        counts = json.loads(self._lewis.backdoor_get_from_device("command_counts"))
+
+        for setting in CACHED_SETTINGS:
+            self.assertGreaterEqual(counts.get(setting, 0), 1)
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_GIVEN_paused_clock_WHEN_running_for_an_hour_THEN_slow_ramp_completes(self):
+        volt_setpoint = 3600.0
+        self._lewis.backdoor_run_function_on_device("pause")
+        self.addCleanup(self._lewis.backdoor_run_function_on_device, "resume")
+        self._lewis.backdoor_set_on_device("ramp_rate", 1.0)
+        self.ca.set_pv_value("VOLT:SP", volt_setpoint)
+        self._wait_for_pv("VOLT_STABLE", "NO")
+        self.ca.assert_that_pv_is("VOLT", 0)
+
+        self._lewis.backdoor_run_function_on_device("step", [1800.0])
+        self._wait_for_pv("VOLT", volt_setpoint / 2)
+        self._lewis.backdoor_run_function_on_device("run_for", [1800.0])
+        self._wait_for_pv("VOLT", volt_setpoint)
+        self._wait_for_pv("VOLT_STABLE", "STABLE")
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_WHEN_reset_THEN_emulator_at_defaults(self):
+        self._lewis.assert_that_emulator_value_is("at_defaults", "True")
+        self._lewis.backdoor_set_on_device("ramp_rate", 1000.0)
+        self._lewis.assert_that_emulator_value_is("at_defaults", "False")
+        self.ca.set_pv_value("RST", 1)
+        self._lewis.assert_that_emulator_value_is("at_defaults", "True")
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_WHEN_current_trips_THEN_service_request_sent_and_trip_detected(self):
+        self.addCleanup(self.ca.set_pv_value, "SERVICE_REQUEST_ENABLE", 0)
+        self.ca.set_pv_value("SERVICE_REQUEST_ENABLE", 14)  # V trip, I trip and I lim
+        self._lewis.assert_that_emulator_value_is("service_request_enable", "14")
+        self._lewis.backdoor_set_on_device("curr", 2000e-6)
+        self._wait_for_pv("SRQ", 101)  # Stable, I trip, ESB and RQS/MSS
+        self._wait_for_pv("CURR_TRIPPED", expected_alarm=self.ca.Alarms.MAJOR)
+        self._lewis.assert_that_emulator_value_is("MSS_bit", "1")
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_WHEN_replaying_trace_THEN_readbacks_follow_it_and_trip_detected(self):
+        # Ten minutes at 10 Hz, ramping to 1 kV and tripping on current at the end
+        samples = 6000
+        trace_dir = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, trace_dir)
+        trace_file = os.path.join(trace_dir, "ramp_and_trip.trace")
+        write_trace(
+            trace_file,
+            [sample * 0.1 for sample in range(samples)],
+            [min(sample, 1000) for sample in range(samples)],
+            [10e-6] * samples,
+            [0] * (samples - 1) + [4],
+        )
+        self.addCleanup(os.remove, trace_file)
+
+        self._lewis.backdoor_run_function_on_device("insert_mock_data", [trace_file, 600.0])
+        self._wait_for_pv("VOLT", 1000)
+        self._wait_for_pv("CURR_TRIPPED", expected_alarm=self.ca.Alarms.MAJOR)
+        self._lewis.assert_that_emulator_value_is("replaying", "False")
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_GIVEN_snapshot_file_WHEN_restoring_snapshot_THEN_limits_and_trip_restored(self):
+        registers = Keithley2290Registers()
+        registers.volt_limit = 4000.0
+        registers.curr_trip = 500e-6
+        registers.status.value = StatusByte.STABLE | StatusByte.CURR_TRIP
+        snapshot_dir = tempfile.mkdtemp()
+        self.addCleanup(os.rmdir, snapshot_dir)
+        snapshot_file = os.path.join(snapshot_dir, "tripped.json")
+        save_snapshots(snapshot_file, {"tripped": registers.as_dict()})
+        self.addCleanup(os.remove, snapshot_file)
+
+        self._lewis.backdoor_run_function_on_device("load_snapshots", [snapshot_file])
+        self._lewis.backdoor_run_function_on_device("restore_snapshot", ["tripped"])
+        # The settings are only read when they are set through the IOC, or when asked to
+        self.ca.set_pv_value("SETTINGS:READ.PROC", 1)
+        self._wait_for_pv("VOLT_LIMIT", 4000.0)
+        self._wait_for_pv("CURR_TRIP", 500)
+        self._wait_for_pv("CURR_TRIPPED", expected_alarm=self.ca.Alarms.MAJOR)
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_GIVEN_volt_replies_dropped_WHEN_fault_ends_THEN_volt_recovers(self):
+        self.addCleanup(self._lewis.backdoor_run_function_on_device, "disable_faults")
+        self._lewis.backdoor_run_function_on_device(
+            "add_fault", ["drop", 0.0, 3.0, 1.0, ["get_volt"]]
+        )
+        self._wait_for_pv("VOLT", expected_alarm=self.ca.Alarms.INVALID)
+        self._wait_for_pv("VOLT", expected_alarm=self.ca.Alarms.NONE)
+        self.ca.assert_that_pv_alarm_is("CURR", self.ca.Alarms.NONE)
+
+    @skip_if_recsim("no backdoor in recsim")
+    def test_WHEN_running_interlock_scenario_THEN_hv_on_rejected_and_trip_detected(self):
+        self.addCleanup(self._lewis.backdoor_run_function_on_device, "stop_scenario")
+
+        self._lewis.backdoor_run_function_on_device(
+            "start_scenario", ["interlock_then_trip", SCENARIO_FILE]
+        )
+        self._wait_for_pv("VOLT", 2000.0)
+        self._wait_for_pv("CURR_TRIPPED", expected_alarm=self.ca.Alarms.MAJOR)
+        self._lewis.assert_that_emulator_value_is("scenario_running", "False")
+        self._lewis.assert_that_emulator_value_is("scenario_changes_made", "7")
 
     @skip_if_recsim("Testing disconnection not possible in recsim")
     def test_WHEN_device_disconnected_THEN_all_pvs_in_alarm(self):
         self.ca.assert_that_pv_alarm_is("IDN", self.ca.Alarms.NONE)
 
         with self._lewis.backdoor_simulate_disconnected_device():
-            self.ca.assert_that_pv_alarm_is("VOLT", self.ca.Alarms.INVALID)
-            self.ca.assert_that_pv_alarm_is("CURR", self.ca.Alarms.INVALID)
-            self.ca.set_pv_value(
-                "STATUS.PROC", 1
-            )  # Force processing so we don't have to wait 1 second
-            self.ca.assert_that_pv_alarm_is("STATUS", self.ca.Alarms.INVALID)
+            self._wait_for_pv("VOLT", expected_alarm=self.ca.Alarms.INVALID)
+            self._wait_for_pv("CURR", expected_alarm=self.ca.Alarms.INVALID)
+            self._wait_for_pv("STATUS", expected_alarm=self.ca.Alarms.INVALID)
 
-        self.ca.assert_that_pv_alarm_is("IDN", self.ca.Alarms.NONE)
+        self._wait_for_pv("IDN", expected_alarm=self.ca.Alarms.NONE)